@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from answer_cache import context_key
+from rag_executor import RagOverloadedError
+from text_utils import hash_text
+
+# Конфигурация (можно переопределить через .env)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+LLM_MAX_QUEUED = int(os.getenv("LLM_MAX_QUEUED", "32"))
+# Вопросов в минуту на пользователя и допустимая серия подряд
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "6"))
+USER_RATE_BURST = int(os.getenv("USER_RATE_BURST", "3"))
+
+# Число пользователей, после которого из памяти удаляются полные корзины
+_RATE_LIMITER_PRUNE_SIZE = 10000
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """Списание токена; возвращает 0 или время (сек) до появления токена"""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate else float("inf")
+
+    @property
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class UserRateLimiter:
+    """Ограничение частоты вопросов каждого пользователя"""
+
+    def __init__(self, per_minute: float = USER_RATE_PER_MINUTE, burst: int = USER_RATE_BURST):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self._buckets: Dict[int, TokenBucket] = {}
+
+    def acquire(self, user_id: int) -> float:
+        """0, если вопрос можно обрабатывать, иначе сколько секунд подождать"""
+        if self.rate <= 0:
+            return 0.0
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= _RATE_LIMITER_PRUNE_SIZE:
+                # Полная корзина ничем не отличается от новой
+                self._buckets = {uid: b for uid, b in self._buckets.items() if not b.full}
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket.acquire()
+
+
+class AdmissionController:
+    """
+    Глобальное ограничение одновременных вызовов LLM.
+
+    Сверх max_in_flight запросы ждут в очереди FIFO и узнают свою позицию;
+    при заполненной очереди выбрасывается RagOverloadedError.
+    """
+
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT, max_queued: int = LLM_MAX_QUEUED):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, on_queued: Optional[Callable[[int], Awaitable]] = None):
+        """Место для вызова LLM; on_queued(позиция) вызывается, если пришлось встать в очередь"""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+        else:
+            if len(self._waiters) >= self.max_queued:
+                raise RagOverloadedError(f"Очередь к LLM заполнена ({self.max_queued})")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                if on_queued is not None:
+                    await on_queued(len(self._waiters))
+                # Место передаётся ожидающему освобождающим запросом
+                await waiter
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                else:
+                    self._waiters.remove(waiter)
+                raise
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вызовов.
+
+    Пока вызов с ключом key выполняется, повторные вызовы с тем же ключом
+    не запускают его заново, а ждут результата первого.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def run(self, key: str, func: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """Результат вызова и признак того, что он получен от другого запроса"""
+        future = self._calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Исключение получат ожидающие; без них оно не должно попадать в лог asyncio
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+
+def coalescing_key(question: str, docs: Sequence[Document], chat_history: Sequence = ()) -> str:
+    """
+    Ключ объединения: нормализованный вопрос, найденный контекст и история.
+
+    Ответ зависит от истории диалога, поэтому запросы с разной историей
+    не объединяются: иначе один пользователь получил бы ответ, построенный
+    по чужой переписке.
+    """
+    key = f"{hash_text(question)}:{context_key(docs)}"
+    if chat_history:
+        history = "\n".join(f"{getattr(message, 'type', '')}:{getattr(message, 'content', '')}"
+                            for message in chat_history)
+        key += ":" + hashlib.sha256(history.encode()).hexdigest()
+    return key
@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+from text_utils import hash_text
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация кэша (можно переопределить через .env)
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "./answer_cache.sqlite3")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+
+
+def chunk_id(doc: Document) -> str:
+    """Идентификатор чанка: id из Chroma или хэш нормализованного текста (как в ingest.py)"""
+    if getattr(doc, "id", None):
+        return str(doc.id)
+    return hash_text(doc.page_content)
+
+
+def context_key(docs: Sequence[Document]) -> str:
+    """Ключ найденного контекста (не зависит от порядка чанков)"""
+    ids = sorted(chunk_id(doc) for doc in docs)
+    return hashlib.sha256("|".join(ids).encode()).hexdigest()
+
+
+def cosine_similarity(a: Sequence[float], b: Sequence[float]) -> float:
+    """Косинусное сходство двух векторов"""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class _Entry:
+    __slots__ = ("entry_id", "context_key", "embedding", "answer", "created_at")
+
+    def __init__(self, entry_id: int, context_key: str, embedding: array, answer: str, created_at: float):
+        self.entry_id = entry_id
+        self.context_key = context_key
+        self.embedding = embedding
+        self.answer = answer
+        self.created_at = created_at
+
+
+class AnswerCache:
+    """
+    Семантический кэш ответов.
+
+    Ответ берётся из кэша, если найденный контекст (набор id чанков) совпадает,
+    а косинусное сходство эмбеддингов вопросов не ниже threshold.
+    Записи хранятся в SQLite и переживают перезапуск; в памяти держится
+    LRU из max_entries записей с TTL. Записи относятся к версии индекса
+    index_version: кэш видит только свои записи и не трогает чужие, поэтому
+    процессы на разных версиях (во время переключения) делят одну базу.
+    Записи старых версий удаляются по TTL.
+    """
+
+    def __init__(
+            self,
+            index_version: str,
+            path: str = ANSWER_CACHE_PATH,
+            threshold: float = ANSWER_CACHE_THRESHOLD,
+            ttl: float = ANSWER_CACHE_TTL,
+            max_entries: int = ANSWER_CACHE_SIZE,
+    ):
+        self.index_version = index_version
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._by_context: Dict[str, List[_Entry]] = {}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                index_version TEXT NOT NULL,
+                context_key TEXT NOT NULL,
+                question TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers (context_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_version ON answers (index_version, created_at)")
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """Загрузка актуальных записей с диска"""
+        # Устаревают записи любых версий; записи других версий индекса не загружаются
+        deleted = self._conn.execute(
+            "DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl,)
+        ).rowcount
+        self._conn.commit()
+        if deleted:
+            logger.info(f"Кэш ответов: удалено {deleted} устаревших записей")
+
+        rows = self._conn.execute(
+            "SELECT id, context_key, embedding, answer, created_at FROM answers "
+            "WHERE index_version = ? ORDER BY created_at DESC LIMIT ?",
+            (self.index_version, self.max_entries),
+        ).fetchall()
+        for entry_id, key, blob, answer, created_at in reversed(rows):
+            self._add(_Entry(entry_id, key, array("f", blob), answer, created_at))
+        logger.info(f"Кэш ответов: загружено {len(self._lru)} записей")
+
+    def _add(self, entry: _Entry):
+        self._lru[entry.entry_id] = entry
+        self._by_context.setdefault(entry.context_key, []).append(entry)
+
+    def _remove(self, entry: _Entry):
+        self._lru.pop(entry.entry_id, None)
+        entries = self._by_context.get(entry.context_key, [])
+        if entry in entries:
+            entries.remove(entry)
+        if not entries:
+            self._by_context.pop(entry.context_key, None)
+        self._conn.execute("DELETE FROM answers WHERE id = ?", (entry.entry_id,))
+
+    def lookup(self, embedding: Sequence[float], docs: Sequence[Document]) -> Optional[str]:
+        """Поиск ответа для вопроса с данным эмбеддингом и найденным контекстом"""
+        key = context_key(docs)
+        now = time.time()
+        with self._lock:
+            best, best_score = None, self.threshold
+            expired = False
+            for entry in list(self._by_context.get(key, [])):
+                if now - entry.created_at > self.ttl:
+                    self._remove(entry)
+                    expired = True
+                    continue
+                score = cosine_similarity(embedding, entry.embedding)
+                if score >= best_score:
+                    best, best_score = entry, score
+            if expired:
+                self._conn.commit()
+
+            if best is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._lru.move_to_end(best.entry_id)
+            return best.answer
+
+    def store(self, question: str, embedding: Sequence[float], docs: Sequence[Document], answer: str):
+        """Сохранение ответа в кэш"""
+        key = context_key(docs)
+        vector = array("f", embedding)
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (index_version, context_key, question, embedding, answer, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.index_version, key, question, vector.tobytes(), answer, now),
+            )
+            self._add(_Entry(cursor.lastrowid, key, vector, answer, now))
+
+            # Вытеснение самых давно использованных записей
+            while len(self._lru) > self.max_entries:
+                _, oldest = next(iter(self._lru.items()))
+                self._remove(oldest)
+                self.evictions += 1
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        """Счётчики попаданий и промахов"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,233 @@
+"""
+Офлайн-бенчмарк загрузки и поиска.
+
+Прогоняет PDF из knowledge_base через этапы ingest.py и поиск RAG-конвейера
+с детерминированными заглушками вместо Ollama и GigaChat, поэтому не требует
+сети. Результаты пишутся в JSON и могут сравниваться с предыдущим запуском:
+
+    python benchmark.py --output bench_results.json
+    python benchmark.py --compare bench_results.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake import FakeListLLM
+
+import ingest
+from bm25_index import BM25_INDEX_FILE, BM25Index
+from custom_gigachat import SYSTEM_PROMPT, create_document_chain
+from prompt_builder import PromptBuilder
+from query_router import ROUTER_FILE, QueryRouter
+from rag_pipeline import RagPipeline
+from retrievers import HybridRetriever, NumpyVectorRetriever, RoutedRetriever, VectorRetriever
+from vector_index import VECTOR_INDEX_FILE, VectorIndex
+
+# Вопросы для замера поиска
+BENCH_QUESTIONS = [
+    "Какая неустойка положена за просрочку выплаты по ОСАГО?",
+    "Что говорит статья 18 закона о защите прав потребителей?",
+    "Как вернуть товар ненадлежащего качества?",
+    "Какие сроки исковой давности установлены Гражданским кодексом?",
+    "Кто отвечает за вред, причинённый пассажиру воздушного судна?",
+    "Как оформить наследство по завещанию?",
+    "Какие права есть у потребителя при нарушении сроков выполнения работ?",
+    "Что такое страховой случай по договору обязательного страхования?",
+    "В каком порядке заключается договор купли-продажи недвижимости?",
+    "Какая ответственность перевозчика за утрату багажа?",
+]
+
+# Метрики, для которых рост означает улучшение; для остальных — ухудшение
+HIGHER_IS_BETTER = {"pages_per_s", "chunks_per_s"}
+
+EMBEDDING_SIZE = 768
+
+
+class CountingFakeEmbeddings(DeterministicFakeEmbedding):
+    """Детерминированные эмбеддинги со счётчиком вызовов"""
+    calls: int = 0
+    texts: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        self.texts += 1
+        return super().embed_query(text)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0..100) методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса и его дочерних процессов (пул разбора PDF), МБ"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # В Linux ru_maxrss в килобайтах, в macOS — в байтах
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return max(own, children) / divisor
+
+
+def run_benchmark(data_path: str, num_queries: int, workdir: str) -> Dict:
+    """Замер этапов загрузки, индексации и поиска"""
+    ingest.DATA_PATH = data_path
+    index_path = os.path.join(workdir, "chroma")
+    ingest.PAGE_CACHE_PATH = os.path.join(workdir, "page_cache")
+    ingest.global_unique_hashes.clear()
+
+    embedder = CountingFakeEmbeddings(size=EMBEDDING_SIZE)
+    metrics: Dict[str, float] = {}
+
+    # Вывод ingest.py не мешает отчёту, но его стоимость входит в замеры
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        pages = list(ingest.load_documents())
+        metrics["load_s"] = time.perf_counter() - start
+    if not pages:
+        raise SystemExit(f"В {data_path} не найдено PDF-документов")
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for page in pages:
+            ingest.clean_legal_text(page.page_content)
+        metrics["clean_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chunks = ingest.split_text(pages)
+        metrics["split_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ingest.save_to_chroma(chunks, index_path, embedding_function=embedder)
+        metrics["index_build_s"] = time.perf_counter() - start
+
+    metrics["pages"] = len(pages)
+    metrics["chunks"] = len(chunks)
+    metrics["pages_per_s"] = len(pages) / metrics["load_s"] if metrics["load_s"] else 0.0
+    metrics["chunks_per_s"] = len(chunks) / metrics["split_s"] if metrics["split_s"] else 0.0
+    metrics["ingest_embedding_calls"] = embedder.calls
+
+    # Поиск через тот же RAG-конвейер, что и в боте
+    db = Chroma(persist_directory=index_path, embedding_function=embedder)
+    retriever = VectorRetriever(db)
+    if os.path.exists(os.path.join(index_path, VECTOR_INDEX_FILE)):
+        retriever = NumpyVectorRetriever(VectorIndex.load(index_path))
+    bm25_path = os.path.join(index_path, BM25_INDEX_FILE)
+    if os.path.exists(bm25_path):
+        retriever = HybridRetriever(db, BM25Index.load(bm25_path), vector_retriever=retriever)
+    router_path = os.path.join(index_path, ROUTER_FILE)
+    if os.path.exists(router_path):
+        retriever = RoutedRetriever(retriever, QueryRouter.load(router_path))
+
+    llm = FakeListLLM(responses=["Ответ для бенчмарка."])
+    pipeline = RagPipeline(db, create_document_chain(llm), index_path,
+                           retriever=retriever, prompt_builder=PromptBuilder(SYSTEM_PROMPT))
+
+    questions = [BENCH_QUESTIONS[i % len(BENCH_QUESTIONS)] for i in range(num_queries)]
+    calls_before = embedder.calls
+
+    search_latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        pipeline.retrieve(question)
+        search_latencies.append((time.perf_counter() - start) * 1000)
+
+    answer_latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        pipeline.answer(question, [])
+        answer_latencies.append((time.perf_counter() - start) * 1000)
+
+    metrics["query_embedding_calls"] = embedder.calls - calls_before
+    metrics["search_p50_ms"] = percentile(search_latencies, 50)
+    metrics["search_p99_ms"] = percentile(search_latencies, 99)
+    metrics["answer_p50_ms"] = percentile(answer_latencies, 50)
+    metrics["answer_p99_ms"] = percentile(answer_latencies, 99)
+    metrics["peak_rss_mb"] = peak_rss_mb()
+    return metrics
+
+
+def compare_results(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Сравнение с предыдущим запуском, возвращает список регрессий"""
+    regressions = []
+    print(f"\n{'Метрика':<24}{'Было':>14}{'Стало':>14}{'Изм.':>10}")
+    for name, new_value in current["metrics"].items():
+        old_value = baseline.get("metrics", {}).get(name)
+        if old_value is None:
+            continue
+        change = (new_value - old_value) / old_value if old_value else 0.0
+        worse = -change if name in HIGHER_IS_BETTER else change
+        mark = ""
+        if name not in ("pages", "chunks") and worse > tolerance:
+            regressions.append(name)
+            mark = "  ⚠️"
+        print(f"{name:<24}{old_value:>14.3f}{new_value:>14.3f}{change:>+10.1%}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк ingest и поиска")
+    parser.add_argument("--data", default=ingest.DATA_PATH, help="папка с PDF")
+    parser.add_argument("--queries", type=int, default=200, help="число поисковых запросов")
+    parser.add_argument("--output", default="bench_results.json", help="файл для результатов")
+    parser.add_argument("--compare", help="файл результатов предыдущего запуска")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение (доля)")
+    parser.add_argument("--workdir", help="рабочий каталог (по умолчанию временный)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    try:
+        metrics = run_benchmark(args.data, args.queries, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "queries": args.queries,
+        },
+        "metrics": metrics,
+    }
+
+    for name, value in metrics.items():
+        print(f"{name:<24}{value:>14.3f}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare_results(result, json.load(f), args.tolerance)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {args.output}")
+
+    if regressions:
+        print(f"Регрессии: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
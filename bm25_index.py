@@ -0,0 +1,158 @@
+import heapq
+import math
+import os
+import pickle
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from text_store import MetadataStore, TextStore, TextStoreWriter
+from text_utils import tokenize
+
+# Файл лексического индекса внутри каталога Chroma
+BM25_INDEX_FILE = "bm25.pkl"
+
+# Версия формата файла; при несовпадении индекс нужно пересобрать
+_FORMAT_VERSION = 2
+
+
+class BM25Index:
+    """
+    Инвертированный индекс BM25 по чанкам с русской токенизацией и стеммингом.
+
+    Хранит тексты и метаданные чанков, поэтому найденный только лексически
+    чанк можно вернуть без обращения к Chroma.
+    """
+
+    def __init__(self, ids: List[str], texts: List[str], metadatas: List[Dict],
+                 postings: Dict[str, Tuple[List[int], List[int]]], doc_lengths: List[int],
+                 k1: float = 1.5, b: float = 0.75):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        num_docs = len(ids)
+        avg_length = sum(doc_lengths) / num_docs if num_docs else 0.0
+        # IDF термов и нормировка длины документов считаются один раз
+        self.idf = {
+            term: math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, (docs, _) in postings.items()
+        }
+        self._length_norm = [
+            k1 * (1 - b + b * length / avg_length) if avg_length else k1
+            for length in doc_lengths
+        ]
+        # Номера чанков для фильтров по метаданным, строятся по запросу
+        self._filter_cache: Dict[tuple, set] = {}
+
+    @classmethod
+    def build(cls, ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[Optional[Dict]]) -> "BM25Index":
+        """Построение индекса по чанкам"""
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        doc_lengths = [_add_postings(postings, doc_index, text) for doc_index, text in enumerate(texts)]
+        return cls(list(ids), list(texts), [metadata or {} for metadata in metadatas], postings, doc_lengths)
+
+    @classmethod
+    def write(cls, path: str, chunks: Iterable[Tuple[str, str, Optional[Dict]]]) -> "BM25Index":
+        """
+        Потоковое построение индекса в файле path по кортежам (id, текст, метаданные).
+
+        Тексты и метаданные чанков сразу пишутся на диск, в памяти остаются
+        только идентификаторы и словарь термов. Возвращает загруженный индекс.
+        """
+        ids: List[str] = []
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        doc_lengths: List[int] = []
+        prefix = os.path.splitext(path)[0]
+        with TextStoreWriter(prefix + "_texts") as texts, TextStoreWriter(prefix + "_metadata") as metadatas:
+            for doc_index, (chunk_id, text, metadata) in enumerate(chunks):
+                ids.append(chunk_id)
+                doc_lengths.append(_add_postings(postings, doc_index, text))
+                texts.append(text)
+                metadatas.append(MetadataStore.encode(metadata or {}))
+        index = cls(ids, [], [], postings, doc_lengths)
+        index._dump(path)
+        return cls.load(path)
+
+    def search(self, query: str, k: int = 20, where: Optional[Dict[str, set]] = None) -> List[Tuple[int, float]]:
+        """
+        Топ-k чанков по BM25: список (номер чанка, оценка).
+
+        where — допустимые значения полей метаданных, например {"source": {...}}.
+        """
+        allowed = self._allowed(where) if where else None
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            idf = self.idf[term]
+            for doc_index, tf in zip(*posting):
+                if allowed is not None and doc_index not in allowed:
+                    continue
+                score = idf * tf * (self.k1 + 1) / (tf + self._length_norm[doc_index])
+                scores[doc_index] = scores.get(doc_index, 0.0) + score
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def _allowed(self, where: Dict[str, set]) -> set:
+        """Номера чанков, метаданные которых проходят фильтр where"""
+        key = tuple(sorted((field, frozenset(values)) for field, values in where.items()))
+        allowed = self._filter_cache.get(key)
+        if allowed is None:
+            allowed = {
+                doc_index for doc_index, metadata in enumerate(self.metadatas)
+                if all(metadata.get(field) in values for field, values in where.items())
+            }
+            self._filter_cache[key] = allowed
+        return allowed
+
+    def save(self, path: str):
+        """Сохранение индекса (через временные файлы)"""
+        # Тексты и метаданные — рядом, в файлах, отображаемых в память
+        prefix = os.path.splitext(path)[0]
+        TextStore.write(prefix + "_texts", self.texts)
+        MetadataStore.write(prefix + "_metadata", self.metadatas)
+        self._dump(path)
+
+    def _dump(self, path: str):
+        """Запись идентификаторов и словаря термов (тексты уже записаны)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "version": _FORMAT_VERSION,
+                "ids": self.ids,
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths,
+                "k1": self.k1,
+                "b": self.b,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Загрузка индекса, построенного ingest.py; тексты и метаданные отображаются в память"""
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") != _FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия индекса BM25 в {path}, пересоберите индекс")
+        prefix = os.path.splitext(path)[0]
+        texts = TextStore.load(prefix + "_texts")
+        metadatas = MetadataStore.load(prefix + "_metadata")
+        if len(texts) != len(data["ids"]) or len(metadatas) != len(data["ids"]):
+            raise ValueError(f"Индекс BM25 в {path} повреждён, пересоберите индекс")
+        return cls(data["ids"], texts, metadatas, data["postings"],
+                   data["doc_lengths"], k1=data["k1"], b=data["b"])
+
+
+def _add_postings(postings: Dict[str, Tuple[List[int], List[int]]], doc_index: int, text: str) -> int:
+    """Добавление термов чанка в инвертированный индекс; возвращает длину чанка в токенах"""
+    tokens = tokenize(text)
+    for term, tf in Counter(tokens).items():
+        docs, freqs = postings.setdefault(term, ([], []))
+        docs.append(doc_index)
+        freqs.append(tf)
+    return len(tokens)
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from session_store import SESSION_DB_PATH
+
+# Как часто Application сохраняет изменившиеся состояния диалогов (сек)
+BOT_STATE_UPDATE_INTERVAL = float(os.getenv("BOT_STATE_UPDATE_INTERVAL", "1.0"))
+
+
+class SqliteConversationPersistence(BasePersistence):
+    """
+    Состояния ConversationHandler в общей с историей базе SQLite.
+
+    Хранятся только состояния диалогов (user_data, chat_data и bot_data
+    бот не использует), поэтому перезапущенный или другой процесс бота
+    продолжает диалог пользователя с того же шага.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, update_interval: float = BOT_STATE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Состояние меняется на каждом шаге диалога: fsync только при контрольной точке WAL
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                name TEXT NOT NULL,
+                conversation_key TEXT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (name, conversation_key)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+
+    async def get_conversations(self, name: str) -> Dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT conversation_key, state FROM conversations WHERE name = ?", (name,)
+            ).fetchall()
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key, new_state: Optional[object]) -> None:
+        # Запись в SQLite выполняется вне event loop
+        await asyncio.to_thread(self._write_conversation, name, key, new_state)
+
+    def _write_conversation(self, name: str, key, new_state: Optional[object]):
+        with self._lock:
+            if new_state is None:
+                self._conn.execute(
+                    "DELETE FROM conversations WHERE name = ? AND conversation_key = ?",
+                    (name, json.dumps(key)),
+                )
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO conversations (name, conversation_key, state) VALUES (?, ?, ?)",
+                    (name, json.dumps(key), json.dumps(new_state)),
+                )
+            self._conn.commit()
+
+    async def get_user_data(self) -> Dict:
+        return {}
+
+    async def get_chat_data(self) -> Dict:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,219 @@
+import os
+import pickle
+import re
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from text_store import MetadataStore, TextStore
+from text_utils import tokenize
+
+# Файл индекса ссылок на статьи и главы внутри каталога Chroma
+CITATION_INDEX_FILE = "citations.pkl"
+# Прямой поиск статей и глав, явно названных в вопросе; 0 — всегда векторный поиск
+CITATION_LOOKUP_ENABLED = os.getenv("CITATION_LOOKUP_ENABLED", "1") == "1"
+# Глава длиннее этого числа чанков не отдаётся целиком (не уместится в промпт) — ищется векторным поиском
+CITATION_CHAPTER_MAX_CHUNKS = int(os.getenv("CITATION_CHAPTER_MAX_CHUNKS", "12"))
+
+# Версия формата файла; при несовпадении индекс нужно пересобрать
+_FORMAT_VERSION = 2
+
+ARTICLE = "Статья"
+CHAPTER = "Глава"
+
+# Заголовок в тексте закона: «Статья 7.1. Объекты…», «Глава II. Условия…»
+# (редакционные пометки вида «Статья 4 изменена…» заголовками не считаются)
+_HEADER_RE = re.compile(r'(?:^|\n)[ \t]*(Статья|Глава)\s+(\d+(?:\.\d+)*|[IVXLCDM]+)\.\s')
+# Ссылка в вопросе: «статья 18», «статьи 18 и 19», «ст. 10», «главе IV», «гл. 2»
+_CITATION_RE = re.compile(
+    r'(?<!\w)(стать[яиеюёй]\w*|ст\.|глав[аыеуо]\w*|гл\.)\s*'
+    r'((?:\d+(?:\.\d+)*|(?-i:[IVXLCDM]+))(?:\s*(?:,|и)\s*(?:\d+(?:\.\d+)*|(?-i:[IVXLCDM]+)))*)(?!\w)',
+    re.IGNORECASE
+)
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)*|[IVXLCDM]+')
+# Дата и номер в названии файла закона не помогают узнать закон в вопросе
+_TITLE_NOISE_RE = re.compile(r'\bот\s+\d+\s+\w+\s+\d{4}\s*г\b|\bN\s+\d+(?:\s+[IVXФЗ]+)*\b')
+
+_ROMAN = {"I": 1, "V": 5, "X": 10, "L": 50, "C": 100, "D": 500, "M": 1000}
+
+
+def roman_to_int(numeral: str) -> int:
+    total = 0
+    for char, next_char in zip(numeral, numeral[1:] + " "):
+        value = _ROMAN[char]
+        total += -value if _ROMAN.get(next_char, 0) > value else value
+    return total
+
+
+def section_label(kind: str, number: str) -> str:
+    """Единая запись номера: главы с римскими и арабскими номерами совпадают («Глава 2»)"""
+    if not number[0].isdigit():
+        number = str(roman_to_int(number))
+    return f"{kind} {number}"
+
+
+def title_terms(source: str) -> List[str]:
+    """Стеммы названия закона из имени файла (без даты и номера)"""
+    title = os.path.splitext(os.path.basename(source))[0].replace("_", " ")
+    return [term for term in tokenize(_TITLE_NOISE_RE.sub(" ", title)) if not term.isdigit()]
+
+
+def parse_citations(question: str) -> List[str]:
+    """Статьи и главы, явно названные в вопросе, в порядке упоминания"""
+    labels = []
+    for word, numbers in _CITATION_RE.findall(question):
+        kind = ARTICLE if word.lower().startswith("ст") else CHAPTER
+        for number in _NUMBER_RE.findall(numbers):
+            # Римские цифры — только номера глав
+            if kind == CHAPTER or number[0].isdigit():
+                label = section_label(kind, number)
+                if label not in labels:
+                    labels.append(label)
+    return labels
+
+
+class CitationIndex:
+    """
+    Индекс ссылок вида (закон, статья или глава) → чанки в порядке текста.
+
+    Вопрос с явной ссылкой («что говорит статья 18 закона о защите прав
+    потребителей») обслуживается поиском в словаре, без эмбеддинга и
+    векторного поиска. Закон определяется по словам из его названия,
+    а если закон не назван и статья с таким номером есть только в одном
+    законе — по ней. Главы длиннее chapter_max_chunks чанков остаются
+    векторному поиску.
+    """
+
+    def __init__(self, ids: List[str], texts: List[str], metadatas: List[Dict],
+                 sections: Dict[Tuple[str, str], List[int]], law_terms: Dict[str, List[str]],
+                 chapter_max_chunks: int = CITATION_CHAPTER_MAX_CHUNKS):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        # (источник, «Статья 18») -> номера чанков в порядке текста
+        self.sections = sections
+        # Источник -> стеммы названия, которых нет в названиях других законов
+        self.law_terms = law_terms
+        self.chapter_max_chunks = chapter_max_chunks
+
+    @classmethod
+    def build(cls, files: Mapping[str, Sequence[str]], chunks: Mapping[str, Tuple[str, Dict]]) -> "CitationIndex":
+        """
+        Построение по упорядоченным спискам чанков файлов (как в манифесте ingest.py).
+
+        Статья чанка определяется по заголовкам заново, с переносом между
+        страницами: чанк относится к статье, действующей на его начало
+        (если до первого заголовка в нём есть текст), и ко всем статьям,
+        заголовки которых в нём встречаются. Чанк может
+        стоять в списке другого файла (вместо объединённого с ним
+        почти-дубликата) — тогда источником считается этот файл.
+        """
+        ids, texts, metadatas = [], [], []
+        sections: Dict[Tuple[str, str], List[int]] = {}
+        for source, chunk_ids in files.items():
+            current: Dict[str, str] = {}
+            for chunk_id in chunk_ids:
+                if chunk_id not in chunks:
+                    continue
+                text, metadata = chunks[chunk_id]
+                headers = list(_HEADER_RE.finditer(text))
+                # Статью заканчивает заголовок любой статьи или главы, главу — только заголовок главы
+                ends = {
+                    ARTICLE: headers[0].start() if headers else len(text),
+                    CHAPTER: next((h.start() for h in headers if h.group(1) == CHAPTER), len(text)),
+                }
+                labels = [label for kind, label in current.items() if text[:ends[kind]].strip()]
+                for header in headers:
+                    kind = header.group(1)
+                    current[kind] = section_label(kind, header.group(2))
+                    labels.append(current[kind])
+                if not labels:
+                    continue
+                row = len(ids)
+                ids.append(chunk_id)
+                texts.append(text)
+                metadatas.append({**(metadata or {}), "source": source})
+                for label in dict.fromkeys(labels):
+                    sections.setdefault((source, label), []).append(row)
+
+        terms = {source: set(title_terms(source)) for source in files}
+        law_terms = {
+            source: sorted(own - set().union(*(other for name, other in terms.items() if name != source)))
+            for source, own in terms.items()
+        }
+        return cls(ids, texts, metadatas, sections, law_terms)
+
+    def resolve_law(self, question: str, labels: Iterable[str]) -> Optional[str]:
+        """
+        Закон, к которому относятся ссылки вопроса, или None, если он неоднозначен.
+
+        Закон, названный в вопросе, важнее наличия статьи: «статья 1000
+        закона о защите прав потребителей» не должна отвечаться статьёй
+        1000 другого закона, даже если такая статья есть только там.
+        """
+        labels = list(labels)
+        question_terms = set(tokenize(question))
+        scores = {law: len(question_terms.intersection(terms)) for law, terms in self.law_terms.items()}
+        best = max(scores.values(), default=0)
+        # Названных законов нет — кандидаты все законы
+        laws = [law for law in self.law_terms if scores[law] == best]
+        if best and len(laws) == 1:
+            return laws[0]
+        laws = [law for law in laws if any((law, label) in self.sections for label in labels)]
+        return laws[0] if len(laws) == 1 else None
+
+    def lookup(self, question: str) -> List[Document]:
+        """Чанки статей и глав из вопроса в порядке текста; пустой список — ссылок нет"""
+        labels = parse_citations(question)
+        if not labels:
+            return []
+        law = self.resolve_law(question, labels)
+        if law is None:
+            return []
+        for label in labels:
+            if label.startswith(CHAPTER) and len(self.sections.get((law, label), ())) > self.chapter_max_chunks:
+                return []
+
+        docs = []
+        seen = set()
+        for label in labels:
+            for row in self.sections.get((law, label), ()):
+                if row in seen:
+                    continue
+                seen.add(row)
+                metadata = dict(self.metadatas[row])
+                if label.startswith(ARTICLE):
+                    # PromptBuilder склеивает чанки одной статьи в один фрагмент
+                    metadata["article"] = label
+                docs.append(Document(id=self.ids[row], page_content=self.texts[row], metadata=metadata))
+        return docs
+
+    def save(self, path: str):
+        """Сохранение индекса (через временный файл)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "version": _FORMAT_VERSION,
+                "ids": self.ids,
+                "sections": self.sections,
+                "law_terms": self.law_terms,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Тексты и метаданные — рядом, в файлах, отображаемых в память
+        prefix = os.path.splitext(path)[0]
+        TextStore.write(prefix + "_texts", self.texts)
+        MetadataStore.write(prefix + "_metadata", self.metadatas)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CitationIndex":
+        """Загрузка индекса, построенного ingest.py; тексты и метаданные отображаются в память"""
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") != _FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия индекса ссылок в {path}, пересоберите индекс")
+        prefix = os.path.splitext(path)[0]
+        texts = TextStore.load(prefix + "_texts")
+        metadatas = MetadataStore.load(prefix + "_metadata")
+        if len(texts) != len(data["ids"]) or len(metadatas) != len(data["ids"]):
+            raise ValueError(f"Индекс ссылок в {path} повреждён, пересоберите индекс")
+        return cls(data["ids"], texts, metadatas, data["sections"], data["law_terms"])
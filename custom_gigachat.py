@@ -1,14 +1,29 @@
 from langchain_chroma import Chroma
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_community.llms import GigaChat
 from langchain_ollama import OllamaEmbeddings  # Убедитесь, что установлен langchain-ollama
 from urllib3.exceptions import InsecureRequestWarning
-from langchain_core.documents import Document
+import argparse
+import json
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 import warnings
 import ssl
+from answer_cache import AnswerCache, chunk_id
+from gigachat_auth import ManagedTokenGigaChat, get_token_manager
+from bm25_index import BM25_INDEX_FILE, BM25Index
+from citation_index import CITATION_INDEX_FILE, CITATION_LOOKUP_ENABLED, CitationIndex
+from embedding_batcher import BatchingEmbeddings
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from index_version import read_index_version, resolve_index_path
+from metrics import span
+from prompt_builder import PromptBuilder
+from query_router import ROUTER_ENABLED, ROUTER_FILE, QueryRouter
+from rag_pipeline import RagPipeline
+from retrievers import HybridRetriever, NumpyVectorRetriever, RoutedRetriever, VectorRetriever
+from vector_index import VECTOR_INDEX_FILE, VectorIndex
 
 # Отключаем предупреждения SSL
 warnings.filterwarnings("ignore", category=InsecureRequestWarning)
@@ -16,38 +31,19 @@ ssl._create_default_https_context = ssl._create_unverified_context
 
 load_dotenv()
 
-CHROMA_PATH = "./db_metadata_v5"
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "1") == "1"
+VECTOR_INDEX_ENABLED = os.getenv("VECTOR_INDEX_ENABLED", "1") == "1"
+# Токены промпта считает токенизатор GigaChat (запрос к API для ещё не посчитанных текстов;
+# по умолчанию — приближённая оценка без запроса)
+MODEL_TOKEN_COUNT = os.getenv("MODEL_TOKEN_COUNT", "0") == "1"
+# Пакетный режим: одновременно обрабатываемые вопросы, повторы при ошибке и пауза перед первым повтором (сек)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_RETRIES = int(os.getenv("BATCH_RETRIES", "3"))
+BATCH_RETRY_DELAY = float(os.getenv("BATCH_RETRY_DELAY", "2.0"))
 
-
-def initialize_rag():
-    print("Инициализация RAG-ассистента...")
-
-    # Получаем ключ авторизации из переменных окружения
-    authorization_key = os.getenv("GIGACHAT_AUTHORIZATION_KEY")
-    if not authorization_key:
-        raise ValueError("Не задана переменная GIGACHAT_AUTHORIZATION_KEY в .env файле")
-
-    # Инициализируем LLM модель GigaChat
-    model = GigaChat(
-        model="GigaChat",
-        credentials=authorization_key,
-        verify_ssl_certs=False,
-        timeout=120,
-        profanity_check=False,
-        scope="GIGACHAT_API_PERS"
-    )
-
-    # Изменено: Используем nomic-embed-text через Ollama
-    embedding_function = OllamaEmbeddings(model="nomic-embed-text")
-
-    # Загружаем Chroma
-    db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_function)
-
-    # Шаблон prompt'а для RAG
-    prompt_template = ChatPromptTemplate.from_messages([
-        (
-            "system",
-            """
+# Системный prompt для RAG
+SYSTEM_PROMPT = """
     Вы — профессиональный юрист-консультант под именем «Юридический Ассистент».
 
     Ваша задача — давать точные, обоснованные и формально-деловые ответы на основе законодательства Российской Федерации (Воздушный_кодекс_Российской_Федерации_от_19_марта_1997_г_N_60_ФЗ, Гражданский_кодекс_Российской_Федерации_ГК_РФ_части_первая_вторая, Закон_РФ_от_7_февраля_1992_г_N_2300_I_О_защите_прав_потребителей, Федеральный_закон_от_25_апреля_2002_г_N_40_ФЗ_Об_обязательном_страховании), строго в пределах предоставленного контекста.
@@ -65,20 +61,259 @@ def initialize_rag():
     📚 Контекст:
     {context}
             """
-        ),
+
+
+def initialize_rag(persist_directory):
+    print("Инициализация RAG-ассистента...")
+
+    # Получаем ключ авторизации из переменных окружения
+    authorization_key = os.getenv("GIGACHAT_AUTHORIZATION_KEY")
+    if not authorization_key:
+        raise ValueError("Не задана переменная GIGACHAT_AUTHORIZATION_KEY в .env файле")
+
+    # Инициализируем LLM модель GigaChat: токен получает и заранее обновляет
+    # общий для процесса GigaChatTokenManager (по пуловой сессии requests)
+    with span("init_gigachat"):
+        token_manager = get_token_manager()
+        token_manager.start()
+        model = ManagedTokenGigaChat(
+            model="GigaChat",
+            token_manager=token_manager,
+            verify_ssl_certs=False,
+            timeout=120,
+            profanity_check=False
+        )
+
+    # Изменено: Используем nomic-embed-text через Ollama (с общим с ingest.py кэшем,
+    # одновременные запросы пользователей отправляются в Ollama пакетами)
+    with span("init_embeddings"):
+        embedding_function = CachedEmbeddings(
+            BatchingEmbeddings(OllamaEmbeddings(model="nomic-embed-text")),
+            EmbeddingCache(),
+            model_name="nomic-embed-text"
+        )
+
+    # Загружаем Chroma
+    with span("init_chroma"):
+        db = Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+
+    return db, create_document_chain(model), model
+
+
+def create_document_chain(model):
+    """Цепочка, подставляющая найденные документы и историю в prompt для LLM"""
+    # Шаблон prompt'а для RAG
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
         MessagesPlaceholder(variable_name="chat_history"),
         ("human", "{question}")
     ])
 
     # Создаём цепочку для комбинирования документов и LLM
-    document_chain = create_stuff_documents_chain(llm=model, prompt=prompt_template)
+    return create_stuff_documents_chain(llm=model, prompt=prompt_template)
+
+
+def initialize_pipeline(persist_directory=None, use_answer_cache=ANSWER_CACHE_ENABLED):
+    """Создание RAG-конвейера с семантическим кэшем ответов (по умолчанию — по активной версии индекса)"""
+    persist_directory = persist_directory or resolve_index_path()
+    print(f"📂 Индекс: {persist_directory}")
+    db, document_chain, model = initialize_rag(persist_directory)
 
-    return db, document_chain
+    answer_cache = None
+    if use_answer_cache:
+        answer_cache = AnswerCache(index_version=read_index_version(persist_directory))
+
+    # Гибридный поиск доступен, если ingest.py построил лексический индекс
+    # Точный поиск по матрице эмбеддингов, если ingest.py её выгрузил
+    retriever = VectorRetriever(db)
+    if VECTOR_INDEX_ENABLED and os.path.exists(os.path.join(persist_directory, VECTOR_INDEX_FILE)):
+        retriever = NumpyVectorRetriever(VectorIndex.load(persist_directory))
+        index = retriever.index
+        print(f"🧮 Векторный индекс: {len(index.ids)} чанков, квантование: {index.quantization}")
+
+    bm25_path = os.path.join(persist_directory, BM25_INDEX_FILE)
+    if HYBRID_SEARCH_ENABLED and os.path.exists(bm25_path):
+        retriever = HybridRetriever(db, BM25Index.load(bm25_path), vector_retriever=retriever)
+        print(f"🔤 Гибридный поиск: загружен BM25-индекс ({len(retriever.lexical_index.ids)} чанков)")
+
+    # Поиск только в законах, к которым относится вопрос (при сомнениях — по всем)
+    router_path = os.path.join(persist_directory, ROUTER_FILE)
+    if ROUTER_ENABLED and os.path.exists(router_path):
+        retriever = RoutedRetriever(retriever, QueryRouter.load(router_path))
+        print(f"🧭 Маршрутизация вопросов: {len(retriever.router.names)} разделов")
+
+    # Вопросы со ссылкой на статью или главу закона — прямой поиск без эмбеддинга
+    citation_index = None
+    citation_path = os.path.join(persist_directory, CITATION_INDEX_FILE)
+    if CITATION_LOOKUP_ENABLED and os.path.exists(citation_path):
+        citation_index = CitationIndex.load(citation_path)
+        print(f"📑 Прямой поиск статей: {len(citation_index.sections)} статей и глав")
+
+    # Контекст и история укладываются в бюджет токенов PROMPT_TOKEN_BUDGET
+    prompt_builder = PromptBuilder(system_prompt=SYSTEM_PROMPT,
+                                   count_tokens=model.count_tokens if MODEL_TOKEN_COUNT else None)
+
+    return RagPipeline(db, document_chain, persist_directory, answer_cache=answer_cache,
+                       retriever=retriever, prompt_builder=prompt_builder, citation_index=citation_index)
+
+
+def load_completed_ids(output_path):
+    """id вопросов, ответы на которые уже записаны в output_path (для продолжения после сбоя)"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    # Файл читается побайтно: оборванная при сбое строка может кончаться посреди символа UTF-8
+    with open(output_path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            # Строка, которая не является объектом JSON, пропускается так же, как оборванная
+            if isinstance(record, dict) and "answer" in record and "id" in record:
+                completed.add(str(record["id"]))
+    return completed
+
+
+def read_batch_items(input_path, skip_ids, id_field="id", question_field="question"):
+    """Потоковое чтение вопросов из JSONL; без поля id идентификатором служит номер строки"""
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                print(f"⚠️ Строка {line_number}: некорректный JSON ({e}), пропущена")
+                continue
+            if not isinstance(record, dict):
+                print(f"⚠️ Строка {line_number}: некорректный JSON (ожидался объект), пропущена")
+                continue
+            question = record.get(question_field)
+            if not question:
+                print(f"⚠️ Строка {line_number}: нет поля {question_field!r}, пропущена")
+                continue
+            item_id = str(record.get(id_field, line_number))
+            if item_id not in skip_ids:
+                yield item_id, question
+
+
+def answer_item(pipeline, item_id, question, retries=BATCH_RETRIES, retry_delay=BATCH_RETRY_DELAY):
+    """Ответ на один вопрос с повторами при ошибке; возвращает запись для выходного JSONL"""
+    record = {"id": item_id, "question": question}
+    start = time.perf_counter()
+    error = None
+    for attempt in range(1, retries + 2):
+        try:
+            retrieve_start = time.perf_counter()
+            embedding, docs = pipeline.retrieve(question)
+            generate_start = time.perf_counter()
+            answer = "".join(pipeline.generate(question, [], embedding, docs))
+            finish = time.perf_counter()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if attempt <= retries:
+                time.sleep(retry_delay * 2 ** (attempt - 1))
+            continue
+
+        record.update(
+            answer=answer,
+            # Вычисленный id важнее поля id в метаданных чанка
+            chunks=[{**doc.metadata, "id": chunk_id(doc)} for doc in docs],
+            attempts=attempt,
+            timings={
+                "retrieve_s": round(generate_start - retrieve_start, 3),
+                "generate_s": round(finish - generate_start, 3),
+                "total_s": round(finish - start, 3),
+            },
+        )
+        return record
+
+    record.update(error=error, attempts=retries + 1, timings={"total_s": round(time.perf_counter() - start, 3)})
+    return record
+
+
+def run_batch(pipeline, input_path, output_path, concurrency=BATCH_CONCURRENCY, retries=BATCH_RETRIES):
+    """
+    Пакетные ответы на вопросы из JSONL-файла.
+
+    Вопросы читаются потоково, одновременно обрабатывается не больше
+    concurrency, результаты дописываются в output_path по мере готовности.
+    Вопросы, ответы на которые уже есть в output_path, пропускаются,
+    поэтому прерванный запуск можно просто повторить.
+    """
+    completed = load_completed_ids(output_path)
+    if completed:
+        print(f"⏩ Уже отвечено: {len(completed)}, эти вопросы пропускаются")
+
+    # Последняя строка прерванного запуска могла остаться незавершённой
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    else:
+        needs_newline = False
+
+    items = read_batch_items(input_path, completed)
+    answered = failed = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            open(output_path, "a", encoding="utf-8") as output:
+        if needs_newline:
+            output.write("\n")
+        in_flight = set()
+
+        def submit_tasks():
+            # Очередь задач ограничена, поэтому файл вопросов может быть сколь угодно большим
+            while len(in_flight) < concurrency * 2:
+                item = next(items, None)
+                if item is None:
+                    return
+                in_flight.add(executor.submit(answer_item, pipeline, *item, retries=retries))
+
+        submit_tasks()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                in_flight.remove(future)
+                record = future.result()
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                if "answer" in record:
+                    answered += 1
+                else:
+                    failed += 1
+                    print(f"❌ {record['id']}: {record['error']}")
+                if (answered + failed) % 10 == 0:
+                    print(f"⏳ Обработано {answered + failed} вопросов за {time.perf_counter() - start:.0f} сек")
+            submit_tasks()
+
+    print(f"✅ Готово: {answered} ответов, {failed} ошибок за {time.perf_counter() - start:.1f} сек → {output_path}")
+    return answered, failed
 
 
 def main():
+    parser = argparse.ArgumentParser(description="RAG-ассистент: интерактивный или пакетный режим")
+    parser.add_argument("--batch", metavar="QUESTIONS_JSONL",
+                        help="файл вопросов JSONL (поля id и question) для пакетного режима")
+    parser.add_argument("--output", default="answers.jsonl", help="файл ответов JSONL")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="вопросов одновременно")
+    parser.add_argument("--retries", type=int, default=BATCH_RETRIES, help="повторов при ошибке")
+    parser.add_argument("--no-cache", action="store_true", help="не использовать кэш ответов")
+    args = parser.parse_args()
+
+    if args.batch:
+        # С --no-cache кэш ответов не открывается вовсе
+        pipeline = initialize_pipeline(use_answer_cache=ANSWER_CACHE_ENABLED and not args.no_cache)
+        try:
+            run_batch(pipeline, args.batch, args.output, concurrency=args.concurrency, retries=args.retries)
+        finally:
+            pipeline.close()
+        return
+
     try:
-        db, document_chain = initialize_rag()
+        pipeline = initialize_pipeline()
+        db = pipeline.db
 
         docs = db.get()
         num_docs = len(docs['documents']) if 'documents' in docs else 0
@@ -99,20 +334,8 @@ def main():
             if not user_input:
                 continue
 
-            results = db.similarity_search(user_input, k=3)
-            documents = [
-                Document(page_content=doc.page_content, metadata=doc.metadata)
-                for doc in results
-            ]
-
-            inputs = {
-                "question": user_input,
-                "context": documents,
-                "chat_history": chat_history
-            }
-
             try:
-                answer = document_chain.invoke(inputs)
+                answer = pipeline.answer(user_input, chat_history)
                 chat_history.append({"role": "human", "content": user_input})
                 chat_history.append({"role": "assistant", "content": answer})
 
@@ -0,0 +1,136 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Параметры пакетирования запросов (можно переопределить через .env)
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_INGEST_BATCH = int(os.getenv("EMBED_INGEST_BATCH", "64"))
+EMBED_INGEST_CONCURRENCY = int(os.getenv("EMBED_INGEST_CONCURRENCY", "2"))
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Пакетирование запросов к модели эмбеддингов.
+
+    embed_query из разных потоков собираются в течение window_ms (но не
+    больше max_batch штук) и отправляются одним вызовом embed_documents;
+    векторы возвращаются ожидающим вызывающим. embed_documents режет
+    тексты на пакеты по batch_size и отправляет до concurrency пакетов
+    одновременно. Окно и размеры пакетов задают баланс задержки и
+    пропускной способности.
+    """
+
+    def __init__(
+            self,
+            embeddings: Embeddings,
+            window_ms: float = EMBED_BATCH_WINDOW_MS,
+            max_batch: int = EMBED_BATCH_MAX,
+            batch_size: int = EMBED_INGEST_BATCH,
+            concurrency: int = EMBED_INGEST_CONCURRENCY,
+    ):
+        self.embeddings = embeddings
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+        # Статистика для подбора параметров
+        self.batches = 0
+        self.batched_queries = 0
+
+        # Очередь запросов; None — сигнал остановки потока пакетирования
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self._closed = False
+
+    def _batch_loop(self):
+        stopping = False
+        while not stopping:
+            # Ждём первый запрос, затем добираем пакет в пределах окна
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Запросы, пришедшие до close(), обрабатываются
+                    stopping = True
+                    break
+                batch.append(item)
+
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                if len(vectors) != len(batch):
+                    # Без проверки запросы без вектора ждали бы результата вечно
+                    raise ValueError(f"Модель вернула {len(vectors)} векторов для {len(batch)} текстов")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.batched_queries += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def embed_query(self, text: str) -> List[float]:
+        future: Future = Future()
+        with self._worker_lock:
+            # После close() сигнал остановки уже в очереди, запрос в неё не ставится
+            queued = not self._closed
+            if queued:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._batch_loop, name="embed-batcher", daemon=True)
+                    self._worker.start()
+                self._queue.put((text, future))
+        if not queued:
+            return self.embeddings.embed_query(text)
+        return future.result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1 or self.concurrency <= 1:
+            return [vector for batch in batches for vector in self.embeddings.embed_documents(batch)]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed-ingest") as executor:
+            results = executor.map(self.embeddings.embed_documents, batches)
+            return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def close(self):
+        """Остановка потока пакетирования; после неё запросы идут в модель по одному"""
+        with self._worker_lock:
+            if self._closed:
+                return
+            self._closed = True
+            worker = self._worker
+            if worker is not None:
+                self._queue.put(None)
+        if worker is not None:
+            worker.join()
+
+    def stats(self):
+        """Средний размер пакета запросов"""
+        return {
+            "batches": self.batches,
+            "queries": self.batched_queries,
+            "avg_batch": self.batched_queries / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import CACHE_HITS, CACHE_MISSES
+from text_utils import hash_text
+
+# Общий для ingest.py и бота файл кэша (можно переопределить через .env)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")
+
+# Ограничение SQLite на число параметров в одном запросе
+_SQLITE_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Постоянный кэш эмбеддингов в SQLite.
+
+    Ключ — (модель, SHA-256 нормализованного текста), значение — вектор float32.
+    Сами тексты в кэш не пишутся.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, text_hashes: Iterable[str]) -> Dict[str, List[float]]:
+        """Поиск векторов по хэшам текстов"""
+        hashes = list(dict.fromkeys(text_hashes))
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), _SQLITE_BATCH):
+                batch = hashes[i:i + _SQLITE_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    (model, *batch),
+                )
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]):
+        """Сохранение векторов"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                ((model, text_hash, array("f", vector).tobytes()) for text_hash, vector in vectors.items()),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обёртка над функцией эмбеддингов: в модель уходят только промахи кэша.
+
+    Эмбеддинги документов (чанков) и вопросов хранятся в постоянном кэше
+    по хэшу текста; текст вопроса на диск не попадает. Вопросы лежат под
+    отдельным ключом модели: эмбеддинг вопроса может отличаться от
+    эмбеддинга документа с тем же текстом.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model_name: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+        self.query_model_name = f"{model_name}:query"
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [hash_text(text) for text in texts]
+        vectors = self.cache.get_many(self.model_name, hashes)
+
+        # Уникальные тексты, которых нет в кэше
+        missing: Dict[str, str] = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in vectors and text_hash not in missing:
+                missing[text_hash] = text
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        CACHE_HITS.inc(len(texts) - len(missing), cache="embedding")
+        CACHE_MISSES.inc(len(missing), cache="embedding")
+
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), computed))
+            self.cache.put_many(self.model_name, new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        text_hash = hash_text(text)
+        cached: Optional[List[float]] = self.cache.get_many(self.query_model_name, [text_hash]).get(text_hash)
+        if cached is not None:
+            self.hits += 1
+            CACHE_HITS.inc(cache="embedding")
+            return cached
+
+        self.misses += 1
+        CACHE_MISSES.inc(cache="embedding")
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many(self.query_model_name, {text_hash: vector})
+        return vector
+
+    def close(self):
+        """Закрытие кэша и обёрнутой функции эмбеддингов (поток пакетирования)"""
+        self.cache.close()
+        close = getattr(self.embeddings, "close", None)
+        if close is not None:
+            close()
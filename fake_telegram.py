@@ -0,0 +1,173 @@
+"""
+Локальная проверка режима webhook без Telegram.
+
+Поднимает поддельный сервер Bot API, который принимает ответы бота, и
+отправляет в роутер webhook.py обновления от нескольких пользователей:
+
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081 python webhook.py --workers 2
+    python fake_telegram.py --api-port 8081 --users 20 --questions 3
+
+В конце печатается, сколько ответов получил каждый пользователь.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "RAG-Assistant", "username": "rag_assistant_bot"}
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _parse_parameters(body: bytes, content_type: str) -> Dict:
+    """Параметры запроса Bot API: значения закодированы в JSON, строки — как есть"""
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    parameters = {}
+    for key, value in parse_qsl(body.decode("utf-8")):
+        try:
+            parameters[key] = json.loads(value)
+        except ValueError:
+            parameters[key] = value
+    return parameters
+
+
+def bot_api_result(method: str, parameters: Dict):
+    """Ответ Bot API на вызов метода: отправленные и изменённые сообщения возвращаются как есть"""
+    if method == "getMe":
+        return BOT_USER
+    if method in ("sendMessage", "editMessageText"):
+        return {
+            "message_id": parameters.get("message_id") or next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(parameters["chat_id"]), "type": "private"},
+            "from": BOT_USER,
+            "text": parameters["text"],
+        }
+    return True
+
+
+class FakeBotApi:
+    """Поддельный сервер Bot API: запоминает отправленные ботом сообщения"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081):
+        self.calls: List[Dict] = []
+        self.replies: Dict[int, List[str]] = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                parameters = _parse_parameters(body, self.headers.get("Content-Type", ""))
+                result = api.handle(method, parameters)
+                payload = json.dumps({"ok": True, "result": result}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, method: str, parameters: Dict):
+        with self._lock:
+            self.calls.append({"method": method, **parameters})
+            if method == "sendMessage":
+                self.replies.setdefault(int(parameters["chat_id"]), []).append(parameters["text"])
+            return bot_api_result(method, parameters)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-bot-api", daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def make_update(user_id: int, text: str) -> Dict:
+    """Обновление Telegram с текстовым сообщением пользователя"""
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def send_update(url: str, update: Dict, secret: Optional[str] = None, retries: int = 30) -> int:
+    """Отправка обновления в webhook; при 503 повторяет, как Telegram"""
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    body = json.dumps(update).encode("utf-8")
+    for _ in range(retries):
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, body, headers), timeout=30) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            if e.code != 503:
+                return e.code
+        except urllib.error.URLError:
+            pass
+        time.sleep(1)
+    return 503
+
+
+def run_user(url: str, user_id: int, questions: List[str], secret: Optional[str] = None, delay: float = 0.2):
+    """Диалог одного пользователя: /start, начало консультации и вопросы"""
+    for text in ["/start", "📢 Начать консультацию", *questions]:
+        send_update(url, make_update(user_id, text), secret)
+        time.sleep(delay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поддельные обновления Telegram для режима webhook")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram", help="адрес роутера webhook")
+    parser.add_argument("--secret", default=None, help="WEBHOOK_SECRET роутера")
+    parser.add_argument("--api-port", type=int, default=8081, help="порт поддельного Bot API")
+    parser.add_argument("--users", type=int, default=10, help="число пользователей")
+    parser.add_argument("--questions", type=int, default=2, help="вопросов на пользователя")
+    parser.add_argument("--wait", type=float, default=10, help="ожидание ответов после отправки (сек)")
+    args = parser.parse_args()
+
+    api = FakeBotApi(port=args.api_port)
+    api.start()
+
+    questions = [f"Вопрос {i + 1}: как вернуть товар ненадлежащего качества?" for i in range(args.questions)]
+    user_ids = [100000 + i for i in range(args.users)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        for user_id in user_ids:
+            executor.submit(run_user, args.url, user_id, questions, args.secret)
+    time.sleep(args.wait)
+
+    expected = 2 + args.questions
+    answered = sum(1 for user_id in user_ids if len(api.replies.get(user_id, [])) >= expected)
+    print(f"Отправлено {len(user_ids) * expected} обновлений за {time.perf_counter() - start:.1f} сек")
+    print(f"Пользователей с ответами на все сообщения: {answered} из {len(user_ids)}")
+    for user_id in user_ids[:3]:
+        print(f"  {user_id}: {[reply[:40] for reply in api.replies.get(user_id, [])]}")
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,227 @@
+import logging
 import requests
+import threading
+import time
 import uuid
 import os
+from typing import Any, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 import warnings
 
+from gigachat.context import authorization_cvar
+from langchain_community.llms import GigaChat
+from langchain_core.outputs import GenerationChunk, LLMResult
+from requests.adapters import HTTPAdapter
 from urllib3.exceptions import InsecureRequestWarning
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Конфигурация из переменных окружения (AUTH_URL можно направить на локальную заглушку)
+AUTH_URL = os.getenv("GIGACHAT_AUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+SCOPE = os.getenv("GIGACHAT_SCOPE", "GIGACHAT_API_PERS")
+# За сколько секунд до истечения токен обновляется в фоне
+TOKEN_REFRESH_MARGIN = float(os.getenv("GIGACHAT_TOKEN_REFRESH_MARGIN", "120"))
+# Пауза перед повторной попыткой фонового обновления после ошибки (сек)
+TOKEN_RETRY_DELAY = float(os.getenv("GIGACHAT_TOKEN_RETRY_DELAY", "5"))
+HTTP_POOL_SIZE = int(os.getenv("GIGACHAT_HTTP_POOL_SIZE", "10"))
+
 
 class GigaChatAuthError(Exception):
     """Кастомное исключение для ошибок аутентификации GigaChat"""
     pass
 
 
+def create_session(pool_size: int = HTTP_POOL_SIZE, verify: bool = False) -> requests.Session:
+    """HTTP-сессия с пулом keep-alive соединений для запросов к GigaChat"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.verify = verify
+    return session
+
+
+class GigaChatTokenManager:
+    """
+    Кэширующий менеджер access token GigaChat.
+
+    Токен хранится вместе со сроком действия и обновляется заранее
+    (за refresh_margin секунд) в фоновом потоке. Одновременные вызовы
+    get_token при отсутствии действующего токена выполняют один общий
+    запрос (single-flight). Все запросы идут через одну пуловую сессию.
+    """
+
+    def __init__(
+            self,
+            authorization_key: Optional[str] = None,
+            auth_url: str = AUTH_URL,
+            scope: str = SCOPE,
+            session: Optional[requests.Session] = None,
+            refresh_margin: float = TOKEN_REFRESH_MARGIN,
+            retry_delay: float = TOKEN_RETRY_DELAY,
+    ):
+        self.authorization_key = authorization_key or os.getenv("GIGACHAT_AUTHORIZATION_KEY")
+        self.auth_url = auth_url
+        self.scope = scope
+        self.session = session or create_session()
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    def _is_fresh(self) -> bool:
+        return self._token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    def _fetch_token(self) -> Tuple[str, float]:
+        """Запрос нового токена, возвращает (токен, время истечения в секундах)"""
+        if not self.authorization_key:
+            raise GigaChatAuthError("Не задан GIGACHAT_AUTHORIZATION_KEY в .env файле")
+
+        # Формируем заголовки запроса
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Accept": "application/json",
+            "RqUID": str(uuid.uuid4()),
+            "Authorization": f"Basic {self.authorization_key.strip()}",
+        }
+
+        try:
+            # Отключаем предупреждения SSL для тестовой среды
+            warnings.filterwarnings("ignore", category=InsecureRequestWarning)
+
+            response = self.session.post(self.auth_url, headers=headers, data={"scope": self.scope}, timeout=10)
+
+            if response.status_code == 200:
+                try:
+                    payload = response.json()
+                    # expires_at приходит в миллисекундах
+                    return payload["access_token"], float(payload["expires_at"]) / 1000
+                except (ValueError, KeyError, TypeError) as e:
+                    raise GigaChatAuthError(f"Некорректный ответ сервера авторизации: {response.text[:200]}") from e
+            else:
+                error_msg = f"Ошибка аутентификации. Код: {response.status_code}. Ответ: {response.text}"
+                raise GigaChatAuthError(error_msg)
+
+        except requests.exceptions.RequestException as e:
+            raise GigaChatAuthError(f"Ошибка подключения к API: {str(e)}")
+
+    def refresh(self) -> str:
+        """Принудительное обновление токена"""
+        with self._refresh_lock:
+            self._token, self._expires_at = self._fetch_token()
+            return self._token
+
+    def get_token(self) -> str:
+        """
+        Действующий access token
+
+        Raises:
+            GigaChatAuthError: Если не удалось получить токен
+        """
+        token = self._token
+        if self._is_fresh():
+            return token
+
+        with self._refresh_lock:
+            # Токен мог обновить другой поток, пока мы ждали блокировку
+            if not self._is_fresh():
+                self._token, self._expires_at = self._fetch_token()
+            return self._token
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            delay = max(1.0, self._expires_at - self.refresh_margin - time.time())
+            if self._stop.wait(delay):
+                return
+            try:
+                self.refresh()
+            except GigaChatAuthError as e:
+                # Повторяем попытку, старый токен ещё действует
+                logger.warning(f"Не удалось обновить токен GigaChat: {e}")
+                self._stop.wait(self.retry_delay)
+            except Exception:
+                # Непредвиденная ошибка не должна останавливать фоновое обновление
+                logger.exception("Сбой фонового обновления токена GigaChat")
+                self._stop.wait(self.retry_delay)
+
+    def start(self):
+        """Получение токена и запуск фонового обновления"""
+        self.get_token()
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="gigachat-token", daemon=True)
+            self._refresher.start()
+
+    def stop(self):
+        """Остановка фонового обновления"""
+        self._stop.set()
+        if self._refresher is not None:
+            self._refresher.join()
+            self._refresher = None
+        self.session.close()
+
+
+_default_manager: Optional[GigaChatTokenManager] = None
+_default_manager_lock = threading.Lock()
+
+
+def get_token_manager() -> GigaChatTokenManager:
+    """Общий для процесса менеджер токенов"""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = GigaChatTokenManager()
+        return _default_manager
+
+
 def get_gigachat_token() -> str:
     """
     Получает access token для работы с GigaChat API
 
     Returns:
-        str: Access token
+        str: Access token (из кэша, пока он действителен)
 
     Raises:
         GigaChatAuthError: Если не удалось получить токен
     """
-    # Конфигурация из переменных окружения
-    AUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-    AUTHORIZATION_KEY = os.getenv("GIGACHAT_AUTHORIZATION_KEY")
+    return get_token_manager().get_token()
 
-    if not AUTHORIZATION_KEY:
-        raise GigaChatAuthError("Не задан GIGACHAT_AUTHORIZATION_KEY в .env файле")
 
-    # Формируем заголовки запроса
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Accept": "application/json",
-        "RqUID": str(uuid.uuid4()),
-        "Authorization": f"Basic {AUTHORIZATION_KEY.strip()}",
-    }
+class ManagedTokenGigaChat(GigaChat):
+    """
+    LLM GigaChat с токеном из GigaChatTokenManager.
 
-    # Тело запроса
-    data = {"scope": "GIGACHAT_API_PERS"}
+    Перед каждым запросом заголовок Authorization передаётся клиенту
+    GigaChat через authorization_cvar, поэтому собственный OAuth клиента
+    не используется: токен берётся из кэша менеджера и обновляется его
+    фоновым потоком заранее, до истечения срока.
+    """
 
-    try:
-        # Отключаем предупреждения SSL для тестовой среды
-        warnings.filterwarnings("ignore", category=InsecureRequestWarning)
+    token_manager: Any = None
+
+    def _authorize(self):
+        manager = self.token_manager or get_token_manager()
+        authorization_cvar.set(f"Bearer {manager.get_token()}")
 
-        # Отправляем запрос на получение токена
-        response = requests.post(
-            AUTH_URL,
-            headers=headers,
-            data=data,
-            verify=False,
-            timeout=10
-        )
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        self._authorize()
+        yield from super()._stream(prompt, stop=stop, run_manager=run_manager, **kwargs)
 
-        if response.status_code == 200:
-            return response.json()["access_token"]
-        else:
-            error_msg = f"Ошибка аутентификации. Код: {response.status_code}. Ответ: {response.text}"
-            raise GigaChatAuthError(error_msg)
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None, run_manager=None,
+                  stream: Optional[bool] = None, **kwargs: Any) -> LLMResult:
+        self._authorize()
+        return super()._generate(prompts, stop=stop, run_manager=run_manager, stream=stream, **kwargs)
 
-    except requests.exceptions.RequestException as e:
-        raise GigaChatAuthError(f"Ошибка подключения к API: {str(e)}")
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Число токенов каждого текста по токенизатору модели (один запрос к API)"""
+        self._authorize()
+        return [item.tokens for item in self.tokens_count(list(texts), model=self.model)]
 
 
 if __name__ == "__main__":
@@ -71,4 +230,4 @@ if __name__ == "__main__":
         print("Токен успешно получен!")
         print(f"Access token: {token[:15]}...")
     except GigaChatAuthError as e:
-        print(f"Ошибка: {str(e)}")
\ No newline at end of file
+        print(f"Ошибка: {str(e)}")
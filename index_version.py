@@ -0,0 +1,100 @@
+import os
+import shutil
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+# Файл-маркер версии индекса внутри каталога Chroma
+INDEX_VERSION_FILE = "index_version"
+# Каталог версий индекса: каждая сборка ingest.py — в своём подкаталоге <INDEX_ROOT>/<версия>,
+# активная версия записана в файле-указателе CURRENT
+INDEX_ROOT = os.getenv("INDEX_ROOT", "./indexes")
+CURRENT_FILE = "CURRENT"
+# Каталог индекса до перехода на версии (используется, пока не опубликована первая версия)
+LEGACY_INDEX_PATH = "./db_metadata_v5"
+# Сколько опубликованных версий хранить: активную и предыдущие (для запросов, начатых до переключения, и отката)
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "2"))
+
+
+def new_index_version() -> str:
+    """Имя новой версии; версии упорядочены по времени сборки"""
+    return f"{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+
+
+def write_index_version(persist_directory: str, version: Optional[str] = None) -> str:
+    """Записывает новую версию индекса после его (пере)сборки"""
+    version = version or new_index_version()
+    with open(os.path.join(persist_directory, INDEX_VERSION_FILE), "w", encoding="utf-8") as f:
+        f.write(version)
+    return version
+
+
+def read_index_version(persist_directory: str) -> str:
+    """Возвращает текущую версию индекса или 'unknown', если маркера нет"""
+    try:
+        with open(os.path.join(persist_directory, INDEX_VERSION_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def current_version(root: str = INDEX_ROOT) -> Optional[str]:
+    """Опубликованная (активная) версия индекса или None"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def version_path(version: Optional[str], root: str = INDEX_ROOT) -> str:
+    """Каталог версии индекса (None — индекс до перехода на версии, LEGACY_INDEX_PATH)"""
+    return os.path.join(root, version) if version else LEGACY_INDEX_PATH
+
+
+def resolve_index_path(root: str = INDEX_ROOT) -> str:
+    """Каталог активной версии индекса (до первой публикации — LEGACY_INDEX_PATH)"""
+    return version_path(current_version(root), root)
+
+
+def create_version_directory(root: str = INDEX_ROOT) -> Tuple[str, str]:
+    """Пустой каталог для сборки новой версии, возвращает (версия, путь)"""
+    version = new_index_version()
+    path = os.path.join(root, version)
+    os.makedirs(path)
+    return version, path
+
+
+def publish_version(version: str, root: str = INDEX_ROOT):
+    """Атомарное переключение указателя CURRENT на собранную и проверенную версию"""
+    pointer_path = os.path.join(root, CURRENT_FILE)
+    tmp_path = pointer_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_path, pointer_path)
+
+
+def list_versions(root: str = INDEX_ROOT) -> List[str]:
+    """Все каталоги версий, от старых к новым"""
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def remove_old_versions(root: str = INDEX_ROOT, keep: int = INDEX_KEEP_VERSIONS) -> List[str]:
+    """
+    Удаление старых версий индекса, возвращает удалённые версии.
+
+    Остаются активная версия и keep - 1 предшествующих ей: бот переходит
+    на новую версию не мгновенно, а запросы, начатые до переключения,
+    дочитывают старую. Версии новее активной не удаляются — это может
+    быть сборка, которая идёт прямо сейчас.
+    """
+    current = current_version(root)
+    if current is None:
+        return []
+    older = [version for version in list_versions(root) if version < current]
+    stale = older[:max(len(older) - max(keep - 1, 0), 0)]
+    for version in stale:
+        shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+    return stale
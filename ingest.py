@@ -1,15 +1,45 @@
+import argparse
 import hashlib
+import json
 import os
 import shutil
 import re
-from langchain_community.document_loaders import PyPDFLoader
+import time
+from collections import deque
+from itertools import islice
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 from langchain_community.vectorstores import Chroma
 from langchain_ollama import OllamaEmbeddings
+from bm25_index import BM25_INDEX_FILE, BM25Index
+from citation_index import CITATION_INDEX_FILE, CitationIndex
+from embedding_batcher import BatchingEmbeddings
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from index_version import (INDEX_ROOT, create_version_directory, publish_version, remove_old_versions,
+                           resolve_index_path, write_index_version)
+from near_dedup import NEAR_DUP_SIGNATURES_FILE, NEAR_DUP_THRESHOLD, NearDuplicateIndex
+from query_router import ROUTER_FILE, QueryRouter
+from vector_index import PARTITION_KEY, VECTOR_INDEX_FILE, VectorIndex
+from text_utils import hash_text
 
-CHROMA_PATH = "./db_metadata_v5"
 DATA_PATH = "./knowledge_base"  # Папка с PDF файлами
+MANIFEST_FILE = "manifest.json"  # Хэши файлов и чанков внутри каталога версии индекса
+PAGE_CACHE_PATH = "./page_cache"  # Извлечённый текст страниц по хэшу PDF
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "50"))
+# Ограничение числа диапазонов страниц, извлекаемых одновременно
+MAX_TASKS_IN_FLIGHT = int(os.getenv("INGEST_TASKS_IN_FLIGHT", str(INGEST_WORKERS * 2)))
+# Размер пакета чанков, эмбеддинги которого считаются и записываются в Chroma за раз
+WRITE_BATCH = int(os.getenv("INGEST_WRITE_BATCH", "256"))
+# Размер страницы коллекции при выгрузке чанков в индексы версии
+FINALIZE_PAGE_SIZE = int(os.getenv("INGEST_FINALIZE_PAGE_SIZE", "1000"))
+# Интервал вывода прогресса (сек)
+PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", "5"))
+# Пробный вопрос для проверки собранной версии перед публикацией
+SMOKE_QUERY = os.getenv("INDEX_SMOKE_QUERY", "Какие права есть у потребителя?")
 global_unique_hashes = set()
 
 
@@ -21,58 +51,204 @@ def walk_through_files(path, file_extension='.pdf'):
                 yield os.path.join(dir_path, filename)
 
 
-def load_documents():
-    """Загрузка PDF-документов"""
-    documents = []
-    for file_path in walk_through_files(DATA_PATH, '.pdf'):
-        try:
-            print(f"[INFO] Загрузка {file_path}")
-            loader = PyPDFLoader(file_path)
-            pdf_pages = loader.load()
-            documents.extend(pdf_pages)
-        except Exception as e:
-            print(f"[ERROR] Не удалось загрузить {file_path}: {e}")
-    return documents
+def hash_file(file_path):
+    """SHA-256 хэш содержимого файла"""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def extract_pages(file_path, start, stop):
+    """Извлечение текста страниц [start, stop) из PDF (выполняется в дочернем процессе)"""
+    reader = PdfReader(file_path)
+    total_pages = len(reader.pages)
+    return [
+        {
+            "page_content": reader.pages[page].extract_text(),
+            "metadata": {"source": file_path, "page": page, "total_pages": total_pages},
+        }
+        for page in range(start, min(stop, total_pages))
+    ]
 
 
-def normalize_text(text):
-    """Нормализация текста для дедупликации"""
-    # Удаление лишних пробелов и специальных символов
-    text = re.sub(r'\s+', ' ', text)
-    # Приведение к нижнему регистру и удаление специальных символов
-    return re.sub(r'[^\w]', '', text.lower())
+def page_cache_path(file_hash):
+    """Путь к кэшу страниц PDF с данным хэшем"""
+    return os.path.join(PAGE_CACHE_PATH, f"{file_hash}.json")
 
 
-def hash_text(text):
-    """SHA-256 хэширование текста с нормализацией"""
-    normalized = normalize_text(text)
-    return hashlib.sha256(normalized.encode()).hexdigest()
+def load_page_cache(file_hash):
+    """Страницы PDF из кэша (None, если файл ещё не разбирался)"""
+    cache_path = page_cache_path(file_hash)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[WARN] Повреждён кэш страниц {cache_path}: {e}")
+        return None
+
+
+def save_page_cache(file_hash, pages):
+    """Сохранение извлечённых страниц PDF в кэш"""
+    os.makedirs(PAGE_CACHE_PATH, exist_ok=True)
+    cache_path = page_cache_path(file_hash)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(pages, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+
+
+def load_documents(file_paths=None, file_hashes=None, failed_files: Optional[set] = None):
+    """
+    Потоковая загрузка PDF-документов (по умолчанию всех из DATA_PATH).
+
+    Страницы извлекаются в пуле процессов диапазонами по PAGES_PER_TASK
+    и отдаются по порядку, как только извлечён весь файл. В работе
+    одновременно не больше MAX_TASKS_IN_FLIGHT диапазонов, поэтому память
+    ограничена размером одного файла, а не корпуса. Текст страниц
+    кэшируется по хэшу файла, поэтому неизменённые PDF повторно не
+    разбираются; при повреждённом кэше PDF разбирается заново.
+    Файл, который не удалось разобрать, пропускается целиком
+    и добавляется в failed_files.
+    """
+    if file_paths is None:
+        file_paths = list(walk_through_files(DATA_PATH, '.pdf'))
+    if file_hashes is None:
+        file_hashes = {path: hash_file(path) for path in file_paths}
+    if failed_files is None:
+        failed_files = set()
+
+    with ProcessPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        # Диапазоны страниц незакэшированных файлов в порядке обработки
+        ranges = []
+        for file_path in file_paths:
+            if os.path.exists(page_cache_path(file_hashes[file_path])):
+                continue
+            try:
+                total_pages = len(PdfReader(file_path).pages)
+                ranges.extend((file_path, start) for start in range(0, total_pages, PAGES_PER_TASK))
+            except Exception as e:
+                print(f"[ERROR] Не удалось загрузить {file_path}: {e}")
+                failed_files.add(file_path)
+
+        pending_ranges = iter(ranges)
+        in_flight = deque()
+
+        def submit_tasks():
+            while len(in_flight) < MAX_TASKS_IN_FLIGHT:
+                item = next(pending_ranges, None)
+                if item is None:
+                    return
+                path, start = item
+                in_flight.append((path, executor.submit(extract_pages, path, start, start + PAGES_PER_TASK)))
+
+        submit_tasks()
+        extracted_files = {path for path, _ in ranges}
+
+        for file_path in file_paths:
+            if file_path in failed_files:
+                continue
+
+            if file_path not in extracted_files:
+                pages = load_page_cache(file_hashes[file_path])
+                if pages is not None:
+                    print(f"[INFO] {file_path}: {len(pages)} страниц из кэша")
+                else:
+                    # Кэш повреждён или удалён: файл разбирается заново в этом процессе
+                    print(f"[INFO] Загрузка {file_path} (кэш страниц недоступен)")
+                    try:
+                        pages = extract_pages(file_path, 0, len(PdfReader(file_path).pages))
+                    except Exception as e:
+                        print(f"[ERROR] Не удалось загрузить {file_path}: {e}")
+                        failed_files.add(file_path)
+                        continue
+                    save_page_cache(file_hashes[file_path], pages)
+            else:
+                print(f"[INFO] Загрузка {file_path}")
+                pages = []
+                failed = False
+                while in_flight and in_flight[0][0] == file_path:
+                    _, future = in_flight.popleft()
+                    submit_tasks()
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if not failed:
+                            print(f"[ERROR] Не удалось загрузить {file_path}: {e}")
+                        failed = True
+                    if not failed:
+                        pages.extend(result)
+                if failed:
+                    # Частично извлечённый файл не индексируется
+                    failed_files.add(file_path)
+                    continue
+                save_page_cache(file_hashes[file_path], pages)
+
+            for page in pages:
+                yield Document(page_content=page["page_content"], metadata=page["metadata"])
+
+
+# Служебные комментарии и ссылки на законы удаляются до конца строки
+_SERVICE_COMMENT_PATTERNS = [
+    re.compile(r'См\.[^\n]*(?:\n|$)'),
+    re.compile(r'Информация об изменениях:[^\n]*(?:\n|$)'),
+    re.compile(r'в редакции[^\n]*(?:\n|$)'),
+    re.compile(r'вступил[а-я]* в силу[^\n]*(?:\n|$)'),
+    re.compile(r'Федеральным законом от\s+[^.]*\s+в\s+(?:пункт|статью)[^\n]*(?:\n|$)'),
+]
+_GARANT_TIMESTAMP_RE = re.compile(r'\d{2}\.\d{2}\.\d{4}\s+Система ГАРАНТ')
+_GARANT_PREFIX_RE = re.compile(r'ГАРАНТ:\s*')
+_SECTION_BREAK_RE = re.compile(r'(?:Статья|Глава|Пункт)\s+[\dIVXLCDM]+')
+_SECTION_RE = re.compile(r'(Глава|Статья|Пункт)\s+([\dIVXLCDM]+)')
 
 
 def clean_legal_text(text):
     """Очистка юридического текста от ненужной информации"""
-    # Удаление служебных комментариев
-    text = re.sub(r'См\..*?(\n|$)', '', text, flags=re.DOTALL)
-    text = re.sub(r'Информация об изменениях:.*?(\n|$)', '', text, flags=re.DOTALL)
-    text = re.sub(r'в редакции.*?(\n|$)', '', text, flags=re.DOTALL)
-    text = re.sub(r'вступил[а-я]* в силу.*?(\n|$)', '', text, flags=re.DOTALL)
-
-    # Удаление ссылок на законы
-    text = re.sub(r'Федеральным законом от\s+[^.]*\s+в\s+(?:пункт|статью).*?(\n|$)', '', text, flags=re.DOTALL)
+    # Удаление служебных комментариев и ссылок на законы
+    for pattern in _SERVICE_COMMENT_PATTERNS:
+        text = pattern.sub('', text)
 
     # Очистка от временных отметок
-    text = re.sub(r'\d{2}\.\d{2}\.\d{4}\s+Система ГАРАНТ', '', text)
+    text = _GARANT_TIMESTAMP_RE.sub('', text)
 
     # Очистка от повторяющихся фраз
-    text = re.sub(r'ГАРАНТ:\s*', '', text)
+    text = _GARANT_PREFIX_RE.sub('', text)
 
     return text.strip()
 
 
-def split_text(documents: list[Document]):
-    """Разделение текста на чанки с учетом юридической структуры"""
-    # Настройки разделителя для юридических документов
-    text_splitter = RecursiveCharacterTextSplitter(
+class IngestProgress:
+    """Счётчики этапов ingest с периодическим выводом скорости"""
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL):
+        self.interval = interval
+        self.pages = 0
+        self.chunks = 0
+        self.unique_chunks = 0
+        self.near_duplicates = 0
+        self.written = 0
+        self._start = time.perf_counter()
+        self._last_report = self._start
+
+    def tick(self):
+        if time.perf_counter() - self._last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self._start
+        self._last_report = time.perf_counter()
+        rate = (lambda value: value / elapsed if elapsed else 0.0)
+        print(f"[INFO] {elapsed:.1f} с: страниц {self.pages} ({rate(self.pages):.1f}/с), "
+              f"чанков {self.chunks}, уникальных {self.unique_chunks} ({rate(self.unique_chunks):.1f}/с), "
+              f"почти-дубликатов {self.near_duplicates}, записано {self.written}")
+
+
+def create_text_splitter():
+    """Разделитель текста с учётом юридической структуры"""
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         separators=[
@@ -87,126 +263,564 @@ def split_text(documents: list[Document]):
         ]
     )
 
-    chunks = []
+
+def clean_documents(documents: Iterable[Document], progress: IngestProgress) -> Iterator[Document]:
+    """Очистка страниц и добавление разрывов перед структурными элементами"""
     for doc in documents:
+        progress.pages += 1
         try:
-            # Очистка текста
-            cleaned_text = clean_legal_text(doc.page_content)
+            cleaned_text = _SECTION_BREAK_RE.sub(r'\n\n\g<0>', clean_legal_text(doc.page_content))
+        except Exception as e:
+            print(f"[ERROR] Ошибка при очистке документа: {e}")
+            continue
+        yield Document(page_content=cleaned_text, metadata=doc.metadata.copy())
 
-            # Добавление разрывов перед структурными элементами
-            cleaned_text = re.sub(r'(?:Статья|Глава|Пункт)\s+[\dIVXLCDM]+',
-                                  r'\n\n\g<0>', cleaned_text)
 
-            # Создание нового документа с очищенным текстом
-            new_doc = Document(
-                page_content=cleaned_text,
-                metadata=doc.metadata.copy()
-            )
+def annotate_chunks(doc_chunks: Iterable[Document]) -> Iterator[Document]:
+    """Добавление в метаданные чанков текущих главы, статьи и раздела"""
+    current_chapter = None
+    current_article = None
 
-            # Разделение на чанки
-            doc_chunks = text_splitter.split_documents([new_doc])
+    for chunk in doc_chunks:
+        # Проверка на пустой чанк
+        if not chunk.page_content.strip():
+            continue
 
-            current_chapter = None
-            current_article = None
+        # Извлечение структурных элементов
+        section_match = _SECTION_RE.search(chunk.page_content)
 
-            # Обработка каждого чанка
-            for chunk in doc_chunks:
-                # Проверка на пустой чанк
-                if not chunk.page_content.strip():
-                    continue
+        if section_match:
+            section_type = section_match.group(1)
+            section_num = section_match.group(2)
+            section_full = f"{section_type} {section_num}"
 
-                # Извлечение структурных элементов
-                section_match = re.search(r'(Глава|Статья|Пункт)\s+([\dIVXLCDM]+)', chunk.page_content)
+            # Обновление текущей главы или статьи
+            if section_type == "Глава":
+                current_chapter = section_full
+            elif section_type == "Статья":
+                current_article = section_full
 
-                if section_match:
-                    section_type = section_match.group(1)
-                    section_num = section_match.group(2)
-                    section_full = f"{section_type} {section_num}"
+            # Добавление конкретного раздела в метаданные
+            chunk.metadata["law_section"] = section_full
+            chunk.metadata["section_type"] = section_type
+            chunk.metadata["section_number"] = section_num
 
-                    # Обновление текущей главы или статьи
-                    if section_type == "Глава":
-                        current_chapter = section_full
-                    elif section_type == "Статья":
-                        current_article = section_full
+        # Добавление текущей главы и статьи в метаданные
+        if current_chapter:
+            chunk.metadata["chapter"] = current_chapter
+        if current_article:
+            chunk.metadata["article"] = current_article
 
-                    # Добавление конкретного раздела в метаданные
-                    chunk.metadata["law_section"] = section_full
-                    chunk.metadata["section_type"] = section_type
-                    chunk.metadata["section_number"] = section_num
+        yield chunk
 
-                # Добавление текущей главы и статьи в метаданные
-                if current_chapter:
-                    chunk.metadata["chapter"] = current_chapter
-                if current_article:
-                    chunk.metadata["article"] = current_article
-
-                chunks.append(chunk)
 
+def split_documents(documents: Iterable[Document], progress: IngestProgress) -> Iterator[Document]:
+    """Разбиение очищенных страниц на размеченные чанки"""
+    text_splitter = create_text_splitter()
+    for doc in documents:
+        try:
+            doc_chunks = list(annotate_chunks(text_splitter.split_documents([doc])))
         except Exception as e:
             print(f"[ERROR] Ошибка при разделении документа: {e}")
+            continue
+        progress.chunks += len(doc_chunks)
+        yield from doc_chunks
 
-    print(f"[INFO] Разделено {len(documents)} документов на {len(chunks)} чанков.")
 
-    # Дедупликация чанков
-    unique_chunks = []
+def deduplicate_chunks(chunks: Iterable[Document], progress: IngestProgress) -> Iterator[Document]:
+    """Пропуск повторяющихся чанков; хэш текста служит стабильным id чанка в Chroma"""
     for chunk in chunks:
         chunk_hash = hash_text(chunk.page_content)
         if chunk_hash not in global_unique_hashes:
-            unique_chunks.append(chunk)
+            chunk.id = chunk_hash
             global_unique_hashes.add(chunk_hash)
+            progress.unique_chunks += 1
+            progress.tick()
+            yield chunk
 
-    print(f"[INFO] Уникальных чанков после дедупликации: {len(unique_chunks)}")
 
-    # Вывод примеров чанков
-    print("\n=== Примеры загруженных чанков ===")
-    for i, chunk in enumerate(unique_chunks):
-        print(f"\n--- Чанк #{i + 1} ---")
-        print(f"Источник: {chunk.metadata.get('source', 'N/A')}")
-        print(f"Тип раздела: {chunk.metadata.get('section_type', 'N/A')}")
-        print(f"Номер: {chunk.metadata.get('section_number', 'N/A')}")
-        print(f"Глава: {chunk.metadata.get('chapter', 'N/A')}")
-        print(f"Статья: {chunk.metadata.get('article', 'N/A')}")
-        print(f"Длина: {len(chunk.page_content)}")
-        print(f"Содержание:\n{chunk.page_content[:500]}...")
+def drop_near_duplicates(chunks: Iterable[Document], progress: IngestProgress, index: NearDuplicateIndex,
+                         merged: Dict[str, Dict[str, str]]) -> Iterator[Document]:
+    """
+    Пропуск чанков, почти повторяющих уже проиндексированные (MinHash/LSH).
 
+    Объединённые чанки записываются в merged: {источник: {id дубликата: id канонического чанка}}.
+    """
+    for chunk in chunks:
+        canonical_id = index.check(chunk.id, chunk.page_content)
+        if canonical_id is None:
+            yield chunk
+            continue
+        merged.setdefault(chunk.metadata["source"], {})[chunk.id] = canonical_id
+        progress.near_duplicates += 1
+
+
+def iter_chunks(documents: Iterable[Document], progress: Optional[IngestProgress] = None,
+                near_duplicates: Optional[NearDuplicateIndex] = None,
+                merged: Optional[Dict[str, Dict[str, str]]] = None) -> Iterator[Document]:
+    """Потоковый конвейер: очистка → разбиение → разметка → дедупликация → удаление почти-дубликатов"""
+    progress = progress or IngestProgress()
+    chunks = deduplicate_chunks(split_documents(clean_documents(documents, progress), progress), progress)
+    if near_duplicates is not None:
+        chunks = drop_near_duplicates(chunks, progress, near_duplicates, {} if merged is None else merged)
+    return chunks
+
+
+def split_text(documents: Iterable[Document]):
+    """Разделение текста на чанки с учетом юридической структуры"""
+    progress = IngestProgress()
+    unique_chunks = list(iter_chunks(documents, progress))
+    print(f"[INFO] Разделено {progress.pages} страниц на {progress.chunks} чанков.")
+    print(f"[INFO] Уникальных чанков после дедупликации: {len(unique_chunks)}")
     return unique_chunks
 
 
-def save_to_chroma(chunks: list[Document]):
-    """Сохранение чанков в векторное хранилище"""
-    if os.path.exists(CHROMA_PATH):
-        shutil.rmtree(CHROMA_PATH)
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Разбиение потока на списки по size элементов"""
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def get_embedding_function():
+    """Функция эмбеддингов: nomic-embed-text через Ollama, в Ollama уходят только промахи кэша"""
+    return CachedEmbeddings(
+        BatchingEmbeddings(OllamaEmbeddings(model="nomic-embed-text")),
+        EmbeddingCache(),
+        model_name="nomic-embed-text"
+    )
 
-    os.makedirs(CHROMA_PATH)
+
+def iter_collection(db, include: List[str], page_size: int = FINALIZE_PAGE_SIZE) -> Iterator[tuple]:
+    """
+    Постраничный обход коллекции: кортежи (id, *поля include).
+
+    В памяти держится одна страница, а не вся коллекция; без фильтра Chroma
+    отдаёт записи в порядке вставки, поэтому порядок совпадает между проходами.
+    """
+    offset = 0
+    while True:
+        page = db.get(include=include, limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield from zip(page["ids"], *(page[field] for field in include))
+        offset += len(page["ids"])
+
+
+def save_lexical_index(db, persist_directory):
+    """Построение BM25-индекса по всем чанкам коллекции для гибридного поиска"""
+    index = BM25Index.write(os.path.join(persist_directory, BM25_INDEX_FILE),
+                            iter_collection(db, ["documents", "metadatas"]))
+    print(f"[INFO] BM25-индекс: {len(index.ids)} чанков, {len(index.postings)} термов")
+
+
+def save_vector_index(db, persist_directory):
+    """Выгрузка эмбеддингов коллекции в матрицу для точного поиска в памяти бота"""
+    # Первый проход — только разделы чанков, чтобы разложить векторы по строкам матрицы
+    names: Dict[str, str] = {}
+    partition_values = [names.setdefault(value, value) for value in
+                        (str((metadata or {}).get(PARTITION_KEY, "")) for _, metadata in
+                         iter_collection(db, ["metadatas"]))]
+    if not partition_values:
+        return
+    index = VectorIndex.write(persist_directory, partition_values,
+                              iter_collection(db, ["embeddings", "documents", "metadatas"]))
+    print(f"[INFO] Векторный индекс: {index.vectors.shape[0]} x {index.vectors.shape[1]} ({index.vectors.dtype}), "
+          f"квантование: {index.quantization}, первый проход {index.memory_bytes() / 2 ** 20:.1f} МБ")
+    save_query_router(index, persist_directory)
+
+
+def save_query_router(index: VectorIndex, persist_directory):
+    """Центроиды и ключевые слова разделов (законов) для маршрутизации вопросов"""
+    router = QueryRouter.build(index)
+    router.save(os.path.join(persist_directory, ROUTER_FILE))
+    for name in router.names:
+        start, stop = index.partitions[name]
+        keywords = sum(1 for weights in router.keywords.values() if name in weights)
+        print(f"[INFO] Раздел {os.path.basename(name)}: {stop - start} чанков, {keywords} ключевых слов")
+
+
+def chunk_sequence(entry: Dict) -> List[str]:
+    """
+    Чанки файла из манифеста в порядке текста.
+
+    На месте объединённого почти-дубликата стоит его канонический чанк
+    (возможно, из другого файла), чтобы в статье не было пропусков.
+    """
+    positions: Dict[int, List[str]] = {}
+    for duplicate_id, position in entry.get("merged_at", {}).items():
+        canonical_id = entry.get("merged", {}).get(duplicate_id)
+        if canonical_id is not None:
+            positions.setdefault(position, []).append(canonical_id)
+    sequence = []
+    for position, chunk_id in enumerate(entry["chunks"] + [None]):
+        sequence.extend(positions.get(position, []))
+        if chunk_id is not None:
+            sequence.append(chunk_id)
+    return sequence
+
+
+def save_citation_index(persist_directory, files: Dict[str, Dict]):
+    """Индекс (закон, статья/глава) → чанки для прямого поиска статей, названных в вопросе"""
+    db = open_chroma(get_embedding_function(), persist_directory)
+    data = db.get(include=["documents", "metadatas"])
+    chunks = dict(zip(data["ids"], zip(data["documents"], data["metadatas"])))
+    # Порядок чанков внутри файла известен только из манифеста
+    index = CitationIndex.build({path: chunk_sequence(entry) for path, entry in files.items()}, chunks)
+    index.save(os.path.join(persist_directory, CITATION_INDEX_FILE))
+    articles = sum(1 for _, label in index.sections if label.startswith("Статья"))
+    print(f"[INFO] Индекс ссылок: {articles} статей, {len(index.sections) - articles} глав")
+
+
+def print_embedding_stats(embedding_function):
+    """Статистика кэша эмбеддингов"""
+    if isinstance(embedding_function, CachedEmbeddings):
+        print(f"[INFO] Кэш эмбеддингов: {embedding_function.hits} попаданий, "
+              f"{embedding_function.misses} запросов к Ollama")
+
+
+def open_chroma(embedding_function, persist_directory):
+    return Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embedding_function,
+        collection_metadata={"hnsw:space": "cosine"}  # Для cosine similarity
+    )
+
+
+def refresh_metadata(db, chunks: List[Document]) -> int:
+    """
+    Замена метаданных чанков, текст которых уже есть в коллекции.
+
+    Тот же текст в изменённом файле мог оказаться на другой странице, в другой
+    статье или главе. Chroma при обновлении сливает старые ключи с новыми,
+    поэтому записи с изменившимися метаданными пересоздаются с прежними
+    эмбеддингами. Возвращает число обновлённых чанков.
+    """
+    if not chunks:
+        return 0
+    stored = db.get(ids=[chunk.id for chunk in chunks], include=["embeddings", "metadatas"])
+    embeddings = dict(zip(stored["ids"], stored["embeddings"]))
+    metadatas = dict(zip(stored["ids"], stored["metadatas"]))
+    changed = [chunk for chunk in chunks if chunk.id in metadatas and metadatas[chunk.id] != chunk.metadata]
+    if changed:
+        ids = [chunk.id for chunk in changed]
+        db.delete(ids=ids)
+        db._collection.add(ids=ids, embeddings=[embeddings[chunk_id] for chunk_id in ids],
+                           metadatas=[chunk.metadata for chunk in changed],
+                           documents=[chunk.page_content for chunk in changed])
+    return len(changed)
+
+
+def write_chunks(db, chunks: Iterable[Document], progress: Optional[IngestProgress] = None,
+                 existing_ids: Collection[str] = ()) -> Tuple[int, int]:
+    """
+    Потоковая запись чанков в Chroma пакетами по WRITE_BATCH.
+
+    Чанки с id из existing_ids уже есть в коллекции: эмбеддинги для них
+    не считаются, обновляются только метаданные. Возвращает число
+    добавленных и обновлённых чанков.
+    """
+    written = 0
+    refreshed = 0
+    for batch in batched(chunks, WRITE_BATCH):
+        new_chunks = [chunk for chunk in batch if chunk.id not in existing_ids]
+        if new_chunks:
+            db.add_documents(new_chunks, ids=[chunk.id for chunk in new_chunks])
+        refreshed += refresh_metadata(db, [chunk for chunk in batch if chunk.id in existing_ids])
+        written += len(new_chunks)
+        if progress is not None:
+            progress.written = written
+            progress.tick()
+    return written, refreshed
+
+
+def finalize_index(db, persist_directory):
+    """Сохранение Chroma и производных индексов, маркер версии индекса"""
+    db.persist()
+    save_lexical_index(db, persist_directory)
+    save_vector_index(db, persist_directory)
+    # Версия совпадает с именем каталога сборки; новая версия сбрасывает кэш ответов бота
+    version = os.path.basename(os.path.normpath(persist_directory))
+    return write_index_version(persist_directory, version)
+
+
+def save_to_chroma(chunks: Iterable[Document], persist_directory, embedding_function=None,
+                   progress: Optional[IngestProgress] = None):
+    """Полная сборка векторного хранилища в каталоге persist_directory"""
+    if os.path.exists(persist_directory):
+        shutil.rmtree(persist_directory)
+
+    os.makedirs(persist_directory)
 
     try:
-        # Используем nomic-embed-text через Ollama
-        embedding_function = OllamaEmbeddings(model="nomic-embed-text")
-
-        db = Chroma.from_documents(
-            documents=chunks,
-            embedding=embedding_function,
-            persist_directory=CHROMA_PATH,
-            collection_metadata={"hnsw:space": "cosine"}  # Для cosine similarity
-        )
-        db.persist()
-        print(f"[SUCCESS] Сохранено {len(chunks)} чанков в {CHROMA_PATH}")
+        embedding_function = embedding_function or get_embedding_function()
+        db = open_chroma(embedding_function, persist_directory)
+        written, _ = write_chunks(db, chunks, progress)
+        version = finalize_index(db, persist_directory)
+        print(f"[SUCCESS] Сохранено {written} чанков в {persist_directory} (версия {version})")
+        print_embedding_stats(embedding_function)
     except Exception as e:
         print(f"[ERROR] Не удалось сохранить в Chroma: {e}")
         raise
 
 
-def generate_data_store():
-    """Основной процесс обработки данных"""
-    documents = load_documents()
-    if not documents:
+def update_chroma(chunks_to_add: Iterable[Document], ids_to_delete: Callable[[], List[str]],
+                  persist_directory, embedding_function=None, progress: Optional[IngestProgress] = None,
+                  existing_ids: Collection[str] = ()):
+    """
+    Инкрементальное обновление копии индекса в persist_directory:
+    добавление новых чанков, обновление метаданных чанков из existing_ids
+    и удаление исчезнувших чанков.
+
+    ids_to_delete вызывается после добавления: список исчезнувших чанков
+    известен только когда поток новых чанков прочитан до конца.
+    """
+    try:
+        embedding_function = embedding_function or get_embedding_function()
+        db = open_chroma(embedding_function, persist_directory)
+
+        added, refreshed = write_chunks(db, chunks_to_add, progress, existing_ids)
+        deleted = ids_to_delete()
+        if deleted:
+            db.delete(ids=deleted)
+
+        version = finalize_index(db, persist_directory)
+        print(f"[SUCCESS] Добавлено {added}, обновлено {refreshed}, удалено {len(deleted)} чанков "
+              f"в {persist_directory} (версия {version})")
+        print_embedding_stats(embedding_function)
+    except Exception as e:
+        print(f"[ERROR] Не удалось обновить Chroma: {e}")
+        raise
+
+
+def load_manifest(persist_directory):
+    """Загрузка манифеста индекса (None, если индекса нет)"""
+    manifest_path = os.path.join(persist_directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[WARN] Не удалось прочитать манифест {manifest_path}: {e}")
+        return None
+
+
+def save_manifest(manifest, persist_directory):
+    """Сохранение манифеста (через временный файл)"""
+    manifest_path = os.path.join(persist_directory, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def verify_index(persist_directory, expected_chunks: int, embedding_function=None):
+    """
+    Проверка собранной версии перед публикацией.
+
+    Индекс открывается так же, как его откроет бот: число чанков в Chroma,
+    векторном и BM25-индексах должно совпадать с манифестом, а пробный
+    вопрос SMOKE_QUERY — находить документы. При ошибке бросает ValueError.
+    """
+    embedding_function = embedding_function or get_embedding_function()
+    db = open_chroma(embedding_function, persist_directory)
+    count = len(db.get(include=[])["ids"])
+    if count == 0 or count != expected_chunks:
+        raise ValueError(f"В Chroma {count} чанков, по манифесту ожидалось {expected_chunks}")
+
+    bm25_path = os.path.join(persist_directory, BM25_INDEX_FILE)
+    if len(BM25Index.load(bm25_path).ids) != count:
+        raise ValueError(f"BM25-индекс {bm25_path} не совпадает с Chroma")
+
+    embedding = embedding_function.embed_query(SMOKE_QUERY)
+    found = db.similarity_search_by_vector(embedding, k=1)
+    if not found:
+        raise ValueError(f"Пробный запрос «{SMOKE_QUERY}» ничего не нашёл в Chroma")
+    if os.path.exists(os.path.join(persist_directory, VECTOR_INDEX_FILE)):
+        index = VectorIndex.load(persist_directory)
+        if len(index.ids) != count or not index.search(embedding, 1):
+            raise ValueError(f"Векторный индекс в {persist_directory} не совпадает с Chroma")
+    print(f"[INFO] Проверка версии пройдена: {count} чанков, "
+          f"пробный запрос нашёл {found[0].metadata.get('source', '?')}")
+
+
+def generate_data_store(full_rebuild=False, dry_run=False, near_dup_threshold=NEAR_DUP_THRESHOLD):
+    """
+    Основной процесс обработки данных.
+
+    По умолчанию работает инкрементально: заново разбираются только PDF,
+    хэш которых изменился, в Chroma добавляются новые чанки и удаляются
+    исчезнувшие. Без манифеста выполняется полная пересборка.
+    Каждая сборка идёт в новый каталог версии INDEX_ROOT/<версия>
+    (инкрементальная — в копию активной версии), проверяется и только
+    затем публикуется атомарной заменой указателя CURRENT, поэтому
+    работающий бот не видит недостроенный индекс. После публикации
+    удаляются старые версии сверх INDEX_KEEP_VERSIONS.
+    Почти повторяющиеся чанки (оценка сходства Жаккара не ниже
+    near_dup_threshold) не индексируются и записываются в манифест
+    как объединённые с каноническим чанком.
+    """
+    file_hashes = {path: hash_file(path) for path in walk_through_files(DATA_PATH, '.pdf')}
+    if not file_hashes:
         print("[WARN] Не найдено документов!")
         return
 
-    print(f"[INFO] Загружено {len(documents)} страниц.")
-    chunks = split_text(documents)
-    save_to_chroma(chunks)
+    current_path = resolve_index_path()
+    manifest = load_manifest(current_path)
+    if manifest is None and not full_rebuild:
+        print("[INFO] Манифест индекса не найден, выполняется полная пересборка.")
+        full_rebuild = True
+
+    old_files = {} if manifest is None else manifest["files"]
+    if full_rebuild:
+        changed_files = list(file_hashes)
+    else:
+        changed_files = [
+            path for path, file_hash in file_hashes.items()
+            if old_files.get(path, {}).get("file_hash") != file_hash
+        ]
+    removed_files = [path for path in old_files if path not in file_hashes]
+
+    # Файлы, дубликаты из которых объединены с чанками изменённых или удалённых файлов,
+    # разбираются заново: канонический чанк мог исчезнуть
+    lost_ids = {
+        chunk_id for path in changed_files + removed_files
+        for chunk_id in old_files.get(path, {}).get("chunks", [])
+    }
+    for path in file_hashes:
+        if path not in changed_files and lost_ids.intersection(old_files[path].get("merged", {}).values()):
+            changed_files.append(path)
+
+    kept_files = {
+        path: old_files[path] for path in file_hashes
+        if path not in changed_files
+    }
+
+    print(f"[INFO] Файлов: {len(file_hashes)}, изменено/новых: {len(changed_files)}, "
+          f"удалено: {len(removed_files)}")
+
+    # Чанки неизменённых файлов уже в индексе и участвуют в дедупликации
+    for entry in kept_files.values():
+        global_unique_hashes.update(entry["chunks"])
+
+    near_duplicates = None
+    merged: Dict[str, Dict[str, str]] = {}
+    if near_dup_threshold > 0:
+        near_duplicates = NearDuplicateIndex(threshold=near_dup_threshold)
+        if not full_rebuild:
+            kept_ids = [chunk_id for entry in kept_files.values() for chunk_id in entry["chunks"]]
+            loaded = near_duplicates.load(os.path.join(current_path, NEAR_DUP_SIGNATURES_FILE), kept_ids)
+            if loaded < len(kept_ids):
+                print(f"[WARN] Найдено {loaded} из {len(kept_ids)} MinHash-сигнатур неизменённых чанков")
+
+    new_files = dict(kept_files)
+    for path in changed_files:
+        new_files[path] = {"file_hash": file_hashes[path], "chunks": []}
+    existing_ids = {chunk_id for entry in old_files.values() for chunk_id in entry["chunks"]}
+
+    def place_merged(path):
+        # Почти-дубликаты, объединённые до текущего чанка файла, стоят в тексте перед ним
+        entry = new_files[path]
+        positions = entry.setdefault("merged_at", {})
+        for duplicate_id in merged.get(path, {}):
+            positions.setdefault(duplicate_id, len(entry["chunks"]))
+
+    def record_chunks(chunks):
+        # Манифест хранит только id чанков, сами чанки идут дальше по конвейеру
+        for chunk in chunks:
+            source = chunk.metadata["source"]
+            place_merged(source)
+            new_files[source]["chunks"].append(chunk.id)
+            yield chunk
+
+    failed_files = set()
+
+    def keep_failed_files():
+        # Файл, который не удалось разобрать, остаётся в индексе в прежнем виде и будет
+        # разобран при следующем запуске (при полной пересборке старых чанков нет — он выпадает)
+        for path in failed_files:
+            if path in old_files and not full_rebuild:
+                new_files[path] = old_files[path]
+            else:
+                new_files.pop(path, None)
+
+    def stale_ids():
+        keep_failed_files()
+        desired_ids = {chunk_id for entry in new_files.values() for chunk_id in entry["chunks"]}
+        return sorted(existing_ids - desired_ids)
+
+    # Страницы идут в очистку, разбиение и запись по мере извлечения
+    progress = IngestProgress()
+    chunks = record_chunks(iter_chunks(load_documents(changed_files, file_hashes, failed_files), progress,
+                                       near_duplicates=near_duplicates, merged=merged))
+
+    if dry_run:
+        chunks_to_add = sum(1 for chunk in chunks if full_rebuild or chunk.id not in existing_ids)
+        ids_to_delete = [] if full_rebuild else stale_ids()
+        desired_count = sum(len(entry["chunks"]) for entry in new_files.values())
+        print("\n=== Что изменится (dry run) ===")
+        print(f"Режим: {'полная пересборка' if full_rebuild else 'инкрементальный'}")
+        for path in changed_files:
+            print(f"  ~ {path}")
+        for path in removed_files:
+            print(f"  - {path}")
+        print(f"Чанков к добавлению: {chunks_to_add}")
+        print(f"Чанков к удалению: {len(ids_to_delete)}")
+        print(f"Чанков без изменений: {desired_count - chunks_to_add}")
+        print(f"Почти-дубликатов объединено: {progress.near_duplicates}")
+        print(f"Не удалось разобрать файлов: {len(failed_files)}")
+        return
+
+    if not full_rebuild and not changed_files and not removed_files:
+        print("[INFO] Индекс актуален, изменений нет.")
+        return
+
+    # Сборка в новом каталоге версии, активная версия остаётся нетронутой
+    version, build_path = create_version_directory()
+    try:
+        if full_rebuild:
+            save_to_chroma(chunks, build_path, progress=progress)
+        else:
+            shutil.copytree(current_path, build_path, dirs_exist_ok=True)
+            # Чанки с уже проиндексированным текстом не эмбеддятся заново, но их метаданные обновляются
+            update_chroma(chunks, stale_ids, build_path, progress=progress, existing_ids=existing_ids)
+        progress.report()
+        keep_failed_files()
+        for path in sorted(failed_files):
+            print(f"[WARN] {path} не разобран, в индексе остаётся его прежняя версия (если была)")
+
+        for path in changed_files:
+            if path not in failed_files:
+                place_merged(path)
+                new_files[path]["merged"] = merged.get(path, {})
+        if near_duplicates is not None:
+            near_duplicates.save(os.path.join(build_path, NEAR_DUP_SIGNATURES_FILE))
+            print(f"[INFO] Объединено почти-дубликатов: {progress.near_duplicates} "
+                  f"(порог {near_dup_threshold}, {near_duplicates.bands} полос x {near_duplicates.rows} строк)")
+        save_manifest({"files": new_files}, build_path)
+        save_citation_index(build_path, new_files)
+
+        verify_index(build_path, sum(len(entry["chunks"]) for entry in new_files.values()))
+    except Exception as e:
+        # Неудачная сборка удаляется, бот продолжает работать с активной версией
+        shutil.rmtree(build_path, ignore_errors=True)
+        print(f"[ERROR] Версия {version} не опубликована: {e}")
+        raise
+
+    publish_version(version)
+    print(f"[SUCCESS] Опубликована версия индекса {version} ({os.path.join(INDEX_ROOT, version)})")
+    removed_versions = remove_old_versions()
+    if removed_versions:
+        print(f"[INFO] Удалены старые версии индекса: {', '.join(removed_versions)}")
 
 
 if __name__ == "__main__":
-    generate_data_store()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Построение векторного индекса из PDF")
+    parser.add_argument("--full", action="store_true", help="полная пересборка индекса")
+    parser.add_argument("--dry-run", action="store_true", help="показать изменения без записи")
+    parser.add_argument("--near-dup-threshold", type=float, default=NEAR_DUP_THRESHOLD,
+                        help="порог сходства Жаккара для почти-дубликатов (0 — отключить)")
+    args = parser.parse_args()
+
+    generate_data_store(full_rebuild=args.full, dry_run=args.dry_run, near_dup_threshold=args.near_dup_threshold)
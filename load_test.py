@@ -0,0 +1,345 @@
+"""
+Нагрузочный тест бота через настоящий ConversationHandler.
+
+Обновления Telegram от синтетических пользователей кладутся в
+application.update_queue и проходят тот же путь, что и в боте: обработчик
+обновлений, ConversationHandler, RAG-конвейер в пуле потоков, ограничение
+вызовов LLM и хранилище истории. Bot API, GigaChat и Ollama заменены
+локальными заглушками с настраиваемыми задержками.
+
+Каждый пользователь проходит сценарий /start → «📢 Начать консультацию» →
+вопросы → «🧹 Завершить консультацию» и ждёт ответа перед следующим
+сообщением. Число пользователей растёт ступенями:
+
+    python load_test.py --users 10,50,100,200 --stage-seconds 30
+    python load_test.py --llm-first-token 1.5 --llm-tokens 200 --output load_results.json
+
+Для каждой ступени печатаются пропускная способность, задержка ответа
+(p50/p95/p99), задержка event loop и обращения к хранилищу истории.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest, RequestData
+
+from fake_telegram import bot_api_result, make_update
+
+QUESTIONS = [
+    "Как вернуть товар ненадлежащего качества?",
+    "Какой срок исковой давности по договору купли-продажи?",
+    "Что делать, если задержали рейс более чем на два часа?",
+    "Как получить страховую выплату по ОСАГО после ДТП?",
+    "Может ли продавец отказать в обмене товара без чека?",
+    "Какая компенсация положена за утерянный багаж?",
+    "Как расторгнуть договор оказания услуг?",
+    "Что такое неустойка и как её рассчитать?",
+]
+
+CONTEXT_CHUNKS = [
+    "Статья 18. Права потребителя при обнаружении в товаре недостатков. Потребитель вправе потребовать "
+    "замены на товар этой же марки или соразмерного уменьшения покупной цены.",
+    "Статья 196. Общий срок исковой давности составляет три года со дня, определяемого в соответствии "
+    "со статьей 200 настоящего Кодекса.",
+    "Статья 120. За просрочку доставки пассажира перевозчик уплачивает штраф в размере двадцати пяти "
+    "процентов установленного федеральным законом минимального размера оплаты труда за каждый час задержки.",
+    "Статья 12. Потерпевший вправе предъявить страховщику требование о возмещении вреда, причиненного его "
+    "имуществу, в пределах страховой суммы.",
+]
+
+ANSWER_WORDS = ("Согласно статье 18 Закона о защите прав потребителей потребитель вправе потребовать "
+                "замены товара или возврата уплаченной суммы в установленный срок").split()
+
+# Служебные ответы бота: позиция в очереди к LLM, отказ из-за перегрузки, ошибка
+NOTICE_PREFIXES = {"queued": "🕒", "overloaded": "⏳", "errors": "⚠️"}
+
+# Обработчик в этой группе выполняется после ConversationHandler и отмечает обновление обработанным
+_DONE_GROUP = 100
+
+
+class StubBotRequest(BaseRequest):
+    """Bot API в памяти процесса: ответ на каждый вызов через latency секунд"""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self.notices: Dict[str, int] = {kind: 0 for kind in NOTICE_PREFIXES}
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data is not None else {}
+        if api_method == "sendMessage":
+            for kind, prefix in NOTICE_PREFIXES.items():
+                if parameters["text"].startswith(prefix):
+                    self.notices[kind] += 1
+        result = bot_api_result(api_method, parameters)
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+class SlowEmbeddings(DeterministicFakeEmbedding):
+    """Эмбеддинги вместо Ollama: детерминированные векторы с задержкой"""
+
+    latency: float = 0.02
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return super().embed_query(text)
+
+
+class SlowStreamingLLM(LLM):
+    """LLM вместо GigaChat: первый фрагмент через first_token сек, затем по слову раз в token_interval"""
+
+    first_token: float = 0.8
+    tokens: int = 60
+    token_interval: float = 0.03
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-streaming-stub"
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        time.sleep(self.first_token)
+        for i in range(self.tokens):
+            if i:
+                time.sleep(self.token_interval)
+            yield GenerationChunk(text=ANSWER_WORDS[i % len(ANSWER_WORDS)] + " ")
+
+
+class StubRetriever:
+    """Поиск вместо индекса: несколько чанков законов с задержкой"""
+
+    def __init__(self, latency: float = 0.005):
+        self.latency = latency
+
+    def search(self, question: str, embedding: Sequence[float], k: int) -> List[Document]:
+        time.sleep(self.latency)
+        # Разным вопросам — разный контекст, как при настоящем поиске
+        offset = sum(map(ord, question)) % len(CONTEXT_CHUNKS)
+        chunks = (CONTEXT_CHUNKS[(offset + i) % len(CONTEXT_CHUNKS)] for i in range(k))
+        return [Document(page_content=text, metadata={"source": "stub"}) for text in chunks]
+
+
+class _StubDB:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+class LoadTest:
+    """Ступенчатая нагрузка синтетических пользователей на приложение бота"""
+
+    def __init__(self, application, request: StubBotRequest, session_store,
+                 questions_per_session: int = 3, think_time: float = 1.0):
+        self.application = application
+        self.request = request
+        self.session_store = session_store
+        self.questions_per_session = questions_per_session
+        self.think_time = think_time
+        self._user_ids = itertools.count(1_000_000)
+        self._pending: Dict[int, asyncio.Future] = {}
+        application.add_handler(TypeHandler(Update, self._mark_done), group=_DONE_GROUP)
+
+    async def _mark_done(self, update, context):
+        future = self._pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def send(self, user_id: int, text: str) -> float:
+        """Отправка сообщения и ожидание конца его обработки; возвращает задержку (сек)"""
+        update = Update.de_json(make_update(user_id, text), self.application.bot)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[update.update_id] = future
+        start = time.perf_counter()
+        await self.application.update_queue.put(update)
+        return await future - start
+
+    async def _user(self, stop: asyncio.Event, latencies: Dict[str, List[float]]):
+        user_id = next(self._user_ids)
+        # Пользователи приходят не одновременно
+        await asyncio.sleep(random.uniform(0, self.think_time))
+        while not stop.is_set():
+            script = [("start", "/start"), ("menu", "📢 Начать консультацию")]
+            script += [("question", random.choice(QUESTIONS)) for _ in range(self.questions_per_session)]
+            script.append(("end", "🧹 Завершить консультацию"))
+            for kind, text in script:
+                if stop.is_set():
+                    return
+                latencies[kind].append(await self.send(user_id, text))
+                await asyncio.sleep(random.uniform(0.5, 1.5) * self.think_time)
+
+    @staticmethod
+    async def _monitor_loop_lag(stop: asyncio.Event, samples: List[float], interval: float = 0.05):
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            start = loop.time()
+            await asyncio.sleep(interval)
+            samples.append(loop.time() - start - interval)
+
+    async def run_stage(self, users: int, duration: float) -> Dict:
+        from metrics import STAGE_SECONDS
+
+        latencies: Dict[str, List[float]] = {"start": [], "menu": [], "question": [], "end": []}
+        lag: List[float] = []
+        reads_before = STAGE_SECONDS.totals(stage="session_read")
+        flushes_before = STAGE_SECONDS.totals(stage="session_flush")
+        rows_before = self.session_store.rows_written
+        notices_before = dict(self.request.notices)
+
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(self._monitor_loop_lag(stop, lag))
+        tasks = [asyncio.create_task(self._user(stop, latencies)) for _ in range(users)]
+        start = time.perf_counter()
+        await asyncio.sleep(duration)
+        stop.set()
+        # Пользователи дожидаются ответа на последнее отправленное сообщение
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        await monitor
+
+        reads, read_seconds = (a - b for a, b in zip(STAGE_SECONDS.totals(stage="session_read"), reads_before))
+        flushes, flush_seconds = (a - b for a, b in zip(STAGE_SECONDS.totals(stage="session_flush"),
+                                                        flushes_before))
+        questions = latencies["question"]
+        all_updates = [value for values in latencies.values() for value in values]
+        return {
+            "users": users,
+            "seconds": elapsed,
+            "updates": len(all_updates),
+            "questions": len(questions),
+            "questions_per_s": len(questions) / elapsed,
+            "updates_per_s": len(all_updates) / elapsed,
+            "question_p50_ms": percentile(questions, 50) * 1000,
+            "question_p95_ms": percentile(questions, 95) * 1000,
+            "question_p99_ms": percentile(questions, 99) * 1000,
+            "menu_p99_ms": percentile(latencies["start"] + latencies["menu"] + latencies["end"], 99) * 1000,
+            "loop_lag_p99_ms": percentile(lag, 99) * 1000,
+            "loop_lag_max_ms": max(lag, default=0.0) * 1000,
+            "history_reads": reads,
+            "history_read_ms": read_seconds * 1000,
+            "history_flushes": flushes,
+            "history_flush_ms": flush_seconds * 1000,
+            "history_rows_written": self.session_store.rows_written - rows_before,
+            **{kind: count - notices_before[kind] for kind, count in self.request.notices.items()},
+        }
+
+
+def _stub_pipeline_factory(args):
+    def create(version=None):
+        from custom_gigachat import SYSTEM_PROMPT, create_document_chain
+        from prompt_builder import PromptBuilder
+        from rag_pipeline import RagPipeline
+
+        llm = SlowStreamingLLM(first_token=args.llm_first_token, tokens=args.llm_tokens,
+                               token_interval=args.llm_token_interval)
+        return RagPipeline(
+            _StubDB(SlowEmbeddings(size=768, latency=args.embed_latency)),
+            create_document_chain(llm),
+            tempfile.gettempdir(),
+            retriever=StubRetriever(latency=args.search_latency),
+            prompt_builder=PromptBuilder(system_prompt=SYSTEM_PROMPT),
+        )
+    return create
+
+
+async def run_load_test(args) -> List[Dict]:
+    # Модуль бота читает конфигурацию при импорте
+    import telegram_bot
+    from pipeline_loader import PipelineLoader
+
+    # Отказы и ошибки считаются по ответам бота, а не по логу
+    logging.getLogger().setLevel(logging.CRITICAL)
+    request = StubBotRequest(latency=args.telegram_latency)
+    application = telegram_bot.build_application(updater=False, request=request)
+    telegram_bot.pipeline_loader = PipelineLoader(factory=_stub_pipeline_factory(args), reload_interval=0)
+    telegram_bot.pipeline_loader.start()
+    telegram_bot.pipeline_loader.wait()
+
+    load_test = LoadTest(application, request, telegram_bot.session_store, args.questions, args.think_time)
+    results = []
+    async with application:
+        await application.start()
+        print(f"{'Польз.':>7}{'Вопр/с':>9}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'Меню p99':>10}"
+              f"{'Lag p99':>9}{'Lag max':>9}{'Чтения':>8}{'Записи':>8}{'I/O, мс':>9}"
+              f"{'Очередь':>9}{'Отказы':>8}{'Ошибки':>8}")
+        for users in args.users:
+            stage = await load_test.run_stage(users, args.stage_seconds)
+            results.append(stage)
+            print(f"{users:>7}{stage['questions_per_s']:>9.2f}{stage['question_p50_ms']:>10.0f}"
+                  f"{stage['question_p95_ms']:>10.0f}{stage['question_p99_ms']:>10.0f}"
+                  f"{stage['menu_p99_ms']:>10.0f}{stage['loop_lag_p99_ms']:>9.1f}{stage['loop_lag_max_ms']:>9.1f}"
+                  f"{stage['history_reads']:>8}{stage['history_rows_written']:>8}"
+                  f"{stage['history_read_ms'] + stage['history_flush_ms']:>9.0f}"
+                  f"{stage['queued']:>9}{stage['overloaded']:>8}{stage['errors']:>8}")
+        await application.stop()
+    await telegram_bot.post_shutdown(application)
+    print(f"\nВызовы Bot API: {request.calls}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушками Telegram, GigaChat и Ollama")
+    parser.add_argument("--users", default="10,25,50,100", help="ступени числа пользователей через запятую")
+    parser.add_argument("--stage-seconds", type=float, default=30, help="длительность ступени (сек)")
+    parser.add_argument("--questions", type=int, default=3, help="вопросов в одной консультации")
+    parser.add_argument("--think-time", type=float, default=1.0, help="средняя пауза пользователя (сек)")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="задержка вызова Bot API (сек)")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="задержка эмбеддинга (сек)")
+    parser.add_argument("--search-latency", type=float, default=0.005, help="задержка поиска (сек)")
+    parser.add_argument("--llm-first-token", type=float, default=0.8, help="задержка первого фрагмента LLM (сек)")
+    parser.add_argument("--llm-tokens", type=int, default=60, help="фрагментов в ответе LLM")
+    parser.add_argument("--llm-token-interval", type=float, default=0.03, help="интервал фрагментов LLM (сек)")
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    args = parser.parse_args()
+    args.users = [int(value) for value in args.users.split(",")]
+
+    workdir = tempfile.mkdtemp(prefix="rag-load-")
+    # История — во временной базе, а истории старого формата ищутся в пустом временном каталоге:
+    # настоящие chat_histories/*.json не переносятся и не переименовываются;
+    # ограничение частоты вопросов не должно искажать замер
+    os.environ["SESSION_DB_PATH"] = os.path.join(workdir, "chat_histories.sqlite3")
+    os.environ["CHAT_HISTORY_DIR"] = os.path.join(workdir, "chat_histories")
+    os.environ.setdefault("USER_RATE_PER_MINUTE", "0")
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:load-test")
+
+    results = asyncio.run(run_load_test(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "stages": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
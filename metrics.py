@@ -0,0 +1,233 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("metrics")
+
+# Конфигурация (можно переопределить через .env); METRICS_PORT=0 отключает HTTP-эндпоинт
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+METRICS_JSON_LOGS = os.getenv("METRICS_JSON_LOGS", "0") == "1"
+
+# Границы корзин гистограмм длительности (сек): от ~1 мс до 2 мин
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192)
+
+# Идентификатор текущего запроса пользователя
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Счётчик в формате Prometheus"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Текущее значение в формате Prometheus"""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.value}"]
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: (счётчики корзин, сумма, количество)
+        self._values: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def totals(self, **labels) -> Tuple[int, float]:
+        """Количество наблюдений и их сумма для набора меток"""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            return (state[2], state[1]) if state is not None else (0, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_seconds", "Длительность этапов обработки запроса", ["stage"]))
+REQUESTS = REGISTRY.register(Counter(
+    "rag_requests_total", "Количество вопросов пользователей", ["mode"]))
+ERRORS = REGISTRY.register(Counter(
+    "rag_errors_total", "Количество ошибок по этапам", ["stage"]))
+CACHE_HITS = REGISTRY.register(Counter(
+    "rag_cache_hits_total", "Попадания в кэши", ["cache"]))
+CACHE_MISSES = REGISTRY.register(Counter(
+    "rag_cache_misses_total", "Промахи кэшей", ["cache"]))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "rag_prompt_tokens", "Размер частей промпта в токенах", ["part"], buckets=TOKEN_BUCKETS))
+COALESCED = REGISTRY.register(Counter(
+    "rag_coalesced_total", "Вопросы, получившие ответ одновременного одинакового запроса"))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "rag_rate_limited_total", "Вопросы, отклонённые ограничением частоты для пользователя"))
+ROUTED = REGISTRY.register(Counter(
+    "rag_router_decisions_total",
+    "Поиск по выбранным разделам индекса, по всему индексу или по ссылке на статью", ["route"]))
+INDEX_RELOADS = REGISTRY.register(Counter(
+    "rag_index_reloads_total", "Переключения бота на новую версию индекса", ["result"]))
+READY = REGISTRY.register(Gauge(
+    "rag_pipeline_ready", "RAG-конвейер инициализирован и прогрет"))
+
+
+def new_request_id() -> str:
+    """Новый идентификатор запроса для текущего контекста"""
+    request_id = uuid.uuid4().hex[:12]
+    request_id_var.set(request_id)
+    return request_id
+
+
+def log_event(event: str, **fields):
+    """Структурированная запись в лог (при METRICS_JSON_LOGS=1)"""
+    if METRICS_JSON_LOGS:
+        logger.info(json.dumps({"event": event, "request_id": request_id_var.get(), **fields},
+                               ensure_ascii=False))
+
+
+@contextmanager
+def span(stage: str, **fields) -> Iterator[None]:
+    """Замер длительности этапа; исключения учитываются в rag_errors_total"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=stage)
+        log_event("span", stage=stage, duration_ms=round(duration * 1000, 3), **fields)
+
+
+def observe_prompt_tokens(token_counts: Dict[str, int]):
+    """Учёт размеров промпта, посчитанных PromptBuilder"""
+    for part in ("system", "question", "context", "history", "total"):
+        if part in token_counts:
+            PROMPT_TOKENS.observe(token_counts[part], part=part)
+    log_event("prompt", **token_counts)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/ready":
+            # Проверка готовности для оркестратора: 503, пока идёт запуск
+            self._reply(200 if READY.value else 503, b"ready\n" if READY.value else b"starting\n")
+        elif path == "/metrics":
+            self._reply(200, REGISTRY.render().encode("utf-8"))
+        else:
+            self.send_error(404)
+
+    def _reply(self, status: int, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Запуск HTTP-эндпоинтов /metrics и /ready в фоновом потоке"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.getLogger(__name__).info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
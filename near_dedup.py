@@ -0,0 +1,151 @@
+import os
+import pickle
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Порог оценки сходства Жаккара, начиная с которого чанк считается дубликатом (0 — отключено)
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.85"))
+# Число хэш-функций MinHash и длина шингла в словах
+NEAR_DUP_NUM_PERM = int(os.getenv("NEAR_DUP_NUM_PERM", "128"))
+NEAR_DUP_SHINGLE = int(os.getenv("NEAR_DUP_SHINGLE", "5"))
+# Сигнатуры чанков индекса внутри каталога Chroma (для инкрементального ingest)
+NEAR_DUP_SIGNATURES_FILE = "minhash.pkl"
+
+# Версия формата файла; при несовпадении сигнатуры считаются заново
+_FORMAT_VERSION = 1
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_RE = re.compile(r'\w+')
+
+
+def shingles(text: str, size: int = NEAR_DUP_SHINGLE) -> Set[str]:
+    """Множество последовательностей из size слов текста"""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def optimal_bands(threshold: float, num_perm: int, recall: float = 0.95) -> Tuple[int, int]:
+    """
+    Число полос и строк в полосе LSH: наибольшее число строк, при котором
+    пара со сходством threshold попадает в кандидаты с вероятностью не ниже
+    recall. Лишние кандидаты отсекаются проверкой по полным сигнатурам.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            best = (bands, rows)
+    return best
+
+
+class MinHasher:
+    """Сигнатуры MinHash по шинглам текста"""
+
+    def __init__(self, num_perm: int = NEAR_DUP_NUM_PERM, shingle_size: int = NEAR_DUP_SHINGLE, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # Перестановки вида (a * x + b) mod p; a, b < 2^31, поэтому произведение не переполняет uint64
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 31, num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, num_perm).astype(np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text, self.shingle_size)),
+            dtype=np.uint64,
+        )
+        if not len(hashes):
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        permuted = (hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    Поиск почти совпадающих чанков: MinHash + LSH по полосам сигнатуры.
+
+    Кандидаты из общих корзин LSH проверяются оценкой сходства Жаккара
+    по полным сигнатурам. Первый добавленный чанк считается каноническим.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUP_THRESHOLD, num_perm: int = NEAR_DUP_NUM_PERM,
+                 shingle_size: int = NEAR_DUP_SHINGLE):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        self.signatures: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(self.bands)]
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, chunk_id: str, signature: np.ndarray):
+        self.signatures[chunk_id] = signature
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, []).append(chunk_id)
+
+    def find(self, signature: np.ndarray) -> Optional[Tuple[str, float]]:
+        """Самый похожий из ранее добавленных чанков, если сходство не ниже порога"""
+        candidates = set()
+        for band, key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(key, ()))
+
+        best = None
+        for candidate in candidates:
+            similarity = float(np.mean(self.signatures[candidate] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+        return best
+
+    def check(self, chunk_id: str, text: str) -> Optional[str]:
+        """id канонического чанка, если текст почти повторяет его; иначе чанк добавляется в индекс"""
+        signature = self.hasher.signature(text)
+        match = self.find(signature)
+        if match is not None:
+            return match[0]
+        self.add(chunk_id, signature)
+        return None
+
+    def save(self, path: str):
+        """Сохранение сигнатур (через временный файл)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "version": _FORMAT_VERSION,
+                "num_perm": self.hasher.num_perm,
+                "shingle_size": self.hasher.shingle_size,
+                "signatures": {chunk_id: signature.tobytes() for chunk_id, signature in self.signatures.items()},
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str, chunk_ids: Iterable[str]) -> int:
+        """
+        Загрузка сигнатур чанков chunk_ids, сохранённых предыдущим запуском.
+
+        Возвращает число загруженных сигнатур; файл с другими параметрами
+        MinHash игнорируется.
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if (data.get("version") != _FORMAT_VERSION or data["num_perm"] != self.hasher.num_perm
+                or data["shingle_size"] != self.hasher.shingle_size):
+            return 0
+
+        loaded = 0
+        for chunk_id in chunk_ids:
+            blob = data["signatures"].get(chunk_id)
+            if blob is not None:
+                self.add(chunk_id, np.frombuffer(blob, dtype=np.uint32))
+                loaded += 1
+        return loaded
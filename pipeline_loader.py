@@ -0,0 +1,208 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from index_version import current_version, version_path
+from metrics import INDEX_RELOADS, READY, span
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторной попыткой инициализации после ошибки (сек)
+PIPELINE_RETRY_INTERVAL = float(os.getenv("PIPELINE_RETRY_INTERVAL", "30"))
+# Вопрос для прогрева: загружает модель Ollama и индекс поиска
+WARMUP_QUESTION = os.getenv("WARMUP_QUESTION", "Какие права есть у потребителя?")
+# Интервал проверки указателя на активную версию индекса (сек, 0 — без перезагрузки индекса)
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "30"))
+# Наибольшее время ожидания начатых запросов старого конвейера после переключения версии (сек)
+PIPELINE_CLOSE_DELAY = float(os.getenv("PIPELINE_CLOSE_DELAY", "120"))
+
+STARTING = "starting"
+WARMING_UP = "warming_up"
+READY_STATE = "ready"
+FAILED = "failed"
+
+
+def _create_pipeline(version: Optional[str]):
+    # Тяжёлые импорты (langchain, Chroma, GigaChat) откладываются до фоновой инициализации
+    from custom_gigachat import initialize_pipeline
+    return initialize_pipeline(version_path(version))
+
+
+class PipelineLoader:
+    """
+    Фоновая инициализация RAG-конвейера.
+
+    Конвейер создаётся в отдельном потоке фабрикой factory(версия индекса),
+    после чего прогревается одним эмбеддингом и одним поиском. До готовности pipeline равен None, а
+    state сообщает текущую стадию запуска. При ошибке инициализация
+    повторяется каждые retry_interval секунд.
+
+    После готовности поток раз в reload_interval секунд проверяет
+    опубликованную версию индекса (version_source). Для новой версии
+    конвейер создаётся и прогревается в фоне, пока запросы обслуживает
+    старый, а затем ссылка на конвейер заменяется целиком. Обработчики
+    берут конвейер через lease() на всё время запроса, поэтому начатые
+    запросы дорабатывают со старым конвейером, а новые идут в новый.
+    Старый конвейер закрывается, когда завершится последний начатый с ним
+    запрос, но не позже чем через close_delay секунд после замены.
+    """
+
+    def __init__(self, factory: Callable = _create_pipeline, warmup_question: str = WARMUP_QUESTION,
+                 retry_interval: float = PIPELINE_RETRY_INTERVAL,
+                 reload_interval: float = INDEX_RELOAD_INTERVAL,
+                 version_source: Callable[[], Optional[str]] = current_version,
+                 close_delay: float = PIPELINE_CLOSE_DELAY):
+        self.factory = factory
+        self.warmup_question = warmup_question
+        self.retry_interval = retry_interval
+        self.reload_interval = reload_interval
+        self.version_source = version_source
+        self.close_delay = close_delay
+        self.state = STARTING
+        self.error: Optional[BaseException] = None
+        # Версия индекса, с которой создан текущий конвейер
+        self.index_version: Optional[str] = None
+        self._failed_version: Optional[str] = None
+        self._pipeline = None
+        # Число запросов, выполняющихся с каждым конвейером (id конвейера -> число)
+        self._leases: Dict[int, int] = {}
+        self._leases_changed = threading.Condition()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def pipeline(self):
+        """Готовый конвейер или None, если инициализация не завершена"""
+        return self._pipeline if self._ready.is_set() else None
+
+    @contextmanager
+    def lease(self) -> Iterator:
+        """
+        Конвейер на время запроса (или None, если он не готов).
+
+        Пока запрос не завершён, конвейер не закрывается перезагрузкой индекса.
+        """
+        with self._leases_changed:
+            pipeline = self.pipeline
+            if pipeline is not None:
+                self._leases[id(pipeline)] = self._leases.get(id(pipeline), 0) + 1
+        try:
+            yield pipeline
+        finally:
+            if pipeline is not None:
+                with self._leases_changed:
+                    count = self._leases.pop(id(pipeline)) - 1
+                    if count:
+                        self._leases[id(pipeline)] = count
+                    else:
+                        self._leases_changed.notify_all()
+
+    def _wait_released(self, pipeline) -> bool:
+        """Ожидание завершения запросов конвейера (не дольше close_delay)"""
+        with self._leases_changed:
+            return self._leases_changed.wait_for(
+                lambda: id(pipeline) not in self._leases or self._stop.is_set(), timeout=self.close_delay
+            )
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def start(self):
+        """Запуск инициализации в фоновом потоке"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._load_loop, name="pipeline-loader", daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание готовности конвейера"""
+        return self._ready.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+        with self._leases_changed:
+            self._leases_changed.notify_all()
+
+    def _load_loop(self):
+        while not self._stop.is_set():
+            try:
+                self._load()
+                break
+            except Exception as e:
+                self.state = FAILED
+                self.error = e
+                logger.error(f"Ошибка инициализации RAG-конвейера: {e}")
+                self._stop.wait(self.retry_interval)
+        if self.reload_interval > 0:
+            self._watch_loop()
+
+    def _watch_loop(self):
+        while not self._stop.wait(self.reload_interval):
+            version = self.version_source()
+            if version is None or version in (self.index_version, self._failed_version):
+                continue
+            try:
+                self._reload(version)
+            except Exception as e:
+                # Повтор — только после публикации следующей версии
+                self._failed_version = version
+                INDEX_RELOADS.inc(result="failed")
+                logger.error(f"Не удалось переключиться на версию индекса {version}: {e}")
+
+    def _load(self):
+        start = time.perf_counter()
+        if self._pipeline is None:
+            # После неудачного прогрева повторяется только прогрев
+            self.state = STARTING
+            with span("init_pipeline"):
+                self.index_version = self.version_source()
+                self._pipeline = self.factory(self.index_version)
+
+        self.state = WARMING_UP
+        with span("warmup"):
+            # Эмбеддинг (мимо кэша) и поиск загружают модель Ollama и индекс в память
+            self._pipeline.warmup(self.warmup_question)
+
+        self.state = READY_STATE
+        self.error = None
+        self._ready.set()
+        READY.set(1)
+        logger.info(f"RAG-конвейер готов за {time.perf_counter() - start:.1f} сек")
+
+    def _reload(self, version: str):
+        """Создание и прогрев конвейера новой версии индекса, затем замена ссылки"""
+        start = time.perf_counter()
+        logger.info(f"Опубликована версия индекса {version}, загрузка в фоне")
+        with span("reload_pipeline"):
+            pipeline = self.factory(version)
+            try:
+                pipeline.warmup(self.warmup_question)
+            except Exception:
+                _close(pipeline)
+                raise
+        with self._leases_changed:
+            previous, self._pipeline = self._pipeline, pipeline
+        self.index_version = version
+        INDEX_RELOADS.inc(result="ok")
+        logger.info(f"Бот переключён на версию индекса {version} за {time.perf_counter() - start:.1f} сек")
+
+        # Запросы, начатые до переключения, дорабатывают со старым конвейером
+        if not self._wait_released(previous):
+            logger.warning(f"Запросы старого конвейера не завершились за {self.close_delay:.0f} сек, "
+                           f"конвейер закрывается")
+        _close(previous)
+
+
+def _close(pipeline):
+    """Закрытие конвейера, если он это поддерживает (ошибки только в лог)"""
+    close = getattr(pipeline, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        logger.warning(f"Ошибка при закрытии RAG-конвейера: {e}")
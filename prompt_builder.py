@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Бюджет токенов на системный промпт, контекст, историю и вопрос
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# Число текстов, подсчитанных токенизатором модели, которые хранятся в памяти
+PROMPT_TOKEN_CACHE_SIZE = int(os.getenv("PROMPT_TOKEN_CACHE_SIZE", "10000"))
+
+# Перекрытие соседних чанков (chunk_overlap в ingest.py) с запасом
+_MAX_OVERLAP = 400
+_MIN_OVERLAP = 20
+
+_TOKEN_PIECES_RE = re.compile(r'\w+|[^\w\s]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценка числа токенов без обращения к API (запасной вариант).
+
+    BPE-токенизаторы GigaChat режут русские слова примерно на куски
+    по 3-4 символа, знаки препинания — отдельные токены.
+    """
+    tokens = 0
+    for piece in _TOKEN_PIECES_RE.findall(text):
+        tokens += math.ceil(len(piece) / 4) if piece[0].isalnum() else 1
+    return tokens
+
+
+def estimate_token_counts(texts: Sequence[str]) -> List[int]:
+    """Оценка числа токенов каждого текста"""
+    return [estimate_tokens(text) for text in texts]
+
+
+def _message_content(message) -> str:
+    """Текст сообщения истории (LangChain-сообщение или dict)"""
+    if isinstance(message, dict):
+        return message.get("content", "")
+    return getattr(message, "content", "")
+
+
+def _is_user_message(message) -> bool:
+    """Сообщение пользователя (а не ответ ассистента)"""
+    if isinstance(message, dict):
+        return message.get("role") in ("user", "human")
+    return getattr(message, "type", "") == "human"
+
+
+def history_turns(chat_history: Sequence) -> List[list]:
+    """
+    История по репликам: вопрос пользователя и ответы на него.
+
+    Ответы ассистента в начале истории (вопрос к ним обрезан хранилищем)
+    отбрасываются: история в промпте всегда начинается с вопроса.
+    """
+    turns: List[list] = []
+    for message in chat_history:
+        if _is_user_message(message):
+            turns.append([message])
+        elif turns:
+            turns[-1].append(message)
+    return turns
+
+
+def _overlap(left: str, right: str) -> int:
+    """Длина самого длинного суффикса left, совпадающего с префиксом right"""
+    for length in range(min(len(left), len(right), _MAX_OVERLAP), _MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def merge_chunks(docs: Sequence[Document]) -> List[Document]:
+    """
+    Склейка чанков одной статьи одного документа.
+
+    Перекрывающийся текст соседних чанков выбрасывается, чанки, целиком
+    содержащиеся в уже собранном фрагменте, отбрасываются. Порядок
+    фрагментов соответствует рангу лучшего чанка в выдаче.
+    """
+    merged: List[Document] = []
+    by_article: Dict[tuple, Document] = {}
+
+    for doc in docs:
+        article = doc.metadata.get("article")
+        key = (doc.metadata.get("source"), article)
+        text = doc.page_content.strip()
+        piece = by_article.get(key) if article else None
+
+        if piece is None:
+            piece = Document(page_content=text, metadata=dict(doc.metadata))
+            merged.append(piece)
+            if article:
+                by_article[key] = piece
+            continue
+
+        current = piece.page_content
+        if text in current:
+            continue
+        if current in text:
+            piece.page_content = text
+            continue
+
+        tail_overlap = _overlap(current, text)
+        head_overlap = 0 if tail_overlap else _overlap(text, current)
+        if tail_overlap:
+            piece.page_content = current + text[tail_overlap:]
+        elif head_overlap:
+            piece.page_content = text + current[head_overlap:]
+        else:
+            piece.page_content = current + "\n" + text
+
+    return merged
+
+
+class Prompt(NamedTuple):
+    """Входные данные для document_chain и итоговые размеры в токенах"""
+    context: List[Document]
+    chat_history: list
+    token_counts: Dict[str, int]
+
+
+class PromptBuilder:
+    """
+    Сборка промпта в пределах бюджета токенов.
+
+    Сначала в бюджет укладываются вопрос и склеенный контекст (в порядке
+    ранга, хотя бы один фрагмент), затем история — целыми репликами
+    (вопрос и ответ) от новых к старым, пока хватает бюджета.
+
+    Токены считает count_tokens — функция, принимающая список текстов
+    (по умолчанию — оценка estimate_tokens без обращения к API). Если
+    задан токенизатор модели, его результаты кэшируются по хэшу текста:
+    чанки контекста и реплики истории повторяются, и в модель уходят
+    только новые тексты, все за один запрос. При ошибке токенизатора
+    используется оценка.
+    """
+
+    def __init__(self, system_prompt: str = "", budget: int = PROMPT_TOKEN_BUDGET,
+                 count_tokens: Optional[Callable[[List[str]], List[int]]] = None,
+                 cache_size: int = PROMPT_TOKEN_CACHE_SIZE):
+        self.budget = budget
+        self.system_prompt = system_prompt
+        self.count_tokens = count_tokens or estimate_token_counts
+        self.cache_size = cache_size
+        # Хэш текста -> число токенов по токенизатору модели (LRU)
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Системный промпт считается один раз, при первой сборке
+        self.system_tokens: Optional[int] = None
+
+    def _count_uncached(self, texts: List[str]) -> Optional[List[int]]:
+        try:
+            counts = list(self.count_tokens(texts))
+            if len(counts) == len(texts):
+                return counts
+            logger.warning(f"Подсчёт токенов вернул {len(counts)} значений для {len(texts)} текстов")
+        except Exception as e:
+            logger.warning(f"Ошибка подсчёта токенов моделью, используется оценка: {e}")
+        return None
+
+    def _count(self, texts: List[str]) -> List[int]:
+        if self.count_tokens is estimate_token_counts:
+            return estimate_token_counts(texts)
+
+        keys = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        with self._lock:
+            known = {key: self._cache[key] for key in keys if key in self._cache}
+            for key in known:
+                self._cache.move_to_end(key)
+        missing = {key: text for key, text in zip(keys, texts) if key not in known}
+
+        if missing:
+            counts = self._count_uncached(list(missing.values()))
+            if counts is None:
+                return estimate_token_counts(texts)
+            known.update(zip(missing, counts))
+            with self._lock:
+                for key, tokens in zip(missing, counts):
+                    self._cache[key] = tokens
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [known[key] for key in keys]
+
+    def build(self, question: str, docs: Sequence[Document], chat_history: Sequence) -> Prompt:
+        pieces = merge_chunks(docs)
+        turns = history_turns(chat_history)
+        texts = [question] + [piece.page_content for piece in pieces]
+        texts += [_message_content(message) for turn in turns for message in turn]
+        if self.system_tokens is None:
+            texts.append(self.system_prompt)
+        counts = self._count(texts)
+        if self.system_tokens is None:
+            self.system_tokens = counts.pop()
+
+        question_tokens = counts[0]
+        remaining = self.budget - self.system_tokens - question_tokens
+
+        context, context_tokens = [], 0
+        for piece, tokens in zip(pieces, counts[1:]):
+            if context and tokens > remaining:
+                break
+            context.append(piece)
+            context_tokens += tokens
+            remaining -= tokens
+
+        # Токены реплик истории по порядку
+        message_counts = iter(counts[1 + len(pieces):])
+        turn_tokens = [sum(next(message_counts) for _ in turn) for turn in turns]
+
+        kept_turns, history_tokens = [], 0
+        for turn, tokens in zip(reversed(turns), reversed(turn_tokens)):
+            if tokens > remaining:
+                break
+            kept_turns.append(turn)
+            history_tokens += tokens
+            remaining -= tokens
+        history = [message for turn in reversed(kept_turns) for message in turn]
+
+        token_counts = {
+            "system": self.system_tokens,
+            "question": question_tokens,
+            "context": context_tokens,
+            "history": history_tokens,
+            "total": self.system_tokens + question_tokens + context_tokens + history_tokens,
+            "context_chunks": len(context),
+            "history_messages": len(history),
+            "dropped_history_messages": len(chat_history) - len(history),
+        }
+        return Prompt(context, history, token_counts)
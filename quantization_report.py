@@ -0,0 +1,159 @@
+"""
+Отчёт «полнота поиска — память» для режимов квантования векторного индекса.
+
+Для каждого режима (none, int8, binary) и коэффициента пересчёта
+VECTOR_RESCORE_FACTOR считает recall@k относительно точного поиска,
+задержку поиска и память: данные первого прохода, которые должны
+находиться в памяти, файл идентификаторов, который каждый процесс бота
+загружает в свою кучу, и тексты с метаданными чанков (отображаются
+в память, страницы общие для всех процессов):
+
+    python quantization_report.py --queries 200 --k 5
+    python quantization_report.py --synthetic 500000 --output quant_report.json
+
+Запросы — векторы случайных чанков индекса с шумом (--noise задаёт норму
+шума относительно вектора; 1.0 даёт косинус ~0.7, как у реальных вопросов).
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from index_version import resolve_index_path
+from vector_index import (QUANTIZATION_MODES, VECTOR_INDEX_FILE, VECTOR_META_FILE, VECTOR_METADATA_PREFIX,
+                          VECTOR_TEXTS_PREFIX, VectorIndex, quantize)
+
+RESCORE_FACTORS = (1, 2, 4, 10, 20)
+
+
+def synthetic_index(num_chunks: int, dim: int = 768, num_topics: int = 1000, seed: int = 0) -> VectorIndex:
+    """Индекс из случайных векторов, сгруппированных вокруг тем (для оценки большого корпуса)"""
+    rng = np.random.RandomState(seed)
+    topics = rng.randn(num_topics, dim).astype(np.float32)
+    vectors = np.empty((num_chunks, dim), dtype=np.float32)
+    for start in range(0, num_chunks, 65536):
+        size = min(65536, num_chunks - start)
+        vectors[start:start + size] = topics[rng.randint(0, num_topics, size)] + rng.randn(size, dim)
+    ids = [str(i) for i in range(num_chunks)]
+    return VectorIndex.build(ids, vectors, ids, [{} for _ in ids], quantization="none")
+
+
+def make_queries(index: VectorIndex, num_queries: int, noise: float, seed: int = 1) -> np.ndarray:
+    rng = np.random.RandomState(seed)
+    rows = np.sort(rng.randint(0, len(index.ids), num_queries))
+    queries = np.asarray(index.vectors[rows], dtype=np.float32)
+    perturbation = rng.randn(*queries.shape).astype(np.float32)
+    perturbation *= noise / np.linalg.norm(perturbation, axis=1, keepdims=True)
+    return queries + perturbation
+
+
+def files_bytes(directory: str, prefixes) -> int:
+    """Суммарный размер файлов каталога, имена которых начинаются с одного из prefixes"""
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+               if name.startswith(tuple(prefixes)))
+
+
+def evaluate(index: VectorIndex, queries: np.ndarray, truth: List[set], k: int) -> Dict:
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = {doc_index for doc_index, _ in index.search(query, k)}
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(found & expected) / len(expected))
+    return {
+        "recall": float(np.mean(recalls)),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def run_report(base: VectorIndex, num_queries: int, k: int, noise: float) -> List[Dict]:
+    queries = make_queries(base, num_queries, noise)
+    # Эталон — точный поиск по float32
+    exact = VectorIndex(np.asarray(base.vectors, dtype=np.float32), base.ids, base.texts, base.metadatas)
+    truth = [{doc_index for doc_index, _ in exact.search(query, k)} for query in queries]
+
+    rows = []
+    workdir = tempfile.mkdtemp(prefix="rag-quant-")
+    try:
+        for mode in QUANTIZATION_MODES:
+            rows.extend(_evaluate_mode(base, mode, os.path.join(workdir, mode), queries, truth, k))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return rows
+
+
+def _evaluate_mode(base: VectorIndex, mode: str, directory: str, queries: np.ndarray,
+                   truth: List[set], k: int) -> List[Dict]:
+    index = VectorIndex(base.vectors, base.ids, base.texts, base.metadatas, base.partitions)
+    if mode != "none":
+        index.quantization = mode
+        index.codes, index.scales = quantize(base.vectors, mode)
+    # Поиск по сохранённому индексу, как в боте: матрица и коды через mmap
+    os.makedirs(directory)
+    index.save(directory)
+    index = VectorIndex.load(directory)
+    # Идентификаторы и разделы загружаются в кучу каждого процесса
+    sidecar_mb = os.path.getsize(os.path.join(directory, VECTOR_META_FILE)) / 2 ** 20
+    # Тексты и метаданные отображаются в память и делятся процессами
+    texts_mb = files_bytes(directory, (VECTOR_TEXTS_PREFIX, VECTOR_METADATA_PREFIX)) / 2 ** 20
+
+    rows = []
+    for factor in RESCORE_FACTORS if mode != "none" else (None,):
+        if factor is not None:
+            index.rescore_factor = factor
+        row = {
+            "mode": mode,
+            "rescore_factor": factor,
+            "memory_mb": index.memory_bytes() / 2 ** 20,
+            "bytes_per_vector": index.memory_bytes() / len(index.ids),
+            "sidecar_mb": sidecar_mb,
+            "texts_mb": texts_mb,
+            "total_mb": index.memory_bytes() / 2 ** 20 + sidecar_mb + texts_mb,
+            **evaluate(index, queries, truth, k),
+        }
+        rows.append(row)
+        print(f"{mode:<8}{factor or '-':>8}{row['recall']:>10.3f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+              f"{row['memory_mb']:>12.1f}{row['bytes_per_vector']:>10.0f}{sidecar_mb:>10.1f}{texts_mb:>12.1f}"
+              f"{row['total_mb']:>11.1f}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Полнота поиска и память для режимов квантования")
+    parser.add_argument("--index", default=resolve_index_path(),
+                        help="каталог с векторным индексом (по умолчанию — активная версия)")
+    parser.add_argument("--synthetic", type=int, default=0, help="вместо индекса — N случайных векторов")
+    parser.add_argument("--queries", type=int, default=200, help="число запросов")
+    parser.add_argument("--k", type=int, default=5, help="число результатов поиска (как RagPipeline.k)")
+    parser.add_argument("--noise", type=float, default=1.0, help="норма шума запроса относительно вектора")
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        base = synthetic_index(args.synthetic)
+    elif os.path.exists(os.path.join(args.index, VECTOR_INDEX_FILE)):
+        base = VectorIndex.load(args.index)
+    else:
+        parser.error(f"В {args.index} нет векторного индекса, запустите ingest.py или укажите --synthetic")
+
+    print(f"Чанков: {len(base.ids)}, размерность: {base.vectors.shape[1]}, k={args.k}, запросов: {args.queries}")
+    print(f"{'Режим':<8}{'Пересч.':>8}{'Recall':>10}{'p50, мс':>10}{'p99, мс':>10}{'Память, МБ':>12}{'Байт/вект':>10}"
+          f"{'Id, МБ':>10}{'Тексты, МБ':>12}{'Всего, МБ':>11}")
+    rows = run_report(base, args.queries, args.k, args.noise)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"chunks": len(base.ids), "k": args.k, "noise": args.noise, "results": rows},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import math
+import os
+import pickle
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from text_utils import tokenize
+from vector_index import VectorIndex
+
+# Файл маршрутизатора запросов внутри каталога Chroma
+ROUTER_FILE = "router.pkl"
+# Маршрутизация вопросов по разделам индекса (законам); 0 — всегда глобальный поиск
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+# Минимальный отрыв близости лучшего центроида от второго, чтобы выбрать один закон
+ROUTER_MARGIN = float(os.getenv("ROUTER_MARGIN", "0.05"))
+# Больше разделов по ключевым словам — вопрос общий, поиск по всему индексу
+ROUTER_MAX_PARTITIONS = int(os.getenv("ROUTER_MAX_PARTITIONS", "2"))
+# Минимальная сумма весов ключевых слов лучшего раздела (вес терма ~ доля его чанков в разделе
+# на log(1 + число чанков)); при меньшей вопрос маршрутизируется по центроидам
+ROUTER_MIN_KEYWORD_SCORE = float(os.getenv("ROUTER_MIN_KEYWORD_SCORE", "2.0"))
+# Раздел остаётся кандидатом, если уступает лучшему меньше этой доли его оценки
+ROUTER_KEYWORD_MARGIN = float(os.getenv("ROUTER_KEYWORD_MARGIN", "0.5"))
+# Ключевые слова раздела: доля чанков с термом, попавших в раздел, и сколько термов хранить
+ROUTER_KEYWORD_PURITY = float(os.getenv("ROUTER_KEYWORD_PURITY", "0.9"))
+ROUTER_KEYWORDS_PER_PARTITION = int(os.getenv("ROUTER_KEYWORDS_PER_PARTITION", "200"))
+ROUTER_KEYWORD_MIN_CHUNKS = 3
+
+# Версия формата файла; при несовпадении маршрутизатор нужно пересобрать
+_FORMAT_VERSION = 1
+
+
+class QueryRouter:
+    """
+    Выбор разделов индекса (законов), в которых искать ответ на вопрос.
+
+    Сначала проверяются ключевые слова — стеммы, встречающиеся почти только
+    в одном законе. Их сумма для лучшего раздела должна быть не меньше
+    min_keyword_score, а разделы, отстающие от лучшего больше чем на долю
+    keyword_margin, отбрасываются. Без уверенного совпадения по ключевым
+    словам вопрос сравнивается с центроидами эмбеддингов законов. Если ни
+    то, ни другое не даёт уверенного ответа, route() возвращает None
+    и поиск идёт по всему индексу.
+    """
+
+    def __init__(self, names: List[str], centroids: np.ndarray, keywords: Dict[str, Dict[str, float]],
+                 margin: float = ROUTER_MARGIN, max_partitions: int = ROUTER_MAX_PARTITIONS,
+                 min_keyword_score: float = ROUTER_MIN_KEYWORD_SCORE,
+                 keyword_margin: float = ROUTER_KEYWORD_MARGIN):
+        self.names = names
+        self.centroids = centroids
+        # Терм -> {раздел: вес}
+        self.keywords = keywords
+        self.margin = margin
+        self.max_partitions = max_partitions
+        self.min_keyword_score = min_keyword_score
+        self.keyword_margin = keyword_margin
+
+    @classmethod
+    def build(cls, index: VectorIndex, purity: float = ROUTER_KEYWORD_PURITY,
+              keywords_per_partition: int = ROUTER_KEYWORDS_PER_PARTITION) -> "QueryRouter":
+        """Центроиды и ключевые слова разделов векторного индекса"""
+        names, centroids = index.centroids()
+
+        # В скольких чанках каждого раздела встречается терм
+        document_frequency: Dict[str, Counter] = {}
+        for name in names:
+            start, stop = index.partitions[name]
+            counts = Counter()
+            for text in index.texts[start:stop]:
+                counts.update(set(tokenize(text)))
+            document_frequency[name] = counts
+
+        total = Counter()
+        for counts in document_frequency.values():
+            total.update(counts)
+
+        keywords: Dict[str, Dict[str, float]] = {}
+        for name, counts in document_frequency.items():
+            # Числа (номера статей, годы) встречаются во всех законах и не указывают на раздел
+            distinctive = [
+                (term, count) for term, count in counts.items()
+                if count >= ROUTER_KEYWORD_MIN_CHUNKS and count / total[term] >= purity and not term.isdigit()
+            ]
+            # Чаще встречающиеся в разделе термы надёжнее указывают на него
+            distinctive.sort(key=lambda item: item[1], reverse=True)
+            for term, count in distinctive[:keywords_per_partition]:
+                weight = count / total[term] * math.log(1 + count)
+                keywords.setdefault(term, {})[name] = weight
+
+        return cls(names, centroids, keywords)
+
+    def route(self, question: str, embedding: Optional[Sequence[float]] = None) -> Optional[List[str]]:
+        """Разделы для поиска или None, если искать нужно по всему индексу"""
+        if len(self.names) < 2:
+            return None
+
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(question)):
+            for name, weight in self.keywords.get(term, {}).items():
+                scores[name] = scores.get(name, 0.0) + weight
+        if scores:
+            ranked = sorted(scores, key=scores.get, reverse=True)
+            best = scores[ranked[0]]
+            if best >= self.min_keyword_score:
+                # Случайные слабые совпадения с другими законами не расширяют поиск
+                close = [name for name in ranked if best - scores[name] < self.keyword_margin * best]
+                return close if len(close) <= self.max_partitions else None
+
+        if embedding is None or not len(self.centroids):
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return None
+        similarity = self.centroids @ (query / norm)
+        best, second = np.argsort(-similarity)[:2]
+        if similarity[best] - similarity[second] < self.margin:
+            return None
+        return [self.names[best]]
+
+    def save(self, path: str):
+        """Сохранение маршрутизатора (через временный файл)"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "version": _FORMAT_VERSION,
+                "names": self.names,
+                "centroids": self.centroids,
+                "keywords": self.keywords,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "QueryRouter":
+        """Загрузка маршрутизатора, построенного ingest.py"""
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") != _FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия маршрутизатора в {path}, пересоберите индекс")
+        return cls(data["names"], data["centroids"], data["keywords"])
@@ -0,0 +1,117 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация пула (можно переопределить через .env)
+RAG_WORKERS = int(os.getenv("RAG_WORKERS", "4"))
+RAG_QUEUE_SIZE = int(os.getenv("RAG_QUEUE_SIZE", "32"))
+
+
+class RagOverloadedError(Exception):
+    """Очередь RAG-запросов переполнена"""
+    pass
+
+
+class RagExecutor:
+    """
+    Пул потоков для синхронной части RAG-конвейера (поиск + генерация).
+
+    Блокирующие вызовы Chroma/Ollama/GigaChat выполняются вне event loop,
+    одновременно выполняется не более max_workers запросов, а в очереди
+    ожидает не более max_queue. Остальные запросы сразу отклоняются.
+    """
+
+    def __init__(self, max_workers: int = RAG_WORKERS, max_queue: int = RAG_QUEUE_SIZE):
+        if max_workers < 1:
+            raise ValueError("max_workers должен быть >= 1")
+        if max_queue < 0:
+            raise ValueError("max_queue должен быть >= 0")
+
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-worker")
+        # Счётчик меняется только из event loop, поэтому блокировка не нужна
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Количество выполняемых и ожидающих задач"""
+        return self._pending
+
+    @property
+    def queued(self) -> int:
+        """Количество задач, ожидающих свободного потока"""
+        return max(0, self._pending - self.max_workers)
+
+    def _admit(self):
+        """Резервирование места в очереди"""
+        if self._pending >= self.max_workers + self.max_queue:
+            raise RagOverloadedError(
+                f"Очередь заполнена: {self._pending} задач при лимите "
+                f"{self.max_workers + self.max_queue}"
+            )
+        self._pending += 1
+
+    def _release(self, *_):
+        self._pending -= 1
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Выполняет func(*args, **kwargs) в пуле потоков
+
+        Raises:
+            RagOverloadedError: Если очередь заполнена
+        """
+        self._admit()
+        try:
+            loop = asyncio.get_running_loop()
+            # Контекст (id запроса для метрик) передаётся в поток пула
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._pool, functools.partial(context.run, func, *args, **kwargs))
+        finally:
+            self._release()
+
+    async def iterate(self, func: Callable[..., Iterator[Any]], *args, **kwargs) -> AsyncIterator[Any]:
+        """
+        Выполняет синхронный генератор func(*args, **kwargs) в пуле потоков
+        и отдаёт его элементы в event loop по мере появления
+
+        Raises:
+            RagOverloadedError: Если очередь заполнена
+        """
+        self._admit()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+
+        def produce():
+            try:
+                for item in func(*args, **kwargs):
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (finished, e))
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, (finished, None))
+
+        # Место в очереди освобождается, когда генератор отработал полностью
+        context = contextvars.copy_context()
+        loop.run_in_executor(self._pool, context.run, produce).add_done_callback(self._release)
+
+        while True:
+            item, error = await queue.get()
+            if item is finished:
+                if error is not None:
+                    raise error
+                return
+            yield item
+
+    def shutdown(self, wait: bool = True):
+        """Остановка пула потоков"""
+        logger.info("Остановка пула RAG-исполнителей...")
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,143 @@
+import logging
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from answer_cache import AnswerCache
+from citation_index import CitationIndex
+from embedding_cache import CachedEmbeddings
+from metrics import CACHE_HITS, CACHE_MISSES, ROUTED, STAGE_SECONDS, observe_prompt_tokens, span
+from prompt_builder import PromptBuilder
+from retrievers import VectorRetriever
+
+logger = logging.getLogger(__name__)
+
+
+class RagPipeline:
+    """
+    RAG-конвейер: эмбеддинг вопроса, поиск чанков и генерация ответа.
+
+    Эмбеддинг вопроса считается один раз и используется и для поиска,
+    и для семантического кэша ответов. Вопрос с явной ссылкой на статью
+    или главу закона обслуживается индексом ссылок без эмбеддинга.
+    """
+
+    def __init__(self, db, document_chain, persist_directory: str,
+                 answer_cache: Optional[AnswerCache] = None, retriever=None,
+                 prompt_builder: Optional[PromptBuilder] = None, k: int = 3,
+                 citation_index: Optional[CitationIndex] = None):
+        self.db = db
+        self.retriever = retriever or VectorRetriever(db)
+        self.prompt_builder = prompt_builder or PromptBuilder()
+        self.document_chain = document_chain
+        self.persist_directory = persist_directory
+        self.answer_cache = answer_cache
+        self.citation_index = citation_index
+        self.k = k
+
+    def retrieve(self, question: str, k: Optional[int] = None) -> Tuple[Optional[List[float]], List[Document]]:
+        """
+        Поиск релевантных чанков, возвращает эмбеддинг вопроса и документы.
+
+        Для вопроса со ссылкой на статью возвращается вся статья целиком
+        (без ограничения k), а эмбеддинг равен None.
+        """
+        if self.citation_index is not None:
+            with span("citation_lookup"):
+                docs = self.citation_index.lookup(question)
+            if docs:
+                ROUTED.inc(route="citation")
+                return None, docs
+        with span("embed_query"):
+            embedding = self.db.embeddings.embed_query(question)
+        with span("search"):
+            docs = self.retriever.search(question, embedding, k=k or self.k)
+        return embedding, docs
+
+    def warmup(self, question: str):
+        """
+        Прогрев: эмбеддинг вопроса и поиск.
+
+        Эмбеддинг считается мимо кэша эмбеддингов — иначе повторный прогрев
+        тем же вопросом получит вектор из кэша и не загрузит модель Ollama.
+        """
+        embeddings = self.db.embeddings
+        if isinstance(embeddings, CachedEmbeddings):
+            embeddings = embeddings.embeddings
+        with span("embed_query"):
+            embedding = embeddings.embed_query(question)
+        with span("search"):
+            self.retriever.search(question, embedding, k=self.k)
+
+    def close(self):
+        """Освобождение ресурсов: поток пакетирования эмбеддингов, соединения SQLite и Chroma"""
+        close_embeddings = getattr(self.db.embeddings, "close", None)
+        if close_embeddings is not None:
+            close_embeddings()
+        if self.answer_cache is not None:
+            self.answer_cache.close()
+        _close_chroma(self.db)
+
+    def stream(self, question: str, chat_history: list) -> Iterator[str]:
+        """Потоковый ответ на вопрос: фрагменты текста по мере генерации"""
+        embedding, docs = self.retrieve(question)
+        yield from self.generate(question, chat_history, embedding, docs)
+
+    def generate(self, question: str, chat_history: list, embedding: Optional[List[float]],
+                 docs: List[Document]) -> Iterator[str]:
+        """Потоковая генерация ответа по результатам retrieve()"""
+        # Семантический кэш работает по эмбеддингу, его нет у ответов по ссылке на статью.
+        # Ответ с историей диалога зависит от чужой для других пользователей переписки:
+        # такие ответы из кэша не берутся и в него не записываются
+        use_cache = self.answer_cache is not None and embedding is not None and not chat_history
+        if use_cache:
+            with span("cache_lookup"):
+                cached = self.answer_cache.lookup(embedding, docs)
+            if cached is not None:
+                CACHE_HITS.inc(cache="answer")
+                logger.info("Ответ взят из кэша")
+                yield cached
+                return
+            CACHE_MISSES.inc(cache="answer")
+
+        with span("prompt_build"):
+            prompt = self.prompt_builder.build(question, docs, chat_history)
+        observe_prompt_tokens(prompt.token_counts)
+        logger.info(f"Размер промпта в токенах: {prompt.token_counts}")
+
+        pieces = []
+        start = time.perf_counter()
+        with span("llm"):
+            for piece in self.document_chain.stream({
+                "question": question,
+                "context": prompt.context,
+                "chat_history": prompt.chat_history
+            }):
+                if not pieces:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm_first_token")
+                pieces.append(piece)
+                yield piece
+
+        # В кэш попадает только полностью сгенерированный ответ
+        if use_cache:
+            self.answer_cache.store(question, embedding, docs, "".join(pieces))
+
+    def answer(self, question: str, chat_history: list) -> str:
+        """Ответ на вопрос с учётом истории диалога"""
+        return "".join(self.stream(question, chat_history))
+
+
+def _close_chroma(db):
+    """Остановка клиента Chroma каталога индекса (у Chroma нет публичного close)"""
+    client = getattr(db, "_client", None)
+    if client is None:
+        return
+    from chromadb.api.shared_system_client import SharedSystemClient
+    try:
+        # Клиенты одного каталога делят System; убираем его из кэша, чтобы освободить память и SQLite
+        system = SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+        if system is not None:
+            system.stop()
+    except Exception as e:
+        logger.warning(f"Не удалось закрыть Chroma: {e}")
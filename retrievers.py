@@ -0,0 +1,116 @@
+import os
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+from answer_cache import chunk_id
+from bm25_index import BM25Index
+from metrics import ROUTED
+from query_router import QueryRouter
+from vector_index import PARTITION_KEY, VectorIndex
+
+# Размер списка кандидатов каждого поиска для слияния
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Константа k в reciprocal rank fusion
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+
+class VectorRetriever:
+    """Поиск только по векторам Chroma"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def search(self, question: str, embedding: Sequence[float], k: int,
+               partitions: Optional[Sequence[str]] = None) -> List[Document]:
+        if partitions:
+            return self.db.similarity_search_by_vector(
+                embedding, k=k, filter={PARTITION_KEY: {"$in": list(partitions)}}
+            )
+        return self.db.similarity_search_by_vector(embedding, k=k)
+
+
+class NumpyVectorRetriever:
+    """
+    Точный векторный поиск по матрице эмбеддингов в памяти процесса.
+
+    where — необязательный фильтр по метаданным (равенство полей),
+    применяется до поиска; partitions — разделы индекса для поиска.
+    """
+
+    def __init__(self, index: VectorIndex, where: Optional[Dict] = None):
+        self.index = index
+        self.where = where
+
+    def search(self, question: str, embedding: Sequence[float], k: int,
+               where: Optional[Dict] = None, partitions: Optional[Sequence[str]] = None) -> List[Document]:
+        index = self.index
+        return [
+            Document(id=index.ids[doc_index], page_content=index.texts[doc_index],
+                     metadata=index.metadatas[doc_index])
+            for doc_index, _ in index.search(embedding, k, where=where or self.where, partitions=partitions)
+        ]
+
+
+class HybridRetriever:
+    """
+    Гибридный поиск: векторный (Chroma или NumpyVectorRetriever) + лексический (BM25).
+
+    Списки кандидатов обоих поисков объединяются методом reciprocal rank
+    fusion: score = sum(1 / (rrf_k + rank)).
+    """
+
+    def __init__(self, db, lexical_index: BM25Index,
+                 candidates: int = HYBRID_CANDIDATES, rrf_k: int = RRF_K, vector_retriever=None):
+        self.db = db
+        self.lexical_index = lexical_index
+        self.vector_retriever = vector_retriever or VectorRetriever(db)
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    def search(self, question: str, embedding: Sequence[float], k: int,
+               partitions: Optional[Sequence[str]] = None) -> List[Document]:
+        candidates = max(k, self.candidates)
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Document] = {}
+
+        search_kwargs = {"partitions": partitions} if partitions else {}
+        vector_docs = self.vector_retriever.search(question, embedding, k=candidates, **search_kwargs)
+        for rank, doc in enumerate(vector_docs):
+            doc_id = chunk_id(doc)
+            docs[doc_id] = doc
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        index = self.lexical_index
+        lexical_filter = {PARTITION_KEY: set(partitions)} if partitions else None
+        for rank, (doc_index, _) in enumerate(index.search(question, k=candidates, where=lexical_filter)):
+            doc_id = index.ids[doc_index]
+            if doc_id not in docs:
+                docs[doc_id] = Document(
+                    id=doc_id,
+                    page_content=index.texts[doc_index],
+                    metadata=index.metadatas[doc_index]
+                )
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [docs[doc_id] for doc_id in ranked[:k]]
+
+
+class RoutedRetriever:
+    """
+    Поиск только в разделах индекса (законах), выбранных QueryRouter.
+
+    Если маршрутизатор не уверен, поиск идёт по всему индексу.
+    """
+
+    def __init__(self, retriever, router: QueryRouter):
+        self.retriever = retriever
+        self.router = router
+
+    def search(self, question: str, embedding: Sequence[float], k: int) -> List[Document]:
+        partitions = self.router.route(question, embedding)
+        ROUTED.inc(route="partition" if partitions else "global")
+        if not partitions:
+            return self.retriever.search(question, embedding, k=k)
+        return self.retriever.search(question, embedding, k=k, partitions=partitions)
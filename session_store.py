@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация хранилища (можно переопределить через .env)
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "./chat_histories.sqlite3")
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1000"))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "50"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1.0"))
+# Базу используют несколько процессов бота (режим webhook)
+SESSION_SHARED = os.getenv("SESSION_SHARED", "0") == "1"
+# Каталог историй в старом формате JSON (переносятся в базу при запуске бота)
+HISTORY_DIR = Path(os.getenv("CHAT_HISTORY_DIR", "chat_histories"))
+
+
+class SessionStore:
+    """
+    Хранилище истории диалогов.
+
+    Сообщения дописываются в таблицу SQLite (журнал WAL) пачками в фоновом
+    потоке раз в flush_interval секунд. Последние max_messages сообщений
+    активных пользователей держатся в LRU на cache_size сессий, поэтому
+    расход памяти не зависит от общего числа пользователей.
+
+    В режиме shared базу делят несколько процессов: кэш сессий отключён,
+    история читается с диска, а изменения записываются сразу. Методы
+    блокируют вызывающий поток на время обращения к диску, поэтому бот
+    вызывает их через asyncio.to_thread.
+    """
+
+    def __init__(
+            self,
+            path: str = SESSION_DB_PATH,
+            cache_size: int = SESSION_CACHE_SIZE,
+            max_messages: int = SESSION_MAX_MESSAGES,
+            flush_interval: float = SESSION_FLUSH_INTERVAL,
+            shared: bool = SESSION_SHARED,
+    ):
+        self.path = path
+        self.shared = shared
+        self.cache_size = 0 if shared else cache_size
+        self.max_messages = max_messages
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._sessions: "OrderedDict[int, List[Dict]]" = OrderedDict()
+        # Очередь операций write-behind: ("append", user_id, role, content, ts) или ("clear", user_id)
+        self._pending: List[tuple] = []
+        # Число операций, записанных на диск (время чтения и записи — в STAGE_SECONDS)
+        self.rows_written = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Периодический commit сбрасывается на диск (fsync). В общем режиме commit идёт
+        # на каждое сообщение: WAL с synchronous=NORMAL не теряет данные при падении
+        # процесса, а fsync выполняется только при контрольной точке
+        self._conn.execute(f"PRAGMA synchronous={'NORMAL' if shared else 'FULL'}")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_user ON messages (user_id, id)")
+        # Перенесённые файлы старого формата: повторный перенос их пропускает
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS migrated_files (
+                name TEXT PRIMARY KEY,
+                migrated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи истории: {e}")
+
+    def flush(self):
+        """Запись накопленных операций на диск"""
+        with self._db_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            self.rows_written += len(pending)
+
+            with span("session_flush"):
+                for op in pending:
+                    if op[0] == "append":
+                        _, user_id, role, content, created_at = op
+                        self._conn.execute(
+                            "INSERT INTO messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                            (user_id, role, content, created_at),
+                        )
+                    else:
+                        self._conn.execute("DELETE FROM messages WHERE user_id = ?", (op[1],))
+                self._conn.commit()
+
+    def _load(self, user_id: int) -> List[Dict]:
+        """Загрузка последних сообщений пользователя с диска"""
+        # Несохранённые операции должны попасть на диск до чтения
+        self.flush()
+        with self._db_lock, span("session_read"):
+            rows = self._conn.execute(
+                "SELECT role, content FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, self.max_messages),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def _session(self, user_id: int) -> List[Dict]:
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                self._sessions.move_to_end(user_id)
+                return session
+
+        session = self._load(user_id)
+        with self._lock:
+            # Сессию мог загрузить другой поток, пока мы читали диск
+            session = self._sessions.setdefault(user_id, session)
+            self._sessions.move_to_end(user_id)
+            while len(self._sessions) > self.cache_size:
+                self._sessions.popitem(last=False)
+        return session
+
+    def get_history(self, user_id: int, limit: Optional[int] = None) -> List[Dict]:
+        """Последние сообщения пользователя (не более max_messages)"""
+        session = self._session(user_id)
+        with self._lock:
+            return list(session[-limit:] if limit else session)
+
+    def append(self, user_id: int, role: str, content: str):
+        """Добавление сообщения в историю"""
+        session = self._session(user_id)
+        with self._lock:
+            session.append({"role": role, "content": content})
+            del session[:-self.max_messages]
+            self._pending.append(("append", user_id, role, content, time.time()))
+        if self.shared:
+            self.flush()
+
+    def clear(self, user_id: int):
+        """Очистка истории пользователя"""
+        with self._lock:
+            self._sessions[user_id] = []
+            self._sessions.move_to_end(user_id)
+            while len(self._sessions) > self.cache_size:
+                self._sessions.popitem(last=False)
+            self._pending.append(("clear", user_id))
+        if self.shared:
+            self.flush()
+
+    def migrate_json(self, history_dir: Path) -> int:
+        """
+        Перенос историй из старого формата chat_histories/<id>.json.
+
+        Сообщения файла и отметка о его переносе записываются в одной
+        транзакции, поэтому повторный запуск (в том числе после сбоя
+        или из другого процесса) не дублирует историю. Перенесённые
+        файлы переименовываются в <id>.json.migrated.
+        """
+        migrated = 0
+        for history_file in sorted(Path(history_dir).glob("*.json")):
+            try:
+                user_id = int(history_file.stem)
+                with open(history_file, "r", encoding="utf-8") as f:
+                    history = json.load(f)
+
+                now = time.time()
+                with self._db_lock:
+                    imported = self._conn.execute(
+                        "INSERT OR IGNORE INTO migrated_files (name, migrated_at) VALUES (?, ?)",
+                        (history_file.name, now),
+                    ).rowcount
+                    if imported:
+                        self._conn.executemany(
+                            "INSERT INTO messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                            ((user_id, msg["role"], msg["content"], now) for msg in history),
+                        )
+                        self._conn.commit()
+                    else:
+                        self._conn.rollback()
+                if imported:
+                    with self._lock:
+                        self._sessions.pop(user_id, None)
+                    migrated += 1
+
+                history_file.rename(history_file.with_name(history_file.name + ".migrated"))
+            except Exception as e:
+                with self._db_lock:
+                    self._conn.rollback()
+                logger.error(f"Ошибка переноса истории {history_file}: {e}")
+
+        if migrated:
+            logger.info(f"Перенесено {migrated} историй из {history_dir} в {self.path}")
+        return migrated
+
+    def close(self):
+        """Остановка фоновой записи и сброс оставшихся операций"""
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
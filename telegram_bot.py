@@ -1,9 +1,16 @@
 import os
+import asyncio
 import logging
-from typing import Dict, List
-from telegram import Update, ReplyKeyboardMarkup
+import time
+from typing import Any, Awaitable, Dict, List, Optional
+from telegram import Message, Update, ReplyKeyboardMarkup
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import BaseRequest
 from telegram.ext import (
     Application,
+    BasePersistence,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     filters,
@@ -11,9 +18,11 @@ from telegram.ext import (
     ConversationHandler,
 )
 from dotenv import load_dotenv
-import json
-from pathlib import Path
-from custom_gigachat import initialize_rag
+from admission import AdmissionController, SingleFlight, UserRateLimiter, coalescing_key
+from metrics import COALESCED, RATE_LIMITED, REQUESTS, new_request_id, span, start_metrics_server
+from pipeline_loader import PipelineLoader
+from rag_executor import RagExecutor, RagOverloadedError
+from session_store import HISTORY_DIR, SessionStore
 from langchain_core.messages import HumanMessage, AIMessage
 
 # Загрузка переменных окружения
@@ -28,14 +37,78 @@ logger = logging.getLogger(__name__)
 
 # Конфигурация
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-HISTORY_DIR = Path("chat_histories")
-HISTORY_DIR.mkdir(exist_ok=True)
+# Максимум одновременно обрабатываемых обновлений Telegram
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+# Потоковая выдача ответа через редактирование сообщения
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "1") == "1"
+# Минимальный интервал между редактированиями одного сообщения (сек)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+# Адрес сервера Bot API (по умолчанию https://api.telegram.org)
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "").rstrip("/")
+# Приём сообщений до готовности RAG-конвейера (0 — ждать инициализации перед запуском)
+LAZY_STARTUP = os.getenv("LAZY_STARTUP", "1") == "1"
 
 # Состояния для ConversationHandler
 MAIN_MENU, CHATTING = range(2)
 
-# Инициализация RAG системы
-db, document_chain = initialize_rag()
+# Инициализация RAG системы выполняется в фоне при запуске бота
+pipeline_loader = PipelineLoader()
+
+# Пул потоков для блокирующих вызовов поиска и генерации
+rag_executor = RagExecutor()
+
+# Ограничение частоты вопросов, одновременных вызовов LLM и объединение одинаковых вопросов
+rate_limiter = UserRateLimiter()
+admission = AdmissionController()
+single_flight = SingleFlight()
+
+# Хранилище истории диалогов
+session_store = SessionStore()
+
+
+def migrate_histories(store: SessionStore = session_store) -> int:
+    """Перенос историй старого формата из HISTORY_DIR (повторный запуск ничего не дублирует)"""
+    if not HISTORY_DIR.exists():
+        return 0
+    return store.migrate_json(HISTORY_DIR)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений разных пользователей.
+
+    Обновления одного пользователя обрабатываются строго по очереди,
+    поэтому состояние ConversationHandler и история диалога не гонятся.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._user_waiters: Dict[int, int] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+
+        lock = self._user_locks.setdefault(user.id, asyncio.Lock())
+        self._user_waiters[user.id] = self._user_waiters.get(user.id, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            # Удаляем блокировку, когда у пользователя не осталось обновлений
+            self._user_waiters[user.id] -= 1
+            if not self._user_waiters[user.id]:
+                del self._user_waiters[user.id]
+                del self._user_locks[user.id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
 
 
 class TelegramChatWrapper:
@@ -43,49 +116,25 @@ class TelegramChatWrapper:
 
     def __init__(self, user_id: int):
         self.user_id = user_id
-        self.history_file = HISTORY_DIR / f"{user_id}.json"
-        self.history: List[Dict] = []
-        self.load_history()
-
-    def load_history(self):
-        """Загрузка истории из файла"""
-        if self.history_file.exists():
-            try:
-                with open(self.history_file, "r", encoding="utf-8") as f:
-                    self.history = json.load(f)
-            except Exception as e:
-                logger.error(f"Ошибка загрузки истории: {e}")
-                self.history = []
-        else:
-            self.history = []
-
-    def save_history(self):
-        """Сохранение истории в файл"""
-        try:
-            with open(self.history_file, "w", encoding="utf-8") as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Ошибка сохранения истории: {e}")
+
+    @property
+    def history(self) -> List[Dict]:
+        """Последние сообщения пользователя"""
+        return session_store.get_history(self.user_id)
 
     def add_message(self, role: str, content: str):
         """Добавление сообщения в историю"""
-        self.history.append({"role": role, "content": content})
-        self.save_history()
+        session_store.append(self.user_id, role, content)
 
     def clear_history(self):
         """Очистка истории диалога"""
-        self.history = []
-        if self.history_file.exists():
-            try:
-                self.history_file.unlink()
-            except Exception as e:
-                logger.error(f"Ошибка удаления файла истории: {e}")
+        session_store.clear(self.user_id)
         logger.info(f"История очищена для пользователя {self.user_id}")
 
     def get_langchain_messages(self):
         """Преобразование истории в формат LangChain"""
         messages = []
-        for msg in self.history[-10:]:
+        for msg in session_store.get_history(self.user_id, limit=10):
             if msg["role"] == "user":
                 messages.append(HumanMessage(content=msg["content"]))
             else:
@@ -93,6 +142,73 @@ class TelegramChatWrapper:
         return messages
 
 
+class StreamingReply:
+    """
+    Прогрессивная отправка ответа: первое сообщение отправляется с первым
+    фрагментом текста, затем редактируется не чаще раза в interval секунд.
+    Текст длиннее лимита Telegram продолжается в следующем сообщении.
+    """
+
+    def __init__(self, message: Message, interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self.text = ""
+        # Начало текста текущего (редактируемого) сообщения
+        self._offset = 0
+        self._current: Optional[Message] = None
+        self._shown = ""
+        self._last_edit = 0.0
+
+    async def append(self, piece: str):
+        """Добавление фрагмента ответа"""
+        self.text += piece
+        if time.monotonic() - self._last_edit >= self.interval:
+            await self._flush()
+
+    async def finish(self) -> str:
+        """Отправка оставшегося текста, возвращает полный ответ"""
+        await self._flush()
+        return self.text
+
+    async def _flush(self):
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        while True:
+            text = self.text[self._offset:]
+            if len(text) > limit:
+                # Закрываем текущее сообщение и переносим остаток в новое
+                await self._show(text[:limit])
+                self._offset += limit
+                self._current = None
+                self._shown = ""
+                continue
+            if text.strip() and text != self._shown:
+                await self._show(text)
+            return
+
+    async def _show(self, text: str):
+        try:
+            with span("telegram_send"):
+                if self._current is None:
+                    self._current = await self.message.reply_text(text)
+                else:
+                    await self._current.edit_text(text)
+        except RetryAfter as e:
+            # Превышен лимит Telegram: ждём и повторяем
+            retry_after = e.retry_after
+            await asyncio.sleep(getattr(retry_after, "total_seconds", lambda: retry_after)())
+            return await self._show(text)
+        except BadRequest as e:
+            if "not modified" not in str(e):
+                raise
+        self._shown = text
+        self._last_edit = time.monotonic()
+
+
+def generate_answer(rag_pipeline, question: str, history: List, embedding: Optional[List[float]], docs: List) -> str:
+    """Синхронная генерация ответа по найденным документам"""
+    return "".join(rag_pipeline.generate(question, history, embedding, docs))
+
+
 # Клавиатура главного меню
 main_menu_keyboard = [
     ["📢 Начать консультацию"],
@@ -169,7 +285,8 @@ async def end_consultation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик завершения консультации"""
     user_id = update.effective_user.id
     chat_wrapper = TelegramChatWrapper(user_id)
-    chat_wrapper.clear_history()
+    # Запись в SQLite (в общем режиме — с фиксацией на диске) идёт вне event loop
+    await asyncio.to_thread(chat_wrapper.clear_history)
 
     await update.message.reply_text(
         "🧹 История диалога очищена. Вы можете начать новую консультацию.",
@@ -190,34 +307,88 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return MAIN_MENU
 
-    chat_wrapper = TelegramChatWrapper(user_id)
-    chat_wrapper.add_message("user", user_message)
-
-    try:
-        # Показываем индикатор набора сообщения
-        await update.message.reply_chat_action(action="typing")
-
-        # Получаем историю в формате LangChain
-        history = chat_wrapper.get_langchain_messages()
-
-        # Поиск релевантных документов
-        results = db.similarity_search(user_message, k=3)
-
-        # Формируем входные данные для RAG
-        inputs = {
-            "question": user_message,
-            "context": results,
-            "chat_history": history
-        }
+    # Конвейер не закрывается перезагрузкой индекса, пока запрос не завершён
+    with pipeline_loader.lease() as rag_pipeline:
+        if rag_pipeline is None:
+            await update.message.reply_text(
+                "🔄 Ассистент запускается. Пожалуйста, повторите вопрос через минуту."
+            )
+            return CHATTING
+        return await answer_question(update, rag_pipeline, user_id, user_message)
+
+
+async def answer_question(update: Update, rag_pipeline, user_id: int, user_message: str):
+    """Ответ на вопрос пользователя конвейером rag_pipeline"""
+    retry_after = rate_limiter.acquire(user_id)
+    if retry_after:
+        RATE_LIMITED.inc()
+        await update.message.reply_text(
+            f"⏳ Вы задаёте вопросы слишком часто. Повторите вопрос через {max(1, round(retry_after))} сек."
+        )
+        return CHATTING
 
-        # Получаем ответ от RAG
-        response = document_chain.invoke(inputs)
+    # Идентификатор запроса попадает в структурированные логи всех этапов
+    new_request_id()
+    REQUESTS.inc(mode="stream" if STREAMING_ENABLED else "batch")
 
-        # Сохраняем ответ в историю
-        chat_wrapper.add_message("assistant", response)
+    async def notify_queued(position: int):
+        try:
+            await update.message.reply_text(
+                f"🕒 Ваш вопрос в очереди: {position}. Ответ начнёт формироваться, как только освободится место."
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить позицию в очереди: {e}")
 
-        # Отправляем ответ пользователю
-        await update.message.reply_text(response)
+    chat_wrapper = TelegramChatWrapper(user_id)
+    try:
+        with span("total", user_id=user_id):
+            with span("history_load"):
+                # История без текущего вопроса: он передаётся в prompt отдельно
+                # Чтение и запись SQLite выполняются вне event loop
+                history = await asyncio.to_thread(chat_wrapper.get_langchain_messages)
+                await asyncio.to_thread(chat_wrapper.add_message, "user", user_message)
+
+            # Показываем индикатор набора сообщения
+            await update.message.reply_chat_action(action="typing")
+
+            # Поиск и генерация выполняются в пуле потоков, не блокируя event loop
+            with span("rag"):
+                embedding, docs = await rag_executor.run(rag_pipeline.retrieve, user_message)
+
+                async def generate():
+                    # Вызов LLM занимает одно из LLM_MAX_IN_FLIGHT мест
+                    async with admission.slot(on_queued=notify_queued):
+                        if STREAMING_ENABLED:
+                            # Ответ показывается по мере генерации
+                            reply = StreamingReply(update.message)
+                            async for piece in rag_executor.iterate(
+                                    rag_pipeline.generate, user_message, history, embedding, docs):
+                                await reply.append(piece)
+                            return await reply.finish()
+
+                        answer = await rag_executor.run(
+                            generate_answer, rag_pipeline, user_message, history, embedding, docs)
+                        with span("telegram_send"):
+                            await update.message.reply_text(answer)
+                        return answer
+
+                # Одинаковый вопрос с тем же контекстом и историей, который уже генерируется, ждёт общий ответ
+                response, shared = await single_flight.run(coalescing_key(user_message, docs, history), generate)
+                if shared:
+                    COALESCED.inc()
+                    reply = StreamingReply(update.message)
+                    await reply.append(response)
+                    await reply.finish()
+
+            # Сохраняем полный ответ в историю
+            with span("history_save"):
+                await asyncio.to_thread(chat_wrapper.add_message, "assistant", response)
+
+    except RagOverloadedError as e:
+        logger.warning(f"Запрос пользователя {user_id} отклонён: {e}")
+        await update.message.reply_text(
+            "⏳ Сейчас поступает слишком много вопросов. Пожалуйста, повторите попытку через минуту."
+        )
 
     except Exception as e:
         logger.error(f"Ошибка обработки запроса: {e}")
@@ -267,10 +438,38 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return MAIN_MENU
 
 
-def main():
-    """Основная функция запуска бота"""
-    # Создаем приложение
-    application = Application.builder().token(TOKEN).build()
+async def post_shutdown(application: Application):
+    """Освобождение ресурсов после остановки бота"""
+    pipeline_loader.stop()
+    rag_executor.shutdown()
+    session_store.close()
+
+
+def build_application(persistence: Optional[BasePersistence] = None, updater: bool = True,
+                      request: Optional[BaseRequest] = None) -> Application:
+    """
+    Создание приложения с обработчиками.
+
+    persistence — общее хранилище состояний диалогов (режим webhook);
+    updater=False — обновления передаются в application.update_queue извне;
+    request — транспорт запросов к Bot API (заглушка в нагрузочном тесте).
+    """
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_BASE_URL:
+        # Локальный сервер Bot API (например, fake_telegram.py для тестов)
+        builder = builder.base_url(f"{TELEGRAM_API_BASE_URL}/bot")
+    if request is not None:
+        builder = builder.request(request)
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
 
     # Настройка ConversationHandler
     conv_handler = ConversationHandler(
@@ -299,12 +498,29 @@ def main():
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="consultation",
+        persistent=persistence is not None,
     )
 
     # Регистрируем обработчики
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("start", start))
+    return application
+
+
+def main():
+    """Основная функция запуска бота (long polling, один процесс)"""
+    migrate_histories()
+    application = build_application()
+
+    # HTTP-эндпоинт /metrics для Prometheus и /ready для проверки готовности
+    start_metrics_server()
+
+    # RAG-конвейер инициализируется и прогревается, пока бот уже принимает сообщения
+    pipeline_loader.start()
+    if not LAZY_STARTUP:
+        pipeline_loader.wait()
 
     # Запускаем бота
     logger.info("Бот запущен...")
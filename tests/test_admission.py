@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+import admission
+from admission import AdmissionController, SingleFlight, TokenBucket, UserRateLimiter, coalescing_key
+from rag_executor import RagOverloadedError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"time": 1000.0}
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now["time"])
+    return now
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = TokenBucket(rate=0.5, capacity=2)
+    assert bucket.acquire() == 0 and bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(2.0)
+    clock["time"] += 1
+    assert bucket.acquire() == pytest.approx(1.0)
+    clock["time"] += 1
+    assert bucket.acquire() == 0
+    # Простой не накапливает токенов сверх capacity
+    clock["time"] += 100
+    assert bucket.full
+    assert [bucket.acquire() for _ in range(3)][-1] > 0
+
+
+def test_user_rate_limiter_is_per_user(clock):
+    limiter = UserRateLimiter(per_minute=6, burst=2)
+    assert limiter.acquire(1) == 0 and limiter.acquire(1) == 0
+    assert limiter.acquire(1) == pytest.approx(10.0)
+    assert limiter.acquire(2) == 0
+    assert UserRateLimiter(per_minute=0).acquire(1) == 0
+
+
+def test_admission_queues_in_order_and_rejects_overflow():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queued=1)
+        release = asyncio.Event()
+        order, positions = [], []
+
+        async def request(name):
+            async def on_queued(position):
+                positions.append((name, position))
+            async with controller.slot(on_queued):
+                order.append(name)
+                await release.wait()
+
+        first = asyncio.create_task(request("first"))
+        second = asyncio.create_task(request("second"))
+        await asyncio.sleep(0)
+        assert controller.in_flight == 1 and controller.queued == 1
+        with pytest.raises(RagOverloadedError):
+            await request("third")
+
+        release.set()
+        await asyncio.gather(first, second)
+        assert order == ["first", "second"]
+        assert positions == [("second", 1)]
+        assert controller.in_flight == 0 and controller.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_frees_its_place():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, max_queued=2)
+        release = asyncio.Event()
+
+        async def request():
+            async with controller.slot():
+                await release.wait()
+
+        running = asyncio.create_task(request())
+        waiting = asyncio.create_task(request())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert controller.queued == 0
+
+        release.set()
+        await running
+        assert controller.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_single_flight_shares_one_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def generate():
+            calls.append(1)
+            await release.wait()
+            return "ответ"
+
+        tasks = [asyncio.create_task(flight.run("key", generate)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert flight.in_flight == 1
+        release.set()
+        results = await asyncio.gather(*tasks)
+        assert calls == [1]
+        assert sorted(results) == [("ответ", False), ("ответ", True), ("ответ", True)]
+        assert flight.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_single_flight_propagates_errors_and_forgets_key():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError("GigaChat недоступен")
+
+        tasks = [asyncio.create_task(flight.run("key", failing)) for _ in range(2)]
+        await asyncio.sleep(0)
+        release.set()
+        errors = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(error, RuntimeError) for error in errors)
+
+        async def succeeding():
+            return "ответ"
+        # После ошибки ключ свободен: следующий вызов выполняется заново
+        assert await flight.run("key", succeeding) == ("ответ", False)
+
+    asyncio.run(scenario())
+
+
+def test_coalescing_key_separates_histories():
+    docs = [Document(id="a", page_content="Статья 18")]
+    history_a = [HumanMessage(content="Я купил телефон"), AIMessage(content="Уточните дату покупки")]
+    history_b = [HumanMessage(content="Я купил холодильник"), AIMessage(content="Уточните дату покупки")]
+
+    assert coalescing_key("Как вернуть товар?", docs) == coalescing_key("как  вернуть товар?", docs, [])
+    assert coalescing_key("Как вернуть товар?", docs, history_a) == coalescing_key("Как вернуть товар?", docs, history_a)
+    assert coalescing_key("Как вернуть товар?", docs, history_a) != coalescing_key("Как вернуть товар?", docs, history_b)
+    assert coalescing_key("Как вернуть товар?", docs, history_a) != coalescing_key("Как вернуть товар?", docs)
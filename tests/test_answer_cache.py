@@ -0,0 +1,108 @@
+import sqlite3
+
+from langchain_core.documents import Document
+
+from answer_cache import AnswerCache, context_key
+from rag_pipeline import RagPipeline
+
+DOCS = [Document(id="a", page_content="Статья 18"), Document(id="b", page_content="Статья 19")]
+EMBEDDING = [0.1, 0.2, 0.3]
+
+
+def test_context_key_ignores_order():
+    assert context_key(DOCS) == context_key(list(reversed(DOCS)))
+    assert context_key(DOCS) != context_key(DOCS[:1])
+
+
+def test_lookup_matches_context_and_similarity(tmp_path):
+    cache = AnswerCache("v1", path=str(tmp_path / "answer_cache.sqlite3"), threshold=0.99)
+    try:
+        cache.store("вопрос", EMBEDDING, DOCS, "ответ")
+        assert cache.lookup([0.1, 0.2, 0.31], DOCS) == "ответ"
+        assert cache.lookup([0.3, 0.2, 0.1], DOCS) is None
+        assert cache.lookup(EMBEDDING, DOCS[:1]) is None
+    finally:
+        cache.close()
+
+
+def test_versions_share_database_without_deleting_each_other(tmp_path):
+    path = str(tmp_path / "answer_cache.sqlite3")
+    old = AnswerCache("v1", path=path)
+    old.store("вопрос", EMBEDDING, DOCS, "ответ v1")
+
+    # Процесс на новой версии индекса не видит и не удаляет записи старой
+    new = AnswerCache("v2", path=path)
+    try:
+        assert new.lookup(EMBEDDING, DOCS) is None
+        assert old.lookup(EMBEDDING, DOCS) == "ответ v1"
+        new.store("вопрос", EMBEDDING, DOCS, "ответ v2")
+        assert new.lookup(EMBEDDING, DOCS) == "ответ v2"
+    finally:
+        old.close()
+        new.close()
+
+    reopened = AnswerCache("v1", path=path)
+    try:
+        assert reopened.lookup(EMBEDDING, DOCS) == "ответ v1"
+    finally:
+        reopened.close()
+
+
+def test_expired_and_evicted_entries_are_dropped(tmp_path):
+    cache = AnswerCache("v1", path=str(tmp_path / "expired.sqlite3"), ttl=-1)
+    try:
+        cache.store("вопрос", EMBEDDING, DOCS, "ответ")
+        assert cache.lookup(EMBEDDING, DOCS) is None
+    finally:
+        cache.close()
+
+    cache = AnswerCache("v1", path=str(tmp_path / "evicted.sqlite3"), max_entries=1)
+    try:
+        cache.store("первый", EMBEDDING, DOCS, "первый ответ")
+        cache.store("второй", EMBEDDING, DOCS[:1], "второй ответ")
+        assert cache.lookup(EMBEDDING, DOCS) is None
+        assert cache.stats()["evictions"] == 1
+    finally:
+        cache.close()
+
+
+def test_expired_entries_are_deleted_from_database(tmp_path):
+    path = str(tmp_path / "answer_cache.sqlite3")
+    cache = AnswerCache("v1", path=path)
+    try:
+        cache.store("вопрос", EMBEDDING, DOCS, "ответ")
+        cache.ttl = -1
+        assert cache.lookup(EMBEDDING, DOCS) is None
+        # Удаление зафиксировано: другое соединение не видит записи
+        other = sqlite3.connect(path)
+        try:
+            assert other.execute("SELECT COUNT(*) FROM answers").fetchone()[0] == 0
+        finally:
+            other.close()
+    finally:
+        cache.close()
+
+
+class CountingChain:
+    def __init__(self):
+        self.calls = 0
+
+    def stream(self, inputs):
+        self.calls += 1
+        yield f"ответ {self.calls}"
+
+
+def test_answers_with_history_bypass_cache(tmp_path):
+    cache = AnswerCache("v1", path=str(tmp_path / "answer_cache.sqlite3"))
+    chain = CountingChain()
+    pipeline = RagPipeline(db=None, document_chain=chain, persist_directory=str(tmp_path), answer_cache=cache)
+    history = [{"role": "user", "content": "Я купил телефон"}, {"role": "assistant", "content": "Когда?"}]
+    try:
+        # Ответ с историей не сохраняется и не берётся из кэша
+        assert "".join(pipeline.generate("Как вернуть товар?", history, EMBEDDING, DOCS)) == "ответ 1"
+        assert cache.lookup(EMBEDDING, DOCS) is None
+        cache.store("Как вернуть товар?", EMBEDDING, DOCS, "из кэша")
+        assert "".join(pipeline.generate("Как вернуть товар?", history, EMBEDDING, DOCS)) == "ответ 2"
+        assert "".join(pipeline.generate("Как вернуть товар?", [], EMBEDDING, DOCS)) == "из кэша"
+    finally:
+        cache.close()
@@ -0,0 +1,107 @@
+import json
+
+from langchain_core.documents import Document
+
+import custom_gigachat
+from custom_gigachat import load_completed_ids, read_batch_items, run_batch
+
+
+class FakePipeline:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.questions = []
+
+    def retrieve(self, question):
+        self.questions.append(question)
+        if question in self.failing:
+            raise RuntimeError("GigaChat недоступен")
+        # Поле id в метаданных не должно подменять id чанка в ответе
+        return [0.0], [Document(id="chunk", page_content="Статья 18", metadata={"source": "law.pdf", "id": "meta"})]
+
+    def generate(self, question, chat_history, embedding, docs):
+        yield "ответ: "
+        yield question
+
+    def close(self):
+        self.closed = True
+
+
+def write_lines(path, lines):
+    path.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+
+
+def test_completed_ids_skip_broken_and_non_object_lines(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    output.write_bytes(
+        b'{"id": "1", "answer": "a"}\n'
+        b'[1, 2]\n'
+        b'"answer"\n'
+        b'{"id": "2", "error": "timeout"}\n'
+        b'{"id": "3", "answer": "\xd0'
+    )
+    assert load_completed_ids(str(output)) == {"1"}
+    assert load_completed_ids(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_read_batch_items_skips_invalid_lines(tmp_path, capsys):
+    questions = tmp_path / "questions.jsonl"
+    write_lines(questions, [
+        '{"id": "a", "question": "Первый?"}',
+        '["not", "an", "object"]',
+        '{"question": "Без id?"}',
+        '{обрыв',
+        '{"id": "b"}',
+        '',
+        '{"id": "c", "question": "Третий?"}',
+    ])
+    assert list(read_batch_items(str(questions), {"c"})) == [("a", "Первый?"), ("3", "Без id?")]
+    out = capsys.readouterr().out
+    assert "Строка 2: некорректный JSON (ожидался объект)" in out
+    assert "Строка 4: некорректный JSON" in out
+    assert "Строка 5: нет поля 'question'" in out
+
+
+def test_run_batch_resumes_after_interruption(tmp_path):
+    questions = tmp_path / "questions.jsonl"
+    write_lines(questions, [json.dumps({"id": str(n), "question": f"Вопрос {n}?"}, ensure_ascii=False)
+                            for n in range(1, 6)])
+    output = tmp_path / "answers.jsonl"
+    # Прерванный запуск: один ответ, одна ошибка и оборванная последняя строка
+    output.write_text('{"id": "1", "answer": "готово"}\n{"id": "2", "error": "timeout"}\n{"id": "3", "ans',
+                      encoding="utf-8")
+
+    pipeline = FakePipeline(failing={"Вопрос 5?"})
+    assert run_batch(pipeline, str(questions), str(output), concurrency=2, retries=0) == (3, 1)
+    assert sorted(pipeline.questions) == ["Вопрос 2?", "Вопрос 3?", "Вопрос 4?", "Вопрос 5?"]
+
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert lines[2] == '{"id": "3", "ans'
+    records = [json.loads(line) for line in lines[3:]]
+    by_id = {record["id"]: record for record in records}
+    assert by_id["2"]["answer"] == "ответ: Вопрос 2?"
+    assert by_id["2"]["chunks"] == [{"id": "chunk", "source": "law.pdf"}]
+    assert by_id["5"]["error"] == "RuntimeError: GigaChat недоступен"
+
+    # Повторный запуск переспрашивает только вопрос с ошибкой
+    pipeline = FakePipeline()
+    assert run_batch(pipeline, str(questions), str(output), retries=0) == (1, 0)
+    assert pipeline.questions == ["Вопрос 5?"]
+
+
+def test_no_cache_batch_does_not_open_answer_cache(tmp_path, monkeypatch):
+    questions = tmp_path / "questions.jsonl"
+    write_lines(questions, [json.dumps({"id": "1", "question": "Вопрос?"}, ensure_ascii=False)])
+    pipeline = FakePipeline()
+    calls = []
+
+    def initialize_pipeline(**kwargs):
+        calls.append(kwargs)
+        return pipeline
+
+    monkeypatch.setattr(custom_gigachat, "initialize_pipeline", initialize_pipeline)
+    monkeypatch.setattr("sys.argv", ["custom_gigachat.py", "--batch", str(questions),
+                                     "--output", str(tmp_path / "answers.jsonl"), "--no-cache"])
+    custom_gigachat.main()
+    assert calls == [{"use_answer_cache": False}]
+    # Конвейер закрывается после пакетного режима
+    assert pipeline.closed
@@ -0,0 +1,67 @@
+from citation_index import CitationIndex, parse_citations, roman_to_int, section_label
+
+CONSUMER = "knowledge_base/Закон_РФ_от_7_февраля_1992_г_N_2300_I_О_защите_прав_потребителей.pdf"
+AIR = "knowledge_base/Воздушный_кодекс_Российской_Федерации_от_19_марта_1997_г_N_60_ФЗ.pdf"
+
+
+def test_parse_citations():
+    assert roman_to_int("XIV") == 14
+    assert section_label("Глава", "IV") == section_label("Глава", "4") == "Глава 4"
+    assert parse_citations("Что говорят статьи 18 и 19, а также ст. 7.1?") == ["Статья 18", "Статья 19", "Статья 7.1"]
+    assert parse_citations("Расскажи про главу II и гл. 3") == ["Глава 2", "Глава 3"]
+    # Римские цифры — только номера глав
+    assert parse_citations("статья IV") == []
+    assert parse_citations("Как вернуть товар?") == []
+
+
+def make_index():
+    chunks = {
+        "c1": ("Глава II. Защита прав\nСтатья 18. Права потребителя при обнаружении недостатков", {"page": 1}),
+        "c2": ("продолжение статьи 18 о замене товара", {"page": 2}),
+        "c3": ("Статья 19. Сроки предъявления требований", {"page": 2}),
+        "a1": ("Глава II. Воздушные суда\nСтатья 18. Пассажирские перевозки", {"page": 5}),
+        "a2": ("Статья 100. Ответственность перевозчика", {"page": 9}),
+    }
+    files = {CONSUMER: ["c1", "c2", "c3"], AIR: ["a1", "c2", "a2"]}
+    return CitationIndex.build(files, chunks)
+
+
+def test_lookup_returns_whole_article_in_order():
+    index = make_index()
+    docs = index.lookup("Что говорит статья 18 закона о защите прав потребителей?")
+    assert [doc.id for doc in docs] == ["c1", "c2"]
+    assert {doc.metadata["article"] for doc in docs} == {"Статья 18"}
+    assert {doc.metadata["source"] for doc in docs} == {CONSUMER}
+
+
+def test_chunk_of_another_file_takes_this_file_as_source():
+    # c2 стоит в списке воздушного кодекса вместо объединённого с ним почти-дубликата
+    docs = make_index().lookup("статья 18 воздушного кодекса")
+    assert [doc.id for doc in docs] == ["a1", "c2"]
+    assert {doc.metadata["source"] for doc in docs} == {AIR}
+
+
+def test_named_law_wins_over_unique_article():
+    index = make_index()
+    # Статья 100 есть только в воздушном кодексе, но вопрос о законе о защите прав потребителей
+    assert index.resolve_law("статья 100 закона о защите прав потребителей", ["Статья 100"]) == CONSUMER
+    assert index.lookup("статья 100 закона о защите прав потребителей") == []
+    # Закон не назван: решает наличие статьи
+    assert [doc.id for doc in index.lookup("Что в статье 100?")] == ["a2"]
+    # Статья есть в обоих законах, закон не назван — ответ векторным поиском
+    assert index.lookup("Что в статье 18?") == []
+
+
+def test_large_chapter_falls_back_to_retrieval():
+    index = make_index()
+    assert [doc.id for doc in index.lookup("глава 2 закона о защите прав потребителей")] == ["c1", "c2", "c3"]
+    index.chapter_max_chunks = 2
+    assert index.lookup("глава 2 закона о защите прав потребителей") == []
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "citations.pkl")
+    make_index().save(path)
+    loaded = CitationIndex.load(path)
+    assert loaded.sections == make_index().sections
+    assert [doc.id for doc in loaded.lookup("статья 19 о защите прав потребителей")] == ["c3"]
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from embedding_batcher import BatchingEmbeddings
+
+
+class DroppingEmbeddings(DeterministicFakeEmbedding):
+    def embed_documents(self, texts):
+        # Модель теряет последний текст пакета
+        return super().embed_documents(texts)[:-1]
+
+
+def test_short_model_response_fails_every_request():
+    embeddings = BatchingEmbeddings(DroppingEmbeddings(size=8), window_ms=50)
+    errors = []
+
+    def ask(text):
+        try:
+            embeddings.embed_query(text)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=ask, args=(f"вопрос {n}",)) for n in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    try:
+        assert not any(thread.is_alive() for thread in threads)
+        assert len(errors) == 3
+    finally:
+        embeddings.close()
+
+
+def test_concurrent_queries_share_a_batch():
+    model = DeterministicFakeEmbedding(size=8)
+    embeddings = BatchingEmbeddings(model, window_ms=50)
+    results = {}
+    threads = [threading.Thread(target=lambda n=n: results.setdefault(n, embeddings.embed_query(f"вопрос {n}")))
+               for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    embeddings.close()
+    assert all(results[n] == pytest.approx(model.embed_query(f"вопрос {n}")) for n in range(4))
+    assert embeddings.batched_queries == 4 and embeddings.batches < 4
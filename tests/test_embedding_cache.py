@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    documents: int = 0
+    queries: int = 0
+
+    def embed_documents(self, texts):
+        self.documents += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.queries += 1
+        return super().embed_query(text)
+
+
+def cached_embeddings(path, model, **kwargs):
+    return CachedEmbeddings(model, EmbeddingCache(path=str(path)), model_name="fake", **kwargs)
+
+
+def stored_rows(path):
+    with sqlite3.connect(str(path)) as conn:
+        return conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def test_document_embeddings_are_persisted(tmp_path):
+    path = tmp_path / "embedding_cache.sqlite3"
+    model = CountingEmbeddings(size=8)
+    embeddings = cached_embeddings(path, model)
+    vectors = embeddings.embed_documents(["Статья 1", "Статья 2", "Статья 1"])
+    assert model.documents == 2 and vectors[0] == vectors[2]
+    embeddings.close()
+
+    embeddings = cached_embeddings(path, model)
+    # Векторы хранятся в float32
+    assert embeddings.embed_documents(["Статья 2", "Статья 1"]) == [pytest.approx(vectors[1]), pytest.approx(vectors[0])]
+    assert model.documents == 2 and embeddings.hits == 2
+    embeddings.close()
+
+
+def test_query_embeddings_are_persisted_without_text(tmp_path):
+    path = tmp_path / "embedding_cache.sqlite3"
+    model = CountingEmbeddings(size=8)
+    embeddings = cached_embeddings(path, model)
+    first = embeddings.embed_query("Как вернуть товар?")
+    assert embeddings.embed_query("как  вернуть товар?") == pytest.approx(first)
+    assert model.queries == 1
+    # Вопрос не путается с документом с тем же текстом
+    embeddings.embed_documents(["Как вернуть товар?"])
+    assert model.documents == 1
+    embeddings.close()
+
+    embeddings = cached_embeddings(path, model)
+    assert embeddings.embed_query("Как вернуть товар?") == pytest.approx(first)
+    assert model.queries == 1
+    embeddings.close()
+    # На диске только хэши и векторы, без текста вопроса
+    with sqlite3.connect(str(path)) as conn:
+        dump = "\n".join(conn.iterdump())
+    assert "вернуть" not in dump and stored_rows(path) == 2
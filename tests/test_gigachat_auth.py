@@ -0,0 +1,137 @@
+import time
+
+import pytest
+
+import gigachat_auth
+from gigachat_auth import GigaChatTokenManager, ManagedTokenGigaChat, authorization_cvar
+
+
+class StubResponse:
+    def __init__(self, token, expires_at):
+        self.status_code = 200
+        self._payload = {"access_token": token, "expires_at": int(expires_at * 1000)}
+        self.text = ""
+
+    def json(self):
+        return self._payload
+
+
+class StubOAuthSession:
+    """Заглушка OAuth: каждый запрос выдаёт новый токен со сроком lifetime секунд"""
+
+    def __init__(self, lifetime):
+        self.lifetime = lifetime
+        self.calls = 0
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        self.calls += 1
+        return StubResponse(f"token-{self.calls}", time.time() + self.lifetime)
+
+    def close(self):
+        pass
+
+
+def make_manager(lifetime, refresh_margin, retry_delay=5.0):
+    session = StubOAuthSession(lifetime)
+    manager = GigaChatTokenManager(authorization_key="key", auth_url="http://stub/oauth",
+                                   session=session, refresh_margin=refresh_margin, retry_delay=retry_delay)
+    return manager, session
+
+
+def test_cached_token_is_reused():
+    manager, session = make_manager(lifetime=1800, refresh_margin=120)
+    assert manager.get_token() == "token-1"
+    assert manager.get_token() == "token-1"
+    assert session.calls == 1
+
+
+def test_token_is_refreshed_within_margin(monkeypatch):
+    manager, session = make_manager(lifetime=1800, refresh_margin=120)
+    manager.get_token()
+    now = time.time()
+    # За минуту до истечения токен уже в пределах запаса и обновляется
+    monkeypatch.setattr(gigachat_auth.time, "time", lambda: now + 1800 - 60)
+    assert manager.get_token() == "token-2"
+    assert session.calls == 2
+
+
+def test_background_refresh_before_expiry():
+    # Токен живёт 2.5 с, запас 1.5 с: фоновое обновление через ~1 с, до истечения
+    manager, session = make_manager(lifetime=2.5, refresh_margin=1.5)
+    manager.start()
+    try:
+        deadline = time.time() + 2.0
+        while session.calls < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert session.calls >= 2
+        assert manager.get_token() == f"token-{session.calls}"
+    finally:
+        manager.stop()
+
+
+def test_llm_requests_use_manager_token():
+    manager, _ = make_manager(lifetime=1800, refresh_margin=120)
+    seen = []
+
+    class StubClient:
+        def stream(self, payload):
+            seen.append(authorization_cvar.get())
+            return iter(())
+
+    llm = ManagedTokenGigaChat(token_manager=manager)
+    llm.__dict__["_client"] = StubClient()
+    list(llm._stream("вопрос"))
+    assert seen == ["Bearer token-1"]
+
+
+def test_missing_key_raises():
+    manager = GigaChatTokenManager(authorization_key="", session=StubOAuthSession(60))
+    manager.authorization_key = None
+    with pytest.raises(gigachat_auth.GigaChatAuthError):
+        manager.get_token()
+
+
+class BrokenResponse:
+    status_code = 200
+    text = "<html>maintenance</html>"
+
+    def __init__(self, payload=None):
+        self._payload = payload
+
+    def json(self):
+        if self._payload is None:
+            raise ValueError("not JSON")
+        return self._payload
+
+
+@pytest.mark.parametrize("response", [BrokenResponse(), BrokenResponse({"access_token": "token"}),
+                                      BrokenResponse(["token"])])
+def test_malformed_token_response_raises_auth_error(response):
+    manager, session = make_manager(lifetime=60, refresh_margin=10)
+    session.post = lambda *args, **kwargs: response
+    with pytest.raises(gigachat_auth.GigaChatAuthError):
+        manager.get_token()
+
+
+def test_background_refresh_survives_unexpected_errors():
+    manager, session = make_manager(lifetime=2.5, refresh_margin=1.5, retry_delay=0.1)
+    manager.start()
+    post = session.post
+    failures = []
+
+    def flaky_post(*args, **kwargs):
+        # Первое фоновое обновление падает с непредвиденной ошибкой
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("сбой")
+        return post(*args, **kwargs)
+
+    session.post = flaky_post
+    try:
+        deadline = time.time() + 3.0
+        while session.calls < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert failures and session.calls >= 2
+        assert manager._refresher.is_alive()
+    finally:
+        manager.stop()
@@ -0,0 +1,174 @@
+import json
+import os
+
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+import ingest
+from index_version import current_version, resolve_index_path
+
+
+ingest_extract_pages = ingest.extract_pages
+
+
+def fail_on_second_range(file_path, start, stop):
+    """extract_pages, который падает на втором диапазоне страниц файла bad.pdf"""
+    if os.path.basename(file_path) == "bad.pdf" and start > 0:
+        raise ValueError("повреждённая страница")
+    return ingest_extract_pages(file_path, start, stop)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Пути ingest.py относительные: база знаний, кэш страниц и индексы — во временном каталоге
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(ingest.DATA_PATH)
+    monkeypatch.setattr(ingest, "INGEST_WORKERS", 1)
+    monkeypatch.setattr(ingest, "get_embedding_function", lambda: DeterministicFakeEmbedding(size=32))
+    ingest.global_unique_hashes.clear()
+    yield tmp_path
+    ingest.global_unique_hashes.clear()
+
+
+def pdf_path(name):
+    return os.path.join(ingest.DATA_PATH, name)
+
+
+def page_texts(docs):
+    return [doc.page_content for doc in docs]
+
+
+def test_corrupt_page_cache_is_reparsed(workdir, make_pdf):
+    path = pdf_path("law.pdf")
+    make_pdf(path, ["first page text", "second page text"])
+    assert page_texts(ingest.load_documents()) == ["first page text", "second page text"]
+
+    cache_path = ingest.page_cache_path(ingest.hash_file(path))
+    with open(cache_path, "w", encoding="utf-8") as f:
+        f.write("{обрыв")
+
+    failed = set()
+    assert page_texts(ingest.load_documents(failed_files=failed)) == ["first page text", "second page text"]
+    assert not failed
+    assert ingest.load_page_cache(ingest.hash_file(path)) is not None
+
+
+def test_unreadable_pdf_is_reported(workdir, make_pdf):
+    make_pdf(pdf_path("good.pdf"), ["good page"])
+    with open(pdf_path("broken.pdf"), "wb") as f:
+        f.write(b"not a pdf")
+
+    failed = set()
+    assert page_texts(ingest.load_documents(failed_files=failed)) == ["good page"]
+    assert failed == {pdf_path("broken.pdf")}
+
+
+def test_partially_extracted_file_is_skipped(workdir, make_pdf, monkeypatch):
+    monkeypatch.setattr(ingest, "PAGES_PER_TASK", 1)
+    monkeypatch.setattr(ingest, "extract_pages", fail_on_second_range)
+    make_pdf(pdf_path("bad.pdf"), ["bad first", "bad second"])
+    make_pdf(pdf_path("good.pdf"), ["good first", "good second"])
+
+    failed = set()
+    assert page_texts(ingest.load_documents(failed_files=failed)) == ["good first", "good second"]
+    assert failed == {pdf_path("bad.pdf")}
+    # Кэш страниц пишется только для полностью извлечённых файлов
+    assert ingest.load_page_cache(ingest.hash_file(pdf_path("bad.pdf"))) is None
+
+
+def read_manifest():
+    with open(os.path.join(resolve_index_path(), ingest.MANIFEST_FILE), encoding="utf-8") as f:
+        return json.load(f)["files"]
+
+
+def test_incremental_build_follows_manifest(workdir, make_pdf, monkeypatch):
+    make_pdf(pdf_path("a.pdf"), ["alpha contract terms", "alpha warranty period"])
+    make_pdf(pdf_path("bad.pdf"), ["bravo consumer rights"])
+    make_pdf(pdf_path("c.pdf"), ["charlie refund rules"])
+    ingest.generate_data_store(near_dup_threshold=0)
+    first_version = current_version()
+    first = read_manifest()
+    assert sorted(first) == [pdf_path("a.pdf"), pdf_path("bad.pdf"), pdf_path("c.pdf")]
+
+    # Без изменений новая версия не собирается
+    ingest.global_unique_hashes.clear()
+    ingest.generate_data_store(near_dup_threshold=0)
+    assert current_version() == first_version
+
+    # Изменённый файл не разбирается: остаются его прежние запись и чанки, удалённый файл уходит из индекса
+    monkeypatch.setattr(ingest, "PAGES_PER_TASK", 1)
+    monkeypatch.setattr(ingest, "extract_pages", fail_on_second_range)
+    make_pdf(pdf_path("bad.pdf"), ["bravo consumer rights", "bravo new page"])
+    os.remove(pdf_path("c.pdf"))
+    ingest.global_unique_hashes.clear()
+    ingest.generate_data_store(near_dup_threshold=0)
+    second = read_manifest()
+    assert current_version() != first_version
+    assert sorted(second) == [pdf_path("a.pdf"), pdf_path("bad.pdf")]
+    assert second[pdf_path("a.pdf")] == first[pdf_path("a.pdf")]
+    assert second[pdf_path("bad.pdf")] == first[pdf_path("bad.pdf")]
+
+    # Следующий запуск снова разбирает файл, который не удалось разобрать
+    monkeypatch.setattr(ingest, "extract_pages", ingest_extract_pages)
+    ingest.global_unique_hashes.clear()
+    ingest.generate_data_store(near_dup_threshold=0)
+    third = read_manifest()
+    assert third[pdf_path("bad.pdf")]["file_hash"] == ingest.hash_file(pdf_path("bad.pdf"))
+    assert len(third[pdf_path("bad.pdf")]["chunks"]) == 2
+
+
+def test_reused_chunks_get_metadata_of_their_new_place(workdir, make_pdf):
+    make_pdf(pdf_path("a.pdf"), ["alpha contract terms", "alpha warranty period"])
+    ingest.generate_data_store(near_dup_threshold=0)
+    chunk_id = read_manifest()[pdf_path("a.pdf")]["chunks"][0]
+
+    # Тот же текст переехал на вторую страницу: эмбеддинг прежний, метаданные новые
+    make_pdf(pdf_path("a.pdf"), ["alpha new preface", "alpha contract terms"])
+    ingest.global_unique_hashes.clear()
+    ingest.generate_data_store(near_dup_threshold=0)
+    assert chunk_id in read_manifest()[pdf_path("a.pdf")]["chunks"]
+    db = ingest.open_chroma(DeterministicFakeEmbedding(size=32), resolve_index_path())
+    stored = db.get(ids=[chunk_id], include=["metadatas"])
+    assert stored["metadatas"][0]["page"] == 1
+    assert len(db.get(include=[])["ids"]) == 2
+
+
+def test_chunk_sequence_puts_canonical_chunks_in_place_of_duplicates():
+    entry = {"chunks": ["a", "b"], "merged": {"x": "k1", "y": "k2", "z": "k3"}, "merged_at": {"x": 0, "y": 1, "z": 2}}
+    assert ingest.chunk_sequence(entry) == ["k1", "a", "k2", "b", "k3"]
+    # Манифест без позиций (собран до их появления)
+    assert ingest.chunk_sequence({"chunks": ["a"], "merged": {"x": "k1"}}) == ["a"]
+
+
+def test_near_duplicates_keep_their_place_in_the_manifest(workdir, make_pdf):
+    shared = " ".join(f"clause{n}" for n in range(60))
+    make_pdf(pdf_path("a.pdf"), [shared])
+    make_pdf(pdf_path("b.pdf"), ["bravo opening words", shared + " extra", "bravo closing words"])
+    ingest.generate_data_store(near_dup_threshold=0.8)
+
+    files = read_manifest()
+    entry = files[pdf_path("b.pdf")]
+    canonical_id = files[pdf_path("a.pdf")]["chunks"][0]
+    assert list(entry["merged"].values()) == [canonical_id]
+    assert len(entry["chunks"]) == 2
+    assert ingest.chunk_sequence(entry) == [entry["chunks"][0], canonical_id, entry["chunks"][1]]
+
+
+class PagedCollection:
+    """Коллекция с постраничным get(), как у Chroma; запоминает размеры запрошенных страниц"""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.pages = []
+
+    def get(self, include, limit, offset):
+        page = self.ids[offset:offset + limit]
+        self.pages.append(len(page))
+        return {"ids": page, **{field: [f"{field}:{chunk_id}" for chunk_id in page] for field in include}}
+
+
+def test_collection_is_read_page_by_page():
+    db = PagedCollection([f"c{n}" for n in range(5)])
+    rows = list(ingest.iter_collection(db, ["documents"], page_size=2))
+    assert rows == [(f"c{n}", f"documents:c{n}") for n in range(5)]
+    assert db.pages == [2, 2, 1, 0]
@@ -0,0 +1,49 @@
+import numpy as np
+
+from near_dedup import MinHasher, NearDuplicateIndex, optimal_bands, shingles
+
+WORDS = [f"слово{n}" for n in range(200)]
+TEXT = " ".join(WORDS)
+
+
+def jaccard(left, right):
+    left, right = shingles(left), shingles(right)
+    return len(left & right) / len(left | right)
+
+
+def test_signature_estimates_jaccard():
+    hasher = MinHasher(num_perm=256)
+    edited = " ".join(WORDS[:190] + [f"другое{n}" for n in range(10)])
+    estimate = float(np.mean(hasher.signature(TEXT) == hasher.signature(edited)))
+    assert abs(estimate - jaccard(TEXT, edited)) < 0.08
+    assert np.array_equal(hasher.signature(TEXT), MinHasher(num_perm=256).signature(TEXT))
+
+
+def test_optimal_bands_reach_recall():
+    bands, rows = optimal_bands(0.85, 128)
+    assert bands * rows == 128
+    assert 1 - (1 - 0.85 ** rows) ** bands >= 0.95
+
+
+def test_index_finds_near_duplicates_only():
+    index = NearDuplicateIndex(threshold=0.85)
+    assert index.check("first", TEXT) is None
+    # Изменено одно слово из двухсот: почти дубликат
+    near = " ".join(WORDS[:100] + ["другое"] + WORDS[101:])
+    assert index.check("second", near) == "first"
+    assert index.check("third", " ".join(reversed(WORDS))) is None
+    assert set(index.signatures) == {"first", "third"}
+
+
+def test_save_and_load_selected_signatures(tmp_path):
+    path = str(tmp_path / "minhash.pkl")
+    index = NearDuplicateIndex()
+    index.check("first", TEXT)
+    index.check("other", "совсем другой текст про страхование автогражданской ответственности")
+    index.save(path)
+
+    loaded = NearDuplicateIndex()
+    assert loaded.load(path, ["first", "missing"]) == 1
+    assert loaded.check("copy", TEXT) == "first"
+    # Сигнатуры с другими параметрами MinHash не загружаются
+    assert NearDuplicateIndex(num_perm=64).load(path, ["first"]) == 0
@@ -0,0 +1,145 @@
+import threading
+import time
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from embedding_batcher import BatchingEmbeddings
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from pipeline_loader import PipelineLoader
+from rag_pipeline import RagPipeline
+
+
+class FakePipeline:
+    def __init__(self, version, fail_warmup=False):
+        self.version = version
+        self.fail_warmup = fail_warmup
+        self.warmed_up = False
+        self.closed = False
+
+    def warmup(self, question):
+        if self.fail_warmup:
+            raise RuntimeError("индекс не открывается")
+        self.warmed_up = True
+
+    def close(self):
+        self.closed = True
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    calls: int = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return super().embed_query(text)
+
+
+class StubDB:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+
+class StubRetriever:
+    def search(self, question, embedding, k):
+        return []
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "условие не выполнено"
+        time.sleep(0.01)
+
+
+def test_reload_builds_requested_version_and_closes_previous():
+    versions = {"current": "v1"}
+    created = []
+
+    def factory(version):
+        pipeline = FakePipeline(version, fail_warmup=version == "broken")
+        created.append(pipeline)
+        return pipeline
+
+    loader = PipelineLoader(factory=factory, reload_interval=0.02, close_delay=0,
+                            version_source=lambda: versions["current"])
+    loader.start()
+    try:
+        assert loader.wait(5)
+        first = loader.pipeline
+        assert first.version == "v1" and first.warmed_up
+
+        versions["current"] = "v2"
+        wait_for(lambda: first.closed)
+        assert loader.pipeline.version == "v2" and loader.index_version == "v2"
+
+        # Версия, которая не прогрелась, не подменяет рабочий конвейер и закрывается
+        versions["current"] = "broken"
+        wait_for(lambda: created[-1].version == "broken" and created[-1].closed)
+        assert loader.pipeline.version == "v2" and not loader.pipeline.closed
+    finally:
+        loader.stop()
+
+
+def test_previous_pipeline_closes_after_its_last_request():
+    versions = {"current": "v1"}
+    loader = PipelineLoader(factory=FakePipeline, reload_interval=0.02, close_delay=30,
+                            version_source=lambda: versions["current"])
+    loader.start()
+    try:
+        assert loader.wait(5)
+        with loader.lease() as first:
+            versions["current"] = "v2"
+            wait_for(lambda: loader.index_version == "v2")
+            with loader.lease() as second:
+                assert second.version == "v2"
+            # Начатый запрос дорабатывает со старым конвейером
+            time.sleep(0.1)
+            assert not first.closed
+        wait_for(lambda: first.closed)
+        assert not loader.pipeline.closed
+    finally:
+        loader.stop()
+
+
+def test_close_delay_bounds_wait_for_requests():
+    versions = {"current": "v1"}
+    loader = PipelineLoader(factory=FakePipeline, reload_interval=0.02, close_delay=0.1,
+                            version_source=lambda: versions["current"])
+    loader.start()
+    try:
+        assert loader.wait(5)
+        with loader.lease() as first:
+            versions["current"] = "v2"
+            wait_for(lambda: first.closed)
+    finally:
+        loader.stop()
+
+
+def test_warmup_bypasses_embedding_cache(tmp_path):
+    model = CountingEmbeddings(size=8)
+    cache = EmbeddingCache(path=str(tmp_path / "embedding_cache.sqlite3"))
+    embeddings = CachedEmbeddings(model, cache, model_name="fake")
+    pipeline = RagPipeline(StubDB(embeddings), document_chain=None, persist_directory=str(tmp_path),
+                           retriever=StubRetriever())
+
+    embeddings.embed_query("Какие права есть у потребителя?")
+    pipeline.warmup("Какие права есть у потребителя?")
+    pipeline.warmup("Какие права есть у потребителя?")
+    assert model.calls == 3
+    pipeline.close()
+
+
+def test_batching_embeddings_close_stops_worker():
+    embeddings = BatchingEmbeddings(DeterministicFakeEmbedding(size=8), window_ms=1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(embeddings.embed_query("вопрос"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    worker = embeddings._worker
+    assert len(results) == 4 and worker.is_alive()
+
+    embeddings.close()
+    assert not worker.is_alive()
+    # После закрытия запросы идут в модель напрямую
+    assert embeddings.embed_query("вопрос") == results[0]
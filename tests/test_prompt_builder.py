@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+
+from gigachat_auth import ManagedTokenGigaChat
+from prompt_builder import PromptBuilder, estimate_tokens, history_turns, merge_chunks
+
+
+def count_words(texts):
+    return [len(text.split()) for text in texts]
+
+
+def test_estimate_counts_cyrillic_pieces():
+    assert estimate_tokens("") == 0
+    # Короткие слова — один токен, длинные режутся на куски, знаки — отдельно
+    assert estimate_tokens("да, нет") == 3
+    assert estimate_tokens("потребителя") == 3
+
+
+def test_merge_chunks_joins_overlapping_article_pieces():
+    head = "Статья 18. Потребитель вправе потребовать замены товара той же марки"
+    tail = "замены товара той же марки или соразмерного уменьшения цены"
+    docs = [
+        Document(page_content=head, metadata={"source": "law.pdf", "article": "Статья 18"}),
+        Document(page_content="Статья 19. Сроки", metadata={"source": "law.pdf", "article": "Статья 19"}),
+        Document(page_content=tail, metadata={"source": "law.pdf", "article": "Статья 18"}),
+        Document(page_content="марки", metadata={"source": "law.pdf", "article": "Статья 18"}),
+    ]
+    merged = merge_chunks(docs)
+    assert [doc.metadata["article"] for doc in merged] == ["Статья 18", "Статья 19"]
+    assert merged[0].page_content == head + " или соразмерного уменьшения цены"
+
+
+def test_history_turns_drop_orphan_answers():
+    history = [
+        {"role": "assistant", "content": "ответ без вопроса"},
+        {"role": "user", "content": "вопрос 1"},
+        {"role": "assistant", "content": "ответ 1"},
+        {"role": "human", "content": "вопрос 2"},
+    ]
+    assert history_turns(history) == [history[1:3], history[3:]]
+
+
+def test_history_is_trimmed_by_whole_turns():
+    history = [
+        HumanMessage(content="первый вопрос"),
+        AIMessage(content="очень длинный первый ответ " * 3),
+        HumanMessage(content="второй вопрос"),
+        AIMessage(content="второй ответ"),
+    ]
+    calls = []
+
+    def counter(texts):
+        calls.append(list(texts))
+        return count_words(texts)
+
+    builder = PromptBuilder(system_prompt="ты юрист", budget=14, count_tokens=counter)
+    docs = [Document(page_content="статья о правах", metadata={"source": "law.pdf"})]
+    prompt = builder.build("что делать?", docs, history)
+
+    # Первая реплика не помещается целиком: ответ без вопроса в промпт не попадает
+    assert prompt.chat_history == history[2:]
+    assert prompt.token_counts["history_messages"] == 2
+    assert prompt.token_counts["dropped_history_messages"] == 2
+    assert prompt.token_counts["total"] == 2 + 2 + 3 + 4
+    # Все тексты считаются одним вызовом, системный промпт — только при первой сборке
+    assert len(calls) == 1 and calls[0][-1] == "ты юрист"
+    # Уже посчитанные тексты берутся из кэша: в модель уходит только новый вопрос
+    assert builder.build("что делать?", docs, history) == prompt
+    assert len(calls) == 1
+    builder.build("куда обращаться?", docs, history)
+    assert calls[1] == ["куда обращаться?"]
+
+
+def test_token_cache_is_bounded():
+    builder = PromptBuilder(count_tokens=count_words, cache_size=2)
+    builder.build("один", [Document(page_content="два слова")], [])
+    builder.build("три", [], [])
+    assert len(builder._cache) == 2
+
+
+def test_default_counter_is_offline_estimate():
+    builder = PromptBuilder(budget=100)
+    prompt = builder.build("вопрос", [Document(page_content="контекст")], [])
+    assert prompt.token_counts["question"] == estimate_tokens("вопрос")
+    assert not builder._cache
+
+
+def test_counter_failure_falls_back_to_estimate():
+    def broken(texts):
+        raise RuntimeError("API недоступен")
+
+    builder = PromptBuilder(budget=100, count_tokens=broken)
+    prompt = builder.build("вопрос", [Document(page_content="контекст")], [])
+    assert prompt.token_counts["question"] == estimate_tokens("вопрос")
+    assert prompt.token_counts["context"] == estimate_tokens("контекст")
+
+    builder = PromptBuilder(budget=100, count_tokens=lambda texts: [1])
+    prompt = builder.build("вопрос", [Document(page_content="контекст")], [])
+    assert prompt.token_counts["context"] == estimate_tokens("контекст")
+
+
+class StubTokenManager:
+    def get_token(self):
+        return "token"
+
+
+class StubClient:
+    def __init__(self):
+        self.requests = []
+
+    def tokens_count(self, input_, model=None):
+        self.requests.append((input_, model))
+        return [SimpleNamespace(tokens=len(text)) for text in input_]
+
+
+def test_model_counts_tokens_in_one_request():
+    model = ManagedTokenGigaChat(model="GigaChat", token_manager=StubTokenManager())
+    client = StubClient()
+    model.__dict__["_client"] = client
+    assert model.count_tokens(["абв", "де"]) == [3, 2]
+    assert client.requests == [(["абв", "де"], "GigaChat")]
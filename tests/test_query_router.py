@@ -0,0 +1,40 @@
+import numpy as np
+
+from query_router import QueryRouter
+
+NAMES = ["air.pdf", "osago.pdf", "consumer.pdf"]
+CENTROIDS = np.eye(3, dtype=np.float32)
+KEYWORDS = {
+    "воздушн": {"air.pdf": 2.5},
+    "судн": {"air.pdf": 1.5},
+    "страхован": {"osago.pdf": 2.5},
+    "полис": {"osago.pdf": 1.0},
+    "потребител": {"consumer.pdf": 2.5},
+    "пассажир": {"air.pdf": 0.5},
+}
+
+
+def make_router(**kwargs):
+    return QueryRouter(NAMES, CENTROIDS, KEYWORDS, **kwargs)
+
+
+def test_strong_keyword_routes_to_one_law():
+    assert make_router().route("Что считается воздушным судном?") == ["air.pdf"]
+
+
+def test_weak_runner_up_is_dropped():
+    # «полис» слабо указывает на ОСАГО, но отрыв «воздушного судна» велик
+    assert make_router().route("Нужен ли полис для воздушного судна?") == ["air.pdf"]
+
+
+def test_close_scores_keep_both_laws():
+    assert sorted(make_router().route("Страхование воздушного транспорта")) == ["air.pdf", "osago.pdf"]
+    assert make_router(max_partitions=1).route("Страхование воздушного транспорта") is None
+
+
+def test_weak_keywords_fall_back_to_centroids():
+    router = make_router()
+    # Одного слабого ключевого слова мало: решают эмбеддинги
+    assert router.route("Права пассажира", [0.1, 0.0, 0.9]) == ["consumer.pdf"]
+    assert router.route("Права пассажира", [0.5, 0.0, 0.52]) is None
+    assert router.route("Права пассажира") is None
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+import pytest
+
+from metrics import new_request_id, request_id_var
+from rag_executor import RagExecutor, RagOverloadedError
+
+
+def test_rejects_beyond_workers_plus_queue():
+    async def scenario():
+        executor = RagExecutor(max_workers=1, max_queue=1)
+        release = threading.Event()
+        try:
+            running = asyncio.create_task(executor.run(release.wait))
+            waiting = asyncio.create_task(executor.run(release.wait))
+            await asyncio.sleep(0)
+            assert executor.pending == 2 and executor.queued == 1
+            with pytest.raises(RagOverloadedError):
+                await executor.run(release.wait)
+            with pytest.raises(RagOverloadedError):
+                async for _ in executor.iterate(iter, [1]):
+                    pass
+
+            release.set()
+            assert await asyncio.gather(running, waiting) == [True, True]
+            assert executor.pending == 0
+            # После освобождения очередь снова принимает задачи
+            assert await executor.run(sum, [1, 2]) == 3
+        finally:
+            release.set()
+            executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_request_id_reaches_worker_threads():
+    def read_request_id():
+        return request_id_var.get()
+
+    def stream_request_id():
+        yield request_id_var.get()
+
+    async def scenario():
+        executor = RagExecutor(max_workers=2, max_queue=0)
+        try:
+            request_id = new_request_id()
+            assert await executor.run(read_request_id) == request_id
+            assert [item async for item in executor.iterate(stream_request_id)] == [request_id]
+        finally:
+            executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_generator_error_reaches_caller_and_frees_slot():
+    def failing_stream():
+        yield "начало ответа"
+        raise RuntimeError("GigaChat недоступен")
+
+    async def scenario():
+        executor = RagExecutor(max_workers=1, max_queue=0)
+        try:
+            received = []
+            with pytest.raises(RuntimeError, match="GigaChat недоступен"):
+                async for piece in executor.iterate(failing_stream):
+                    received.append(piece)
+            assert received == ["начало ответа"]
+            # Место освобождается колбэком пула после завершения генератора
+            for _ in range(100):
+                if executor.pending == 0:
+                    break
+                await asyncio.sleep(0.01)
+            assert executor.pending == 0
+            assert [item async for item in executor.iterate(iter, "аб")] == ["а", "б"]
+        finally:
+            executor.shutdown()
+
+    asyncio.run(scenario())
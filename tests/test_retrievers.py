@@ -0,0 +1,68 @@
+from langchain_core.documents import Document
+
+from bm25_index import BM25Index
+from retrievers import HybridRetriever
+
+
+def doc(doc_id, source="law.pdf"):
+    return Document(id=doc_id, page_content=f"текст {doc_id}", metadata={"source": source})
+
+
+class StubVectorRetriever:
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = []
+
+    def search(self, question, embedding, k, partitions=None):
+        self.calls.append((k, partitions))
+        return self.docs[:k]
+
+
+def make_lexical_index():
+    return BM25Index.build(
+        ["a", "b", "c", "d"],
+        ["перевозчик отвечает за багаж", "потребитель вправе вернуть товар",
+         "страхование ответственности", "потребитель и качество товара"],
+        [{"source": "air.pdf"}, {"source": "consumer.pdf"}, {"source": "osago.pdf"}, {"source": "consumer.pdf"}],
+    )
+
+
+def test_rrf_merges_vector_and_lexical_ranks():
+    vector = StubVectorRetriever([doc("a", "air.pdf"), doc("b", "consumer.pdf")])
+    retriever = HybridRetriever(None, make_lexical_index(), candidates=5, rrf_k=60, vector_retriever=vector)
+
+    docs = retriever.search("потребитель вернуть товар", [0.0], k=3)
+    # b найден обоими поисками; a (1-й у векторов) выше d (2-й у BM25)
+    assert [d.id for d in docs] == ["b", "a", "d"]
+    # Найденный только лексически чанк собирается из BM25-индекса
+    assert docs[2].page_content == "потребитель и качество товара"
+    assert docs[2].metadata == {"source": "consumer.pdf"}
+    assert vector.calls == [(5, None)]
+
+
+def test_partitions_limit_both_searches():
+    vector = StubVectorRetriever([doc("b", "consumer.pdf")])
+    retriever = HybridRetriever(None, make_lexical_index(), candidates=5, vector_retriever=vector)
+
+    docs = retriever.search("перевозчик и товар", [0.0], k=5, partitions=["consumer.pdf"])
+    assert sorted(d.id for d in docs) == ["b", "d"]
+    assert vector.calls == [(5, ["consumer.pdf"])]
+
+
+def test_lexical_index_save_and_load(tmp_path):
+    path = str(tmp_path / "bm25.pkl")
+    index = make_lexical_index()
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.search("потребитель товар", where={"source": {"consumer.pdf"}}) == \
+        index.search("потребитель товар", where={"source": {"consumer.pdf"}})
+    assert list(loaded.texts) == index.texts and list(loaded.metadatas) == index.metadatas
+
+
+def test_lexical_index_write_streams_chunks(tmp_path):
+    index = make_lexical_index()
+    path = str(tmp_path / "bm25.pkl")
+    written = BM25Index.write(path, iter(zip(index.ids, index.texts, index.metadatas)))
+    assert written.postings == index.postings and written.doc_lengths == index.doc_lengths
+    assert written.search("потребитель товар") == index.search("потребитель товар")
+    assert list(written.texts) == index.texts and list(written.metadatas) == index.metadatas
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+from session_store import SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SessionStore(path=str(tmp_path / "chat_histories.sqlite3"), flush_interval=0.05)
+    yield store
+    store.close()
+
+
+def write_history(history_dir, user_id, messages):
+    history_dir.mkdir(exist_ok=True)
+    with open(history_dir / f"{user_id}.json", "w", encoding="utf-8") as f:
+        json.dump(messages, f, ensure_ascii=False)
+
+
+def test_history_is_kept_after_reopen(tmp_path):
+    path = str(tmp_path / "chat_histories.sqlite3")
+    store = SessionStore(path=path, max_messages=3)
+    for number in range(5):
+        store.append(1, "user", f"вопрос {number}")
+    store.clear(2)
+    store.close()
+
+    store = SessionStore(path=path, max_messages=3)
+    try:
+        assert [msg["content"] for msg in store.get_history(1)] == ["вопрос 2", "вопрос 3", "вопрос 4"]
+        assert store.get_history(2) == []
+    finally:
+        store.close()
+
+
+def test_migrate_json_is_idempotent(store, tmp_path):
+    history_dir = tmp_path / "chat_histories"
+    messages = [{"role": "user", "content": "Привет"}, {"role": "assistant", "content": "Здравствуйте"}]
+    write_history(history_dir, 42, messages)
+
+    assert store.migrate_json(history_dir) == 1
+    assert store.get_history(42) == messages
+    assert (history_dir / "42.json.migrated").exists()
+
+    # Файл вернули на место (например, сбой после записи, но до переименования) — история не дублируется
+    (history_dir / "42.json.migrated").rename(history_dir / "42.json")
+    assert store.migrate_json(history_dir) == 0
+    assert store.get_history(42) == messages
+    assert not (history_dir / "42.json").exists()
+
+
+def test_migrate_json_skips_broken_files(store, tmp_path):
+    history_dir = tmp_path / "chat_histories"
+    write_history(history_dir, 7, [{"role": "user", "content": "Вопрос"}])
+    (history_dir / "8.json").write_text("{обрыв", encoding="utf-8")
+    (history_dir / "9.json").write_text(json.dumps([{"role": "user"}]), encoding="utf-8")
+
+    assert store.migrate_json(history_dir) == 1
+    assert store.get_history(9) == []
+    # Неудачные файлы остаются на месте и переносятся после исправления
+    assert (history_dir / "8.json").exists()
+    write_history(history_dir, 9, [{"role": "user", "content": "Исправлено"}])
+    assert store.migrate_json(history_dir) == 1
+    assert store.get_history(9) == [{"role": "user", "content": "Исправлено"}]
+
+
+def test_shared_mode_writes_are_visible_to_other_processes(tmp_path):
+    path = str(tmp_path / "chat_histories.sqlite3")
+    first = SessionStore(path=path, shared=True)
+    second = SessionStore(path=path, shared=True)
+    try:
+        assert first._conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+        first.append(42, "user", "Как вернуть товар?")
+        assert second.get_history(42) == [{"role": "user", "content": "Как вернуть товар?"}]
+        second.clear(42)
+        assert first.get_history(42) == []
+    finally:
+        first.close()
+        second.close()
+
+
+def test_conversation_states_survive_restart(tmp_path):
+    from bot_persistence import SqliteConversationPersistence
+
+    path = str(tmp_path / "chat_histories.sqlite3")
+
+    async def scenario():
+        persistence = SqliteConversationPersistence(path=path)
+        await persistence.update_conversation("consultation", (7, 7), 1)
+        await persistence.update_conversation("consultation", (8, 8), 0)
+        await persistence.update_conversation("consultation", (8, 8), None)
+        await persistence.flush()
+        restarted = SqliteConversationPersistence(path=path)
+        states = await restarted.get_conversations("consultation")
+        await restarted.flush()
+        return states
+
+    assert asyncio.run(scenario()) == {(7, 7): 1}
@@ -0,0 +1,35 @@
+import pytest
+
+from text_store import MetadataStore, TextStore
+
+
+def test_round_trip_through_mmap(tmp_path):
+    prefix = str(tmp_path / "texts")
+    texts = ["Статья 18. Права потребителя", "", "ascii", "последний"]
+    assert TextStore.write(prefix, (text for text in texts)) == 4
+
+    store = TextStore.load(prefix)
+    assert len(store) == 4
+    assert list(store) == texts
+    assert store[-1] == "последний" and store[1:3] == ["", "ascii"]
+    with pytest.raises(IndexError):
+        store[4]
+
+
+def test_metadata_and_empty_store(tmp_path):
+    prefix = str(tmp_path / "metadata")
+    metadatas = [{"source": "закон.pdf", "page": 3}, {}]
+    MetadataStore.write(prefix, metadatas)
+    assert list(MetadataStore.load(prefix)) == metadatas
+
+    TextStore.write(str(tmp_path / "empty"), [])
+    assert len(TextStore.load(str(tmp_path / "empty"))) == 0
+
+
+def test_truncated_blob_is_rejected(tmp_path):
+    prefix = str(tmp_path / "texts")
+    TextStore.write(prefix, ["Статья 18"])
+    with open(prefix + ".bin", "r+b") as f:
+        f.truncate(3)
+    with pytest.raises(ValueError):
+        TextStore.load(prefix)
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+from text_store import MetadataStore, TextStore
+from vector_index import VectorIndex
+
+NUM_CHUNKS = 2000
+DIM = 64
+NUM_TOPICS = 100
+K = 10
+
+
+def make_index(quantization):
+    rng = np.random.RandomState(0)
+    # Чанки сгруппированы вокруг тем, как эмбеддинги статей одного закона
+    topics = rng.normal(size=(NUM_TOPICS, DIM))
+    embeddings = topics[np.arange(NUM_CHUNKS) % NUM_TOPICS] + rng.normal(scale=0.5, size=(NUM_CHUNKS, DIM))
+    embeddings = embeddings.astype(np.float32)
+    ids = [f"chunk{n}" for n in range(NUM_CHUNKS)]
+    metadatas = [{"source": f"law{n % 4}.pdf"} for n in range(NUM_CHUNKS)]
+    return VectorIndex.build(ids, embeddings, ids, metadatas, quantization=quantization), embeddings
+
+
+def queries(embeddings, count=50):
+    rng = np.random.RandomState(1)
+    # Вопросы близки к чанкам, но не совпадают с ними
+    return embeddings[:count] + rng.normal(scale=0.3, size=(count, DIM)).astype(np.float32)
+
+
+def recall(index, exact, query, **kwargs):
+    found = {doc for doc, _ in index.search(query, K, **kwargs)}
+    expected = {doc for doc, _ in exact.search(query, K, **kwargs)}
+    return len(found & expected) / K
+
+
+@pytest.mark.parametrize("quantization, min_recall", [("int8", 0.95), ("binary", 0.9)])
+def test_quantized_search_recall(quantization, min_recall):
+    exact, embeddings = make_index("none")
+    index, _ = make_index(quantization)
+    assert index.memory_bytes() < exact.memory_bytes()
+
+    recalls = [recall(index, exact, query) for query in queries(embeddings)]
+    assert np.mean(recalls) >= min_recall
+    # Оценки после пересчёта точные
+    query = queries(embeddings)[0]
+    assert index.search(query, 1)[0][1] == pytest.approx(exact.search(query, 1)[0][1], abs=1e-5)
+
+
+def test_quantized_search_respects_partitions():
+    exact, embeddings = make_index("none")
+    index, _ = make_index("int8")
+    for query in queries(embeddings, count=10):
+        results = index.search(query, K, partitions=["law1.pdf"])
+        assert {index.metadatas[doc]["source"] for doc, _ in results} == {"law1.pdf"}
+        assert recall(index, exact, query, partitions=["law1.pdf"]) >= 0.9
+
+
+def test_save_keeps_texts_out_of_process_memory(tmp_path):
+    index, embeddings = make_index("int8")
+    index.save(str(tmp_path))
+
+    loaded = VectorIndex.load(str(tmp_path))
+    # Тексты и метаданные читаются из файлов, отображённых в память, а не из pickle
+    assert isinstance(loaded.texts, TextStore) and isinstance(loaded.metadatas, MetadataStore)
+    query = queries(embeddings)[0]
+    assert loaded.search(query, K) == index.search(query, K)
+    doc, _ = loaded.search(query, 1)[0]
+    assert loaded.texts[doc] == index.texts[doc] and loaded.metadatas[doc] == index.metadatas[doc]
+    assert loaded.search(query, K, where={"source": "law2.pdf"}) == index.search(query, K, where={"source": "law2.pdf"})
+
+
+@pytest.mark.parametrize("quantization", ["none", "int8", "binary"])
+def test_write_streams_chunks_like_build(tmp_path, quantization):
+    index, embeddings = make_index(quantization)
+    ids = [f"chunk{n}" for n in range(NUM_CHUNKS)]
+    metadatas = [{"source": f"law{n % 4}.pdf"} for n in range(NUM_CHUNKS)]
+    written = VectorIndex.write(str(tmp_path), [metadata["source"] for metadata in metadatas],
+                                iter(zip(ids, embeddings, ids, metadatas)), quantization=quantization)
+
+    assert written.ids == index.ids and written.partitions == index.partitions
+    np.testing.assert_allclose(written.vectors, index.vectors, atol=1e-6)
+    assert list(written.texts) == list(index.texts) and list(written.metadatas) == list(index.metadatas)
+    query = queries(embeddings)[0]
+    assert [doc for doc, _ in written.search(query, K)] == [doc for doc, _ in index.search(query, K)]
+    # Промежуточные хранилища удалены
+    assert not [name for name in os.listdir(tmp_path) if "unsorted" in name or name.endswith(".tmp")]
+
+
+def test_write_rejects_missing_chunks(tmp_path):
+    with pytest.raises(ValueError):
+        VectorIndex.write(str(tmp_path), ["law.pdf", "law.pdf"], iter([("a", [1.0, 0.0], "a", {})]))
@@ -0,0 +1,20 @@
+from webhook import update_user_id, worker_index, worker_share
+
+
+def test_update_user_id():
+    assert update_user_id({"update_id": 1, "message": {"from": {"id": 5}, "chat": {"id": 6}}}) == 5
+    assert update_user_id({"update_id": 2, "my_chat_member": {"chat": {"id": 7}}}) == 7
+    assert update_user_id({"update_id": 3}) is None
+
+
+def test_worker_index_is_sticky():
+    assert worker_index(None, 4) == 0
+    assert {worker_index(123, 4) for _ in range(10)} == {worker_index(123, 4)}
+    assert {worker_index(user_id, 4) for user_id in range(100)} == {0, 1, 2, 3}
+
+
+def test_worker_share_splits_total():
+    assert [worker_share(10, index, 4) for index in range(4)] == [3, 3, 2, 2]
+    assert sum(worker_share(32, index, 3) for index in range(3)) == 32
+    # Процессов больше, чем лимит: каждому всё равно нужен хотя бы один вызов
+    assert [worker_share(2, index, 3) for index in range(3)] == [1, 1, 1]
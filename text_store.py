@@ -0,0 +1,133 @@
+import json
+import os
+from array import array
+from typing import Iterable, Sequence, Union
+
+import numpy as np
+
+# Файлы хранилища: тексты подряд в UTF-8 и границы строк
+_BLOB_SUFFIX = ".bin"
+_OFFSETS_SUFFIX = "_offsets.npy"
+
+
+class TextStoreWriter:
+    """
+    Последовательная запись строк в TextStore (через временные файлы).
+
+    Строки сразу уходят на диск, в памяти остаются только их границы;
+    файлы хранилища заменяются в close(), при ошибке временные файлы
+    удаляются.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        # Границы строк в компактном массиве int64
+        self.offsets = array("q", [0])
+        self._file = open(prefix + _BLOB_SUFFIX + ".tmp", "wb")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def append(self, text: str):
+        data = text.encode("utf-8")
+        self._file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self) -> int:
+        """Запись границ строк и замена файлов хранилища; возвращает число строк"""
+        self._file.close()
+        with open(self.prefix + _OFFSETS_SUFFIX + ".tmp", "wb") as f:
+            np.save(f, np.frombuffer(self.offsets, dtype=np.int64))
+        os.replace(self.prefix + _BLOB_SUFFIX + ".tmp", self.prefix + _BLOB_SUFFIX)
+        os.replace(self.prefix + _OFFSETS_SUFFIX + ".tmp", self.prefix + _OFFSETS_SUFFIX)
+        return len(self)
+
+    def abort(self):
+        self._file.close()
+        for suffix in (_BLOB_SUFFIX, _OFFSETS_SUFFIX):
+            if os.path.exists(self.prefix + suffix + ".tmp"):
+                os.remove(self.prefix + suffix + ".tmp")
+
+    def __enter__(self) -> "TextStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def remove_store(prefix: str):
+    """Удаление файлов хранилища"""
+    for suffix in (_BLOB_SUFFIX, _OFFSETS_SUFFIX):
+        if os.path.exists(prefix + suffix):
+            os.remove(prefix + suffix)
+
+
+class TextStore(Sequence):
+    """
+    Строки чанков в файле, отображённом в память.
+
+    Тексты лежат подряд в одном файле, границы строк — в массиве .npy.
+    Оба файла открываются через mmap: процессы бота, загрузившие одну
+    версию индекса, делят страницы в кэше ОС, а строка декодируется
+    только при обращении к ней.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _decode(self, index: int) -> str:
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode("utf-8")
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self._decode(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._decode(index)
+
+    @property
+    def nbytes(self) -> int:
+        return self.blob.nbytes + self.offsets.nbytes
+
+    @staticmethod
+    def write(prefix: str, texts: Iterable[str]) -> int:
+        """Запись строк (через временные файлы); texts может быть генератором. Возвращает число строк"""
+        with TextStoreWriter(prefix) as writer:
+            for text in texts:
+                writer.append(text)
+        return len(writer)
+
+    @classmethod
+    def load(cls, prefix: str) -> "TextStore":
+        offsets = np.load(prefix + _OFFSETS_SUFFIX, mmap_mode="r")
+        blob_path = prefix + _BLOB_SUFFIX
+        if os.path.getsize(blob_path) != int(offsets[-1]):
+            raise ValueError(f"Хранилище текстов {blob_path} повреждено, пересоберите индекс")
+        # Пустой файл нельзя отобразить в память
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if offsets[-1] else np.empty(0, dtype=np.uint8)
+        return cls(blob, offsets)
+
+
+class MetadataStore(TextStore):
+    """Метаданные чанков в виде JSON в TextStore; словарь собирается при обращении"""
+
+    def _decode(self, index: int) -> dict:
+        return json.loads(super()._decode(index))
+
+    @staticmethod
+    def encode(metadata: dict) -> str:
+        """Строка хранилища для метаданных (для записи через TextStoreWriter)"""
+        return json.dumps(metadata, ensure_ascii=False)
+
+    @staticmethod
+    def write(prefix: str, metadatas: Iterable[dict]) -> int:
+        return TextStore.write(prefix, (MetadataStore.encode(metadata) for metadata in metadatas))
@@ -0,0 +1,99 @@
+import hashlib
+import re
+
+
+def normalize_text(text):
+    """Нормализация текста для дедупликации"""
+    # Удаление лишних пробелов и специальных символов
+    text = re.sub(r'\s+', ' ', text)
+    # Приведение к нижнему регистру и удаление специальных символов
+    return re.sub(r'[^\w]', '', text.lower())
+
+
+def hash_text(text):
+    """SHA-256 хэширование текста с нормализацией"""
+    normalized = normalize_text(text)
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+# Стеммер Портера (Snowball) для русского языка
+_RVRE = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_I = re.compile(r'и$')
+_DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_DER = re.compile(r'ость?$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+_SOFT_SIGN = re.compile(r'ь$')
+_NN = re.compile(r'нн$')
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Служебные слова, не несущие смысла для поиска
+RUSSIAN_STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от
+меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять уж
+вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто
+чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один почти мой
+тем чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после над больше тот
+через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть
+том нельзя такой им более всегда конечно всю между это также либо который которая которые которых
+""".split())
+
+
+def stem_russian(word):
+    """Основа русского слова по алгоритму Snowball"""
+    word = word.lower().replace('ё', 'е')
+    match = _RVRE.match(word)
+    if not match:
+        return word
+
+    prefix, rv = match.groups()
+
+    # Шаг 1: деепричастия, возвратные частицы, прилагательные, глаголы, существительные
+    temp = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if temp == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        temp = _ADJECTIVE.sub('', rv, 1)
+        if temp != rv:
+            rv = _PARTICIPLE.sub('', temp, 1)
+        else:
+            temp = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+
+    # Шаг 2: конечная «и»
+    rv = _I.sub('', rv, 1)
+
+    # Шаг 3: словообразовательные суффиксы
+    if _DERIVATIONAL.match(rv):
+        rv = _DER.sub('', rv, 1)
+
+    # Шаг 4: мягкий знак, превосходная степень, двойная «н»
+    temp = _SOFT_SIGN.sub('', rv, 1)
+    if temp == rv:
+        rv = _SUPERLATIVE.sub('', rv, 1)
+        rv = _NN.sub('н', rv, 1)
+    else:
+        rv = temp
+
+    return prefix + rv
+
+
+def tokenize(text):
+    """Токенизация для лексического поиска: нижний регистр, без стоп-слов, со стеммингом"""
+    return [
+        stem_russian(token) if not token.isdigit() else token
+        for token in _TOKEN_RE.findall(text.lower())
+        if token not in RUSSIAN_STOPWORDS
+    ]
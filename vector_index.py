@@ -0,0 +1,375 @@
+import os
+import pickle
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from text_store import MetadataStore, TextStore, TextStoreWriter, remove_store
+
+# Файлы векторного индекса внутри каталога Chroma
+VECTOR_INDEX_FILE = "vectors.npy"
+VECTOR_CODES_FILE = "vectors_codes.npy"
+VECTOR_META_FILE = "vectors_meta.pkl"
+# Тексты и метаданные чанков (TextStore, отображаются в память)
+VECTOR_TEXTS_PREFIX = "vectors_texts"
+VECTOR_METADATA_PREFIX = "vectors_metadata"
+# Тип элементов матрицы: float32 или float16 (вдвое меньше памяти)
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")
+# Сжатые коды для первого прохода поиска: none, int8 (в 4 раза меньше float32) или binary (в 32 раза)
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "none")
+# Во сколько раз больше k кандидатов первого прохода пересчитывается по точным векторам
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "10"))
+# Поле метаданных, по которому чанки делятся на разделы (один раздел — один закон)
+PARTITION_KEY = "source"
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+
+# Версия формата файла метаданных; при несовпадении индекс нужно пересобрать
+_FORMAT_VERSION = 4
+
+# Коды int8 переводятся во float блоками, которые помещаются в кэш процессора
+_SCAN_BLOCK = 256
+# Число единичных битов в каждом байте (для numpy < 2.0 без bitwise_count)
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(codes: np.ndarray, bits: np.ndarray) -> np.ndarray:
+    """Расстояния Хэмминга от упакованных битовых кодов до кода запроса"""
+    if codes.shape[1] % 8 == 0:
+        # Побитовые операции над словами по 64 бита в 8 раз короче, чем над байтами
+        codes = np.ascontiguousarray(codes).view(np.uint64)
+        bits = bits.view(np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes ^ bits).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[(codes ^ bits).view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+def quantize(vectors: np.ndarray, quantization: str,
+             allocate: Callable[[Tuple[int, int], type], np.ndarray] = np.empty
+             ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    Сжатые коды нормированных векторов и масштабы измерений.
+
+    int8 — скалярное квантование с масштабом по каждому измерению,
+    binary — знаки компонент, упакованные по 8 в байт. Векторы читаются
+    блоками (матрица может быть отображена в память), массив кодов
+    создаёт allocate(форма, тип) — например, файл через open_memmap.
+    """
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Неизвестный режим квантования {quantization!r}, ожидается один из {QUANTIZATION_MODES}")
+    if quantization == "none":
+        return None, None
+    num_vectors, dim = vectors.shape
+    if quantization == "binary":
+        codes = allocate((num_vectors, (dim + 7) // 8), np.uint8)
+        for start in range(0, num_vectors, _SCAN_BLOCK):
+            block = np.asarray(vectors[start:start + _SCAN_BLOCK])
+            codes[start:start + len(block)] = np.packbits(block > 0, axis=1)
+        return codes, None
+
+    scales = np.zeros(dim, dtype=np.float32)
+    for start in range(0, num_vectors, _SCAN_BLOCK):
+        block = np.asarray(vectors[start:start + _SCAN_BLOCK], dtype=np.float32)
+        np.maximum(scales, np.abs(block).max(axis=0), out=scales)
+    scales /= 127
+    scales[scales == 0] = 1.0
+    codes = allocate((num_vectors, dim), np.int8)
+    for start in range(0, num_vectors, _SCAN_BLOCK):
+        block = np.asarray(vectors[start:start + _SCAN_BLOCK], dtype=np.float32)
+        codes[start:start + len(block)] = np.clip(np.rint(block / scales), -127, 127)
+    return codes, scales
+
+
+class VectorIndex:
+    """
+    Точный косинусный поиск по матрице эмбеддингов чанков.
+
+    Векторы хранятся нормированными в файле .npy, который открывается через
+    mmap: процессы бота, загрузившие один и тот же файл, делят страницы
+    в кэше ОС. Тексты и метаданные чанков так же отображаются в память
+    (TextStore), в куче процесса остаются только идентификаторы.
+
+    Чанки одного источника (PARTITION_KEY) лежат в матрице подряд, поэтому
+    поиск по разделу читает только его строки и не замедляется при
+    добавлении других законов.
+
+    С квантованием первый проход идёт по сжатым кодам (int8 или битовым),
+    а k * rescore_factor лучших кандидатов пересчитываются по точным
+    векторам. Точная матрица остаётся на диске: из неё читаются только
+    строки кандидатов.
+    """
+
+    def __init__(self, vectors: np.ndarray, ids: List[str], texts: List[str], metadatas: List[Dict],
+                 partitions: Optional[Dict[str, Tuple[int, int]]] = None, quantization: str = "none",
+                 codes: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None,
+                 rescore_factor: int = VECTOR_RESCORE_FACTOR):
+        self.vectors = vectors
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        # Раздел -> диапазон строк матрицы [start, stop)
+        self.partitions = partitions or {}
+        self.quantization = quantization
+        self.codes = codes
+        self.scales = scales
+        self.rescore_factor = rescore_factor
+        # Номера чанков для пар (поле метаданных, значение), строятся по запросу
+        self._filter_cache: Dict[Tuple[str, object], np.ndarray] = {}
+
+    @classmethod
+    def build(cls, ids: Sequence[str], embeddings: Sequence[Sequence[float]], texts: Sequence[str],
+              metadatas: Sequence[Optional[Dict]], dtype: str = VECTOR_INDEX_DTYPE,
+              partition_key: str = PARTITION_KEY, quantization: str = VECTOR_INDEX_QUANTIZATION) -> "VectorIndex":
+        """Построение индекса по эмбеддингам чанков, сгруппированным по разделам"""
+        metadatas = [metadata or {} for metadata in metadatas]
+        # Устойчивая сортировка по разделу: внутри раздела порядок чанков сохраняется
+        order = sorted(range(len(ids)), key=lambda i: str(metadatas[i].get(partition_key, "")))
+
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)[order]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = (vectors / norms).astype(dtype)
+
+        metadatas = [metadatas[i] for i in order]
+        partitions: Dict[str, Tuple[int, int]] = {}
+        for position, metadata in enumerate(metadatas):
+            name = str(metadata.get(partition_key, ""))
+            start, _ = partitions.get(name, (position, position))
+            partitions[name] = (start, position + 1)
+
+        codes, scales = quantize(vectors, quantization)
+        return cls(vectors, [ids[i] for i in order], [texts[i] for i in order], metadatas, partitions,
+                   quantization=quantization, codes=codes, scales=scales)
+
+    def memory_bytes(self) -> int:
+        """Объём данных, читаемых первым проходом поиска (то, что должно быть в памяти)"""
+        if self.codes is not None:
+            return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        return self.vectors.nbytes
+
+    def centroids(self) -> Tuple[List[str], np.ndarray]:
+        """Названия разделов и нормированные центроиды их векторов"""
+        names = sorted(self.partitions)
+        centroids = np.zeros((len(names), self.vectors.shape[1]), dtype=np.float32)
+        for row, name in enumerate(names):
+            start, stop = self.partitions[name]
+            # Сумма по блокам: раздел может не помещаться в память целиком
+            centroid = np.zeros(self.vectors.shape[1], dtype=np.float64)
+            for block_start in range(start, stop, _SCAN_BLOCK):
+                centroid += np.asarray(self.vectors[block_start:min(stop, block_start + _SCAN_BLOCK)],
+                                       dtype=np.float32).sum(axis=0)
+            centroid = (centroid / max(stop - start, 1)).astype(np.float32)
+            norm = np.linalg.norm(centroid)
+            centroids[row] = centroid / norm if norm else centroid
+        return names, centroids
+
+    def _filter_indices(self, where: Dict) -> np.ndarray:
+        """Номера чанков, метаданные которых совпадают со всеми полями where"""
+        result = None
+        for key, value in where.items():
+            indices = self._filter_cache.get((key, value))
+            if indices is None:
+                indices = np.fromiter(
+                    (i for i, metadata in enumerate(self.metadatas) if metadata.get(key) == value),
+                    dtype=np.int64,
+                )
+                self._filter_cache[(key, value)] = indices
+            result = indices if result is None else np.intersect1d(result, indices, assume_unique=True)
+        return result
+
+    def _candidates(self, where: Optional[Dict],
+                    partitions: Optional[Sequence[str]]) -> Tuple[Optional[np.ndarray], List[Tuple[int, int]]]:
+        """Номера строк для поиска (None — все) и диапазоны разделов, если поиск идёт по ним"""
+        ranges = [self.partitions[name] for name in partitions or () if name in self.partitions]
+        if where:
+            candidates = self._filter_indices(where)
+            if ranges:
+                inside = np.zeros(len(candidates), dtype=bool)
+                for start, stop in ranges:
+                    inside |= (candidates >= start) & (candidates < stop)
+                candidates = candidates[inside]
+            return candidates, []
+        if ranges:
+            return np.concatenate([np.arange(start, stop) for start, stop in ranges]), ranges
+        return None, []
+
+    @staticmethod
+    def _scan(score_rows: Callable[[object], np.ndarray], candidates: Optional[np.ndarray],
+              ranges: List[Tuple[int, int]]) -> np.ndarray:
+        """Оценки строк-кандидатов; срезы по разделам — представления mmap без копирования"""
+        if ranges:
+            return np.concatenate([score_rows(slice(start, stop)) for start, stop in ranges])
+        return score_rows(slice(None) if candidates is None else candidates)
+
+    def _exact_scores(self, rows, query: np.ndarray) -> np.ndarray:
+        return self.vectors[rows] @ query.astype(self.vectors.dtype)
+
+    def _approximate_scores(self, rows, query: np.ndarray) -> np.ndarray:
+        """Оценки первого прохода по сжатым кодам (чем больше, тем ближе)"""
+        codes = self.codes[rows]
+        if self.quantization == "binary":
+            # Минус расстояние Хэмминга между знаками компонент
+            return -hamming_distances(codes, np.packbits(query > 0)).astype(np.float32)
+
+        scores = np.empty(len(codes), dtype=np.float32)
+        weights = query * self.scales
+        for start in range(0, len(codes), _SCAN_BLOCK):
+            block = codes[start:start + _SCAN_BLOCK]
+            scores[start:start + len(block)] = block.astype(np.float32) @ weights
+        return scores
+
+    @staticmethod
+    def _top(scores: np.ndarray, k: int) -> np.ndarray:
+        """Позиции k наибольших оценок по убыванию"""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        # argpartition отбирает k лучших за O(n), сортируются только они
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def search(self, embedding: Sequence[float], k: int, where: Optional[Dict] = None,
+               partitions: Optional[Sequence[str]] = None) -> List[Tuple[int, float]]:
+        """
+        Топ-k чанков по косинусной близости: список (номер чанка, оценка).
+
+        partitions ограничивает поиск строками указанных разделов.
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        candidates, ranges = self._candidates(where, partitions)
+        if self.codes is not None:
+            scores = self._scan(lambda rows: self._approximate_scores(rows, query), candidates, ranges)
+            shortlist = self._top(scores, k * self.rescore_factor)
+            # Строки кандидатов читаются с диска по возрастанию номеров
+            candidates = np.sort(shortlist if candidates is None else candidates[shortlist])
+            scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+        else:
+            scores = self._scan(lambda rows: self._exact_scores(rows, query), candidates, ranges)
+
+        top = self._top(scores, k)
+        indices = top if candidates is None else candidates[top]
+        return [(int(index), float(scores[position])) for index, position in zip(indices, top)]
+
+    def save(self, directory: str):
+        """Сохранение матрицы, текстов и метаданных (через временные файлы)"""
+        with open(os.path.join(directory, VECTOR_INDEX_FILE) + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors))
+        if self.codes is not None:
+            with open(os.path.join(directory, VECTOR_CODES_FILE) + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(self.codes))
+        TextStore.write(os.path.join(directory, VECTOR_TEXTS_PREFIX), self.texts)
+        MetadataStore.write(os.path.join(directory, VECTOR_METADATA_PREFIX), self.metadatas)
+        _publish(directory, self.ids, self.partitions, self.quantization, self.scales)
+
+    @classmethod
+    def write(cls, directory: str, partition_values: Sequence[str],
+              chunks: Iterable[Tuple[str, Sequence[float], str, Optional[Dict]]],
+              dtype: str = VECTOR_INDEX_DTYPE, quantization: str = VECTOR_INDEX_QUANTIZATION) -> "VectorIndex":
+        """
+        Потоковое построение индекса в каталоге directory.
+
+        chunks — кортежи (id, эмбеддинг, текст, метаданные) в том же порядке,
+        что и partition_values (раздел каждого чанка). Векторы сразу пишутся
+        в файл матрицы на свои строки, тексты и метаданные — в хранилища на
+        диске, поэтому в памяти остаются только идентификаторы. Возвращает
+        загруженный индекс.
+        """
+        num_chunks = len(partition_values)
+        names = sorted(set(partition_values))
+        rank = {name: position for position, name in enumerate(names)}
+        partition_codes = np.fromiter((rank[value] for value in partition_values), dtype=np.int32, count=num_chunks)
+        # Устойчивая сортировка по разделу, как в build(): строка матрицы для каждого чанка
+        order = np.argsort(partition_codes, kind="stable")
+        rows = np.empty(num_chunks, dtype=np.int64)
+        rows[order] = np.arange(num_chunks)
+        counts = np.bincount(partition_codes, minlength=len(names))
+        partitions = {name: (int(stop - count), int(stop))
+                      for name, count, stop in zip(names, counts, np.cumsum(counts))}
+
+        vectors_path = os.path.join(directory, VECTOR_INDEX_FILE) + ".tmp"
+        codes_path = os.path.join(directory, VECTOR_CODES_FILE) + ".tmp"
+        # Тексты приходят в порядке коллекции и переупорядочиваются по разделам после записи
+        unsorted_texts = os.path.join(directory, VECTOR_TEXTS_PREFIX + "_unsorted")
+        unsorted_metadata = os.path.join(directory, VECTOR_METADATA_PREFIX + "_unsorted")
+        ids: List[Optional[str]] = [None] * num_chunks
+        vectors = None
+        received = 0
+        with TextStoreWriter(unsorted_texts) as texts, TextStoreWriter(unsorted_metadata) as metadatas:
+            for chunk, (chunk_id, embedding, text, metadata) in enumerate(chunks):
+                if chunk >= num_chunks:
+                    raise ValueError(f"Чанков больше, чем разделов ({num_chunks})")
+                vector = np.asarray(embedding, dtype=np.float32)
+                if vectors is None:
+                    vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=dtype,
+                                                        shape=(num_chunks, len(vector)))
+                norm = np.linalg.norm(vector)
+                vectors[rows[chunk]] = vector / norm if norm else vector
+                ids[rows[chunk]] = chunk_id
+                texts.append(text)
+                metadatas.append(MetadataStore.encode(metadata or {}))
+                received += 1
+        if vectors is None or received != num_chunks:
+            raise ValueError(f"Получено {received} чанков, ожидалось {num_chunks}")
+
+        for unsorted, prefix in ((unsorted_texts, VECTOR_TEXTS_PREFIX), (unsorted_metadata, VECTOR_METADATA_PREFIX)):
+            store = TextStore.load(unsorted)
+            TextStore.write(os.path.join(directory, prefix), (store[chunk] for chunk in order))
+            del store
+            remove_store(unsorted)
+
+        vectors.flush()
+        codes, scales = quantize(vectors, quantization, allocate=lambda shape, code_dtype: np.lib.format.open_memmap(
+            codes_path, mode="w+", dtype=code_dtype, shape=shape))
+        if codes is not None:
+            codes.flush()
+        del vectors, codes
+        _publish(directory, ids, partitions, quantization, scales)
+        return cls.load(directory)
+
+    @classmethod
+    def load(cls, directory: str) -> "VectorIndex":
+        """Загрузка индекса, построенного ingest.py; матрица, коды и тексты отображаются в память"""
+        meta_path = os.path.join(directory, VECTOR_META_FILE)
+        with open(meta_path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") != _FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия векторного индекса в {meta_path}, пересоберите индекс")
+
+        vectors = np.load(os.path.join(directory, VECTOR_INDEX_FILE), mmap_mode="r")
+        codes = None
+        if data["quantization"] != "none":
+            codes = np.load(os.path.join(directory, VECTOR_CODES_FILE), mmap_mode="r")
+        texts = TextStore.load(os.path.join(directory, VECTOR_TEXTS_PREFIX))
+        metadatas = MetadataStore.load(os.path.join(directory, VECTOR_METADATA_PREFIX))
+        if (len(vectors) != len(data["ids"]) or (codes is not None and len(codes) != len(vectors))
+                or len(texts) != len(vectors) or len(metadatas) != len(vectors)):
+            raise ValueError(f"Векторный индекс в {directory} повреждён, пересоберите индекс")
+        return cls(vectors, data["ids"], texts, metadatas, data["partitions"],
+                   quantization=data["quantization"], codes=codes, scales=data["scales"])
+
+
+def _publish(directory: str, ids: List[str], partitions: Dict[str, Tuple[int, int]], quantization: str,
+             scales: Optional[np.ndarray]):
+    """Запись файла идентификаторов и замена матрицы и кодов, записанных во временные файлы"""
+    vectors_path = os.path.join(directory, VECTOR_INDEX_FILE)
+    codes_path = os.path.join(directory, VECTOR_CODES_FILE)
+    meta_path = os.path.join(directory, VECTOR_META_FILE)
+    with open(meta_path + ".tmp", "wb") as f:
+        pickle.dump({
+            "version": _FORMAT_VERSION,
+            "ids": ids,
+            "partitions": partitions,
+            "quantization": quantization,
+            "scales": scales,
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(vectors_path + ".tmp", vectors_path)
+    if os.path.exists(codes_path + ".tmp"):
+        os.replace(codes_path + ".tmp", codes_path)
+    elif os.path.exists(codes_path):
+        os.remove(codes_path)
+    os.replace(meta_path + ".tmp", meta_path)
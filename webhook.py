@@ -0,0 +1,281 @@
+"""
+Режим webhook: несколько процессов бота за одним HTTP-эндпоинтом.
+
+Роутер принимает обновления Telegram и передаёт каждое в процесс-обработчик,
+выбранный по ID пользователя, поэтому обновления одного пользователя
+обрабатываются одним процессом по порядку. История диалогов и состояния
+ConversationHandler хранятся в общей базе SQLite, так что после перезапуска
+или изменения числа процессов диалог продолжается с того же шага.
+
+Маршрутизация должна быть липкой: состояния диалогов процесс читает из базы
+только при запуске, и диалог, начатый в другом процессе, он увидит лишь
+после перезапуска. Поэтому обработчик принимает только обновления своих
+пользователей (остальные получают 421), а перед роутером не должно быть
+балансировщика, раскидывающего обновления по обработчикам напрямую.
+
+Лимиты LLM_MAX_IN_FLIGHT и LLM_MAX_QUEUED относятся ко всей установке
+и делятся между процессами. Ограничение частоты вопросов ведётся по
+пользователю, а пользователь всегда попадает в один процесс, поэтому
+оно не умножается на число процессов.
+
+    python webhook.py --workers 4
+
+Локальная проверка без Telegram — см. fake_telegram.py.
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("webhook")
+
+# Конфигурация (можно переопределить через .env)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Публичный адрес, регистрируемый в Telegram через setWebhook (пусто — не регистрировать)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+# Процессы-обработчики слушают порты WORKER_BASE_PORT, WORKER_BASE_PORT + 1, ...
+WORKER_HOST = "127.0.0.1"
+WORKER_BASE_PORT = int(os.getenv("WEBHOOK_WORKER_BASE_PORT", "8500"))
+WORKER_TIMEOUT = float(os.getenv("WEBHOOK_WORKER_TIMEOUT", "10"))
+
+
+def update_user_id(data: Dict) -> Optional[int]:
+    """ID пользователя (или чата) из обновления Telegram в виде JSON"""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            entity = value.get(field)
+            if isinstance(entity, dict) and "id" in entity:
+                return entity["id"]
+    return None
+
+
+def worker_index(user_id: Optional[int], workers: int) -> int:
+    """Номер процесса, который обслуживает пользователя"""
+    if user_id is None:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % workers
+
+
+def worker_port(index: int) -> int:
+    return WORKER_BASE_PORT + index
+
+
+def worker_share(total: int, index: int, workers: int) -> int:
+    """Доля общего лимита для процесса index: доли в сумме дают total (но не меньше 1 на процесс)"""
+    return max(1, total // workers + (1 if index < total % workers else 0))
+
+
+def _worker_handler(application, loop, index: int, workers: int):
+    from telegram import Update
+
+    class WorkerHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                data = json.loads(body)
+                update = Update.de_json(data, application.bot)
+            except Exception as e:
+                logger.warning(f"Некорректное обновление: {e}")
+                self._reply(400)
+                return
+            if worker_index(update_user_id(data), workers) != index:
+                # Состояние диалога этого пользователя хранится в памяти другого процесса
+                logger.warning(f"Обработчик {index}: обновление другого обработчика отклонено")
+                self._reply(421)
+                return
+            # Обновление обрабатывается в event loop приложения
+            asyncio.run_coroutine_threadsafe(application.update_queue.put(update), loop).result()
+            self._reply(200)
+
+        def _reply(self, status: int):
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return WorkerHandler
+
+
+async def _serve_worker(index: int, workers: int):
+    # Тяжёлые модули загружаются только в процессах-обработчиках
+    import telegram_bot
+    from admission import LLM_MAX_IN_FLIGHT, LLM_MAX_QUEUED, AdmissionController
+    from bot_persistence import SqliteConversationPersistence
+    from metrics import METRICS_PORT, start_metrics_server
+
+    # Лимиты вызовов LLM заданы на все процессы вместе
+    telegram_bot.admission = AdmissionController(
+        max_in_flight=worker_share(LLM_MAX_IN_FLIGHT, index, workers),
+        max_queued=worker_share(LLM_MAX_QUEUED, index, workers),
+    )
+    application = telegram_bot.build_application(persistence=SqliteConversationPersistence(), updater=False)
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # У каждого процесса свой порт метрик: METRICS_PORT + 1 + номер
+    start_metrics_server(port=METRICS_PORT + 1 + index if METRICS_PORT else 0)
+    telegram_bot.pipeline_loader.start()
+
+    async with application:
+        await application.start()
+        server = ThreadingHTTPServer((WORKER_HOST, worker_port(index)), _worker_handler(application, loop, index, workers))
+        threading.Thread(target=server.serve_forever, name="webhook-worker-http", daemon=True).start()
+        logger.info(f"Обработчик {index} слушает {WORKER_HOST}:{worker_port(index)}")
+
+        await stop.wait()
+        server.shutdown()
+        await application.stop()
+
+    await application.post_shutdown(application)
+
+
+def run_worker(index: int, workers: int):
+    """Точка входа процесса-обработчика"""
+    asyncio.run(_serve_worker(index, workers))
+
+
+def migrate_histories():
+    """Перенос историй старого формата один раз в роутере, до запуска обработчиков"""
+    from session_store import HISTORY_DIR, SessionStore
+
+    if not HISTORY_DIR.exists():
+        return
+    store = SessionStore(shared=True)
+    try:
+        store.migrate_json(HISTORY_DIR)
+    finally:
+        store.close()
+
+
+class RouterHandler(BaseHTTPRequestHandler):
+    """Приём обновлений Telegram и передача их обработчику пользователя"""
+    workers = 1
+
+    def do_POST(self):
+        if self.path.split("?")[0] != WEBHOOK_PATH:
+            self._reply(404)
+            return
+        if WEBHOOK_SECRET and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            self._reply(403)
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            data = json.loads(body)
+        except ValueError:
+            self._reply(400)
+            return
+
+        index = worker_index(update_user_id(data), self.workers)
+        try:
+            connection = http.client.HTTPConnection(WORKER_HOST, worker_port(index), timeout=WORKER_TIMEOUT)
+            connection.request("POST", "/", body, {"Content-Type": "application/json"})
+            status = connection.getresponse().status
+            connection.close()
+        except OSError as e:
+            logger.warning(f"Обработчик {index} недоступен: {e}")
+            status = 503
+        # При ошибке Telegram повторит доставку обновления позже
+        self._reply(200 if status == 200 else 503)
+
+    def _reply(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def register_webhook(url: str, secret: str):
+    """Регистрация адреса webhook в Telegram"""
+    from telegram import Bot, Update
+
+    api_base_url = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org").rstrip("/")
+    async with Bot(os.getenv("TELEGRAM_BOT_TOKEN"), base_url=f"{api_base_url}/bot") as bot:
+        await bot.set_webhook(url=url, secret_token=secret or None, allowed_updates=Update.ALL_TYPES)
+
+
+def serve(workers: int = WEBHOOK_WORKERS, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+    """Запуск роутера и процессов-обработчиков; упавшие обработчики перезапускаются"""
+    # Процессы делят историю диалогов через SQLite, без локального кэша
+    os.environ["SESSION_SHARED"] = "1"
+    context = multiprocessing.get_context("spawn")
+
+    def start_worker(index: int):
+        process = context.Process(target=run_worker, args=(index, workers), name=f"bot-worker-{index}")
+        process.start()
+        return process
+
+    migrate_histories()
+
+    if WEBHOOK_URL:
+        asyncio.run(register_webhook(WEBHOOK_URL, WEBHOOK_SECRET))
+        logger.info(f"Webhook зарегистрирован: {WEBHOOK_URL}")
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    processes: List = [start_worker(index) for index in range(workers)]
+    router = None
+    try:
+        RouterHandler.workers = workers
+        router = ThreadingHTTPServer((host, port), RouterHandler)
+        threading.Thread(target=router.serve_forever, name="webhook-router", daemon=True).start()
+        logger.info(f"Роутер слушает http://{host}:{port}{WEBHOOK_PATH}, обработчиков: {workers}")
+
+        while not stop.wait(1):
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.warning(f"Обработчик {index} завершился (код {process.exitcode}), перезапуск")
+                    processes[index] = start_worker(index)
+    finally:
+        if router is not None:
+            router.shutdown()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        logger.info("Роутер остановлен")
+
+
+def main():
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Бот в режиме webhook с несколькими процессами")
+    parser.add_argument("--workers", type=int, default=WEBHOOK_WORKERS, help="число процессов-обработчиков")
+    parser.add_argument("--host", default=WEBHOOK_HOST, help="адрес роутера")
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT, help="порт роутера")
+    args = parser.parse_args()
+
+    serve(workers=args.workers, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()